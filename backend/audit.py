@@ -0,0 +1,267 @@
+# ============================================================
+# UNS VISA SYSTEM - Audit Log
+# Cambios (valores antes/después) de empleados, 派遣先 y usuarios en
+# audit_log. Las entradas se encolan en memoria y un único writer las
+# escribe por lotes con COPY: auditar no añade una escritura a cada petición.
+# ============================================================
+
+from fastapi import APIRouter, Depends, HTTPException
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import logging
+import os
+import time
+
+from auth import require_role
+from database import get_db_pool, get_read_pool
+
+router = APIRouter(prefix="/api/audit", tags=["Audit"])
+
+logger = logging.getLogger(__name__)
+
+# Entradas pendientes como máximo; si el writer no da abasto se descartan (y se cuentan)
+AUDIT_QUEUE_MAX = int(os.getenv("AUDIT_QUEUE_MAX", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+# Espera tras la primera entrada para juntar un lote
+AUDIT_FLUSH_INTERVAL_SECONDS = float(os.getenv("AUDIT_FLUSH_INTERVAL_SECONDS", "1.0"))
+
+AUDITED_TABLES = ("employees", "haken_saki_company", "users")
+AUDIT_COLUMNS = [
+    "table_name", "record_id", "action", "old_values", "new_values",
+    "user_id", "user_name", "ip_address", "created_at",
+]
+# No forman parte del cambio
+IGNORED_FIELDS = {"created_at", "updated_at"}
+# Se registra que cambiaron, nunca su valor
+MASKED_FIELDS = {"password_hash"}
+MASK = "***"
+
+# ============================================================
+# CONTEXTO DE LA PETICIÓN
+# ============================================================
+
+@dataclass
+class Actor:
+    user_id: Optional[int] = None
+    user_name: Optional[str] = None
+    ip_address: Optional[str] = None
+
+
+_actor: ContextVar[Optional[Actor]] = ContextVar("audit_actor", default=None)
+
+
+def set_actor(user_id: Optional[int], user_name: Optional[str], ip_address: Optional[str]):
+    """Lo llama el middleware de main.py; devuelve el token del ContextVar"""
+    return _actor.set(Actor(user_id, user_name, ip_address))
+
+
+def reset_actor(token):
+    _actor.reset(token)
+
+# ============================================================
+# DIFF
+# ============================================================
+
+def _plain(value: Any) -> Any:
+    # Valores que van igual a JSONB que en la respuesta (los dict de un Record compuesto también)
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if hasattr(value, "items"):
+        return {k: _plain(v) for k, v in value.items()}
+    return value
+
+
+def _clean(row: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if row is None:
+        return None
+    return {
+        k: (MASK if k in MASKED_FIELDS and v is not None else _plain(v))
+        for k, v in dict(row).items() if k not in IGNORED_FIELDS
+    }
+
+
+def diff(old: Optional[Dict[str, Any]], new: Optional[Dict[str, Any]]) -> Tuple[Optional[dict], Optional[dict]]:
+    """
+    (old_values, new_values) solo con los campos que cambian. En altas y bajas
+    físicas se guarda la fila completa del lado que existe.
+    """
+    if old is None or new is None:
+        return _clean(old), _clean(new)
+    old_values, new_values = {}, {}
+    for key, new_value in dict(new).items():
+        if key in IGNORED_FIELDS or key not in old:
+            continue
+        if old[key] != new_value:
+            masked = key in MASKED_FIELDS
+            old_values[key] = MASK if masked else _plain(old[key])
+            new_values[key] = MASK if masked else _plain(new_value)
+    return old_values, new_values
+
+
+def split_old(row, column: str = "_old") -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+    """
+    Para UPDATE ... FROM tabla old ... RETURNING t.*, old AS _old: separa la fila
+    nueva de la anterior (Record compuesto del mismo tipo de tabla)
+    """
+    new = dict(row)
+    old = new.pop(column, None)
+    return new, (dict(old.items()) if old is not None else None)
+
+# ============================================================
+# COLA Y WRITER
+# ============================================================
+
+_queue: Optional[asyncio.Queue] = None
+# Se activa al encolar: el writer espera sin sacar nada de la cola, así una
+# cancelación mientras espera no pierde entradas
+_pending: Optional[asyncio.Event] = None
+_writer_task: Optional[asyncio.Task] = None
+_inflight: Optional[asyncio.Future] = None
+_stats = {"queued": 0, "written": 0, "dropped": 0, "failed": 0, "batches": 0, "last_flush_ms": None}
+_last_drop_warning = 0.0
+
+
+def _get_queue() -> asyncio.Queue:
+    global _queue, _pending
+    if _queue is None:
+        _queue = asyncio.Queue(maxsize=AUDIT_QUEUE_MAX)
+        _pending = asyncio.Event()
+    return _queue
+
+
+def record(table_name: str, record_id: Optional[int], action: str,
+           old: Optional[Dict[str, Any]] = None, new: Optional[Dict[str, Any]] = None):
+    """
+    Encola un cambio (INSERT, UPDATE o DELETE). No espera a la BD y nunca lanza:
+    un fallo al auditar no debe romper la petición. Los UPDATE sin cambios no se registran.
+    """
+    global _last_drop_warning
+    old_values, new_values = diff(old, new)
+    if action == "UPDATE" and not new_values:
+        return
+    actor = _actor.get() or Actor()
+    entry = (
+        table_name, record_id, action, old_values, new_values,
+        actor.user_id, actor.user_name, actor.ip_address, datetime.now(),
+    )
+    try:
+        _get_queue().put_nowait(entry)
+        _pending.set()
+        _stats["queued"] += 1
+    except asyncio.QueueFull:
+        _stats["dropped"] += 1
+        if time.monotonic() - _last_drop_warning > 60:
+            _last_drop_warning = time.monotonic()
+            logger.warning("Cola de auditoría llena (%d): descartando entradas (%d en total)",
+                           AUDIT_QUEUE_MAX, _stats["dropped"])
+
+
+def _drain(limit: int) -> List[tuple]:
+    queue = _get_queue()
+    batch = []
+    while len(batch) < limit and not queue.empty():
+        batch.append(queue.get_nowait())
+    if queue.empty():
+        _pending.clear()
+    return batch
+
+
+async def _flush(batch: List[tuple]):
+    started = time.perf_counter()
+    try:
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            await conn.copy_records_to_table("audit_log", records=batch, columns=AUDIT_COLUMNS)
+    except Exception as e:
+        _stats["failed"] += len(batch)
+        logger.error("No se pudieron escribir %d entradas de auditoría: %s", len(batch), e)
+        return
+    _stats["written"] += len(batch)
+    _stats["batches"] += 1
+    _stats["last_flush_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+
+async def _writer():
+    global _inflight
+    _get_queue()
+    while True:
+        await _pending.wait()
+        # Juntar lo que llegue durante el intervalo en un solo COPY
+        await asyncio.sleep(AUDIT_FLUSH_INTERVAL_SECONDS)
+        while not _get_queue().empty():
+            # shield: si se cancela el writer, el COPY en curso termina igualmente
+            _inflight = asyncio.ensure_future(_flush(_drain(AUDIT_BATCH_SIZE)))
+            await asyncio.shield(_inflight)
+            _inflight = None
+
+
+async def start_audit_writer():
+    global _writer_task
+    if _writer_task is None or _writer_task.done():
+        _writer_task = asyncio.create_task(_writer())
+
+
+async def stop_audit_writer():
+    """Detiene el writer y escribe lo pendiente (llamar antes de cerrar el pool)"""
+    global _writer_task
+    if _writer_task is not None:
+        _writer_task.cancel()
+        try:
+            await _writer_task
+        except asyncio.CancelledError:
+            pass
+        _writer_task = None
+    if _inflight is not None:
+        await _inflight
+    while True:
+        batch = _drain(AUDIT_BATCH_SIZE)
+        if not batch:
+            break
+        await _flush(batch)
+
+
+def get_audit_stats() -> Dict[str, Any]:
+    return {
+        **_stats,
+        "pending": _queue.qsize() if _queue is not None else 0,
+        "queue_max": AUDIT_QUEUE_MAX,
+        "writer_running": _writer_task is not None and not _writer_task.done(),
+    }
+
+# ============================================================
+# ENDPOINTS
+# ============================================================
+
+@router.get("/stats")
+async def audit_stats(current_user=Depends(require_role(["admin"]))):
+    """監査ログの書き込み状況 - Audit writer counters of this worker"""
+    return get_audit_stats()
+
+
+@router.get("/{table_name}/{record_id}")
+async def get_record_history(table_name: str, record_id: int, limit: int = 50,
+                             before: Optional[datetime] = None,
+                             current_user=Depends(require_role(["admin"]))):
+    """
+    変更履歴 - Change history of one record, newest first
+    (idx_audit_log_record; paginar con before = created_at del último)
+    """
+    if table_name not in AUDITED_TABLES:
+        raise HTTPException(400, f"table_name: {', '.join(AUDITED_TABLES)}")
+    pool = await get_read_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT id, action, old_values, new_values, user_id, user_name, ip_address, created_at
+            FROM audit_log
+            WHERE table_name = $1 AND record_id = $2
+            AND ($3::timestamp IS NULL OR created_at < $3)
+            ORDER BY created_at DESC
+            LIMIT $4
+        """, table_name, record_id, before, min(limit, 200))
+    return [dict(r) for r in rows]
@@ -9,8 +9,13 @@ from pydantic import BaseModel, EmailStr
 from typing import Optional
 from datetime import datetime, timedelta
 from passlib.context import CryptContext
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import jwt
 import os
+import threading
+import time
+import queries
 
 router = APIRouter(prefix="/api/auth", tags=["Authentication"])
 
@@ -22,6 +27,10 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 480  # 8 horas
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt (~250ms de CPU) corre en un pool de threads acotado para no bloquear el event loop
+AUTH_HASH_CONCURRENCY = int(os.getenv("AUTH_HASH_CONCURRENCY", "4"))
+_hash_executor = ThreadPoolExecutor(max_workers=AUTH_HASH_CONCURRENCY, thread_name_prefix="bcrypt")
+
 # Pre-generated hashes to avoid runtime issues
 PRE_GENERATED_HASHES = {
     "admin123": "$2b$12$LQv3c1yqBWVHxkd0LHAkCOYz6TtxMQJqhN8/LewdBPj/RK.s5uO9G",
@@ -45,6 +54,7 @@ class TokenData(BaseModel):
     username: Optional[str] = None
     user_id: Optional[int] = None
     role: Optional[str] = None
+    token_version: int = 0
 
 class UserCreate(BaseModel):
     username: str
@@ -70,6 +80,9 @@ class PasswordChange(BaseModel):
     current_password: str
     new_password: str
 
+class RoleUpdate(BaseModel):
+    role: str
+
 # ============================================================
 # HELPER FUNCTIONS
 # ============================================================
@@ -82,6 +95,65 @@ def get_password_hash(password: str) -> str:
     """Hash de password"""
     return pwd_context.hash(password)
 
+_hash_metrics_lock = threading.Lock()
+_hash_metrics = {
+    op: {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "total_wait_ms": 0.0, "max_wait_ms": 0.0}
+    for op in ("verify", "hash")
+}
+_hash_in_flight = 0
+
+def _record_hash_timing(op: str, wait_ms: float, run_ms: float):
+    with _hash_metrics_lock:
+        m = _hash_metrics[op]
+        m["count"] += 1
+        m["total_ms"] += run_ms
+        m["max_ms"] = max(m["max_ms"], run_ms)
+        m["total_wait_ms"] += wait_ms
+        m["max_wait_ms"] = max(m["max_wait_ms"], wait_ms)
+
+async def _run_in_hash_pool(op: str, fn, *args):
+    """Ejecuta fn en el pool de bcrypt midiendo espera en cola y tiempo de CPU"""
+    global _hash_in_flight
+    queued = time.perf_counter()
+
+    def timed():
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            finished = time.perf_counter()
+            _record_hash_timing(op, (started - queued) * 1000, (finished - started) * 1000)
+
+    _hash_in_flight += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, timed)
+    finally:
+        _hash_in_flight -= 1
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Verificar password sin bloquear el event loop"""
+    return await _run_in_hash_pool("verify", verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """Hash de password sin bloquear el event loop"""
+    return await _run_in_hash_pool("hash", get_password_hash, password)
+
+def get_hash_metrics() -> dict:
+    """Métricas del pool de bcrypt"""
+    with _hash_metrics_lock:
+        ops = {}
+        for op, m in _hash_metrics.items():
+            ops[op] = {
+                **{k: round(v, 1) if isinstance(v, float) else v for k, v in m.items()},
+                "avg_ms": round(m["total_ms"] / m["count"], 1) if m["count"] else None,
+                "avg_wait_ms": round(m["total_wait_ms"] / m["count"], 1) if m["count"] else None,
+            }
+    return {
+        "concurrency": AUTH_HASH_CONCURRENCY,
+        "in_flight": _hash_in_flight,
+        "operations": ops,
+    }
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Crear token JWT"""
     to_encode = data.copy()
@@ -103,6 +175,7 @@ def decode_token(token: str) -> TokenData:
         username: str = payload.get("sub")
         user_id: int = payload.get("user_id")
         role: str = payload.get("role")
+        token_version: int = payload.get("ver", 0)
         
         if username is None:
             raise HTTPException(
@@ -111,7 +184,7 @@ def decode_token(token: str) -> TokenData:
                 headers={"WWW-Authenticate": "Bearer"},
             )
         
-        return TokenData(username=username, user_id=user_id, role=role)
+        return TokenData(username=username, user_id=user_id, role=role, token_version=token_version)
     
     except jwt.ExpiredSignatureError:
         raise HTTPException(
@@ -130,14 +203,98 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> TokenData:
     """Obtener usuario actual desde token"""
     return decode_token(token)
 
+# Estado de usuario (activo, rol, versión de token) cacheado por user_id.
+# Con varios workers la invalidación es local: el TTL acota el desfase entre procesos.
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+
+class UserStateCache:
+    """Caché TTL de users(is_active, role, token_version) para no consultar la BD en cada petición"""
+
+    def __init__(self, ttl_seconds: int = USER_CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._entries = {}
+        self._loading = {}
+        # Se incrementa en invalidate(): una carga empezada antes no guarda su resultado
+        self._generations = {}
+
+    async def get(self, user_id: int) -> Optional[dict]:
+        entry = self._entries.get(user_id)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+
+        # Un solo SELECT aunque lleguen varias peticiones a la vez
+        loading = self._loading.get(user_id)
+        if loading is None:
+            loading = asyncio.ensure_future(self._load(user_id, self._generations.get(user_id, 0)))
+            self._loading[user_id] = loading
+            loading.add_done_callback(lambda done: self._forget_load(user_id, done))
+        return await asyncio.shield(loading)
+
+    async def _load(self, user_id: int, generation: int) -> Optional[dict]:
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            row = await queries.fetchrow(conn, "user_state", user_id)
+        state = dict(row) if row else None
+        # Si se invalidó mientras tanto, la fila puede ser anterior al cambio: no se guarda
+        if self._generations.get(user_id, 0) == generation:
+            self._entries[user_id] = (time.monotonic() + self.ttl_seconds, state)
+        return state
+
+    def _forget_load(self, user_id: int, loading: asyncio.Future):
+        # Solo la propia carga: tras un invalidate() puede haber ya otra en curso
+        if self._loading.get(user_id) is loading:
+            del self._loading[user_id]
+
+    def invalidate(self, user_id: int):
+        self._generations[user_id] = self._generations.get(user_id, 0) + 1
+        self._entries.pop(user_id, None)
+        # Las peticiones siguientes no se unen a una carga empezada antes del cambio
+        self._loading.pop(user_id, None)
+
+user_state_cache = UserStateCache()
+
+async def revoke_user_tokens(conn, user_id: int) -> Optional[int]:
+    """
+    Invalida todos los tokens emitidos al usuario (incrementa token_version).
+    Dentro de una transacción, llamar también a user_state_cache.invalidate() tras el commit
+    """
+    new_version = await conn.fetchval(
+        "UPDATE users SET token_version = token_version + 1 WHERE id = $1 RETURNING token_version",
+        user_id
+    )
+    user_state_cache.invalidate(user_id)
+    return new_version
+
 async def get_current_active_user(current_user: TokenData = Depends(get_current_user)) -> TokenData:
-    """Verificar que el usuario esté activo"""
-    # Aquí podrías verificar en la base de datos si el usuario está activo
+    """Verificar que el usuario esté activo y que el token no haya sido revocado"""
+    state = await user_state_cache.get(current_user.user_id) if current_user.user_id else None
+
+    if not state or not state["is_active"]:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="アカウントが無効です",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    if current_user.token_version != state["token_version"]:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="トークンが無効です",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    # El rol vigente es el de la BD, no el del token
+    current_user.role = state["role"]
     return current_user
 
+def _audit(*args, **kwargs):
+    # Import diferido: audit.py importa require_role de este módulo
+    from audit import record
+    record(*args, **kwargs)
+
 def require_role(allowed_roles: list):
     """Decorator para requerir roles específicos"""
-    async def role_checker(current_user: TokenData = Depends(get_current_user)):
+    async def role_checker(current_user: TokenData = Depends(get_current_active_user)):
         if current_user.role not in allowed_roles:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
@@ -163,10 +320,7 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     """
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        user = await conn.fetchrow(
-            "SELECT * FROM users WHERE username = $1", 
-            form_data.username
-        )
+        user = await queries.fetchrow(conn, "user_by_username", form_data.username)
     
     if not user:
         raise HTTPException(
@@ -176,7 +330,7 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
         )
     
     # Verify password
-    if not verify_password(form_data.password, user["password_hash"]):
+    if not await verify_password_async(form_data.password, user["password_hash"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="ユーザー名またはパスワードが正しくありません",
@@ -195,7 +349,8 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
         data={
             "sub": user["username"],
             "user_id": user["id"],
-            "role": user["role"]
+            "role": user["role"],
+            "ver": user["token_version"]
         },
         expires_delta=access_token_expires
     )
@@ -214,7 +369,7 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     }
 
 @router.get("/me", response_model=dict)
-async def get_current_user_info(current_user: TokenData = Depends(get_current_user)):
+async def get_current_user_info(current_user: TokenData = Depends(get_current_active_user)):
     """
     現在のユーザー情報 - Current user info
     """
@@ -225,20 +380,24 @@ async def get_current_user_info(current_user: TokenData = Depends(get_current_us
     }
 
 @router.post("/logout")
-async def logout(current_user: TokenData = Depends(get_current_user)):
+async def logout(current_user: TokenData = Depends(get_current_active_user)):
     """
     ログアウト - Logout
     
-    En JWT stateless, el logout se maneja en el cliente
-    eliminando el token almacenado
+    Incrementa token_version: todos los tokens emitidos a este usuario
+    dejan de ser válidos (en todas las sesiones)
     """
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        await revoke_user_tokens(conn, current_user.user_id)
+
     return {
         "message": "ログアウトしました",
         "detail": "トークンをクライアント側で削除してください"
     }
 
 @router.post("/refresh")
-async def refresh_token(current_user: TokenData = Depends(get_current_user)):
+async def refresh_token(current_user: TokenData = Depends(get_current_active_user)):
     """
     トークン更新 - Refresh token
     """
@@ -247,7 +406,8 @@ async def refresh_token(current_user: TokenData = Depends(get_current_user)):
         data={
             "sub": current_user.username,
             "user_id": current_user.user_id,
-            "role": current_user.role
+            "role": current_user.role,
+            "ver": current_user.token_version
         },
         expires_delta=access_token_expires
     )
@@ -261,7 +421,7 @@ async def refresh_token(current_user: TokenData = Depends(get_current_user)):
 @router.post("/change-password")
 async def change_password(
     password_data: PasswordChange,
-    current_user: TokenData = Depends(get_current_user)
+    current_user: TokenData = Depends(get_current_active_user)
 ):
     """
     パスワード変更 - Change password
@@ -269,34 +429,54 @@ async def change_password(
     pool = await get_db_pool()
     async with pool.acquire() as conn:
         # Get current user from database
-        user = await conn.fetchrow(
-            "SELECT * FROM users WHERE id = $1",
-            current_user.user_id
+        user = await queries.fetchrow(conn, "user_by_id", current_user.user_id)
+
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="ユーザーが見つかりません"
         )
 
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="ユーザーが見つかりません"
-            )
+    # bcrypt fuera de la conexión: no retener el pool ~500ms
+    if not await verify_password_async(password_data.current_password, user["password_hash"]):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="現在のパスワードが正しくありません"
+        )
 
-        # Verify current password
-        if not verify_password(password_data.current_password, user["password_hash"]):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="現在のパスワードが正しくありません"
+    new_password_hash = await get_password_hash_async(password_data.new_password)
+
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                "UPDATE users SET password_hash = $1 WHERE id = $2",
+                new_password_hash,
+                current_user.user_id
             )
+            # Cerrar las demás sesiones
+            new_version = await revoke_user_tokens(conn, current_user.user_id)
+    # Una carga entre el invalidate() y el commit habría leído la versión anterior
+    user_state_cache.invalidate(current_user.user_id)
 
-        # Hash new password and update
-        new_password_hash = get_password_hash(password_data.new_password)
-        await conn.execute(
-            "UPDATE users SET password_hash = $1 WHERE id = $2",
-            new_password_hash,
-            current_user.user_id
-        )
+    _audit("users", current_user.user_id, "UPDATE",
+           {"password_hash": user["password_hash"]}, {"password_hash": new_password_hash})
+
+    # Token nuevo para la sesión actual
+    access_token = create_access_token(
+        data={
+            "sub": current_user.username,
+            "user_id": current_user.user_id,
+            "role": current_user.role,
+            "ver": new_version
+        },
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
 
     return {
-        "message": "パスワードが変更されました"
+        "message": "パスワードが変更されました",
+        "access_token": access_token,
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60
     }
 
 # ============================================================
@@ -308,7 +488,7 @@ async def create_user(user: UserCreate):
     """
     ユーザー作成 - Create user (Admin only)
     """
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash_async(user.password)
 
     pool = await get_db_pool()
     async with pool.acquire() as conn:
@@ -350,6 +530,8 @@ async def create_user(user: UserCreate):
             user.role
         )
 
+    _audit("users", new_user["id"], "INSERT", new=dict(new_user))
+
     return {
         "message": "ユーザーが作成されました",
         "user": {
@@ -392,7 +574,7 @@ async def list_users():
     ]
 
 @router.delete("/users/{user_id}", dependencies=[Depends(require_role(["admin"]))])
-async def delete_user(user_id: int, current_user: TokenData = Depends(get_current_user)):
+async def delete_user(user_id: int, current_user: TokenData = Depends(get_current_active_user)):
     """
     ユーザー削除 - Delete user (Admin only)
     """
@@ -407,7 +589,7 @@ async def delete_user(user_id: int, current_user: TokenData = Depends(get_curren
     async with pool.acquire() as conn:
         # Check if user exists
         user = await conn.fetchrow(
-            "SELECT id, username FROM users WHERE id = $1",
+            "SELECT id, username, is_active FROM users WHERE id = $1",
             user_id
         )
 
@@ -418,12 +600,65 @@ async def delete_user(user_id: int, current_user: TokenData = Depends(get_curren
             )
 
         # Soft delete - set is_active to false instead of deleting
-        await conn.execute(
-            "UPDATE users SET is_active = false WHERE id = $1",
-            user_id
-        )
+        async with conn.transaction():
+            await conn.execute(
+                "UPDATE users SET is_active = false WHERE id = $1",
+                user_id
+            )
+            await revoke_user_tokens(conn, user_id)
+        user_state_cache.invalidate(user_id)
+
+    _audit("users", user_id, "DELETE", {"is_active": user["is_active"]}, {"is_active": False})
 
     return {
         "message": f"ユーザー {user['username']} が削除されました",
         "user_id": user_id
     }
+
+@router.put("/users/{user_id}/role", dependencies=[Depends(require_role(["admin"]))])
+async def update_user_role(user_id: int, role_data: RoleUpdate, current_user: TokenData = Depends(get_current_active_user)):
+    """
+    ユーザー権限変更 - Change user role (Admin only)
+    """
+    if user_id == current_user.user_id:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="自分自身の権限は変更できません"
+        )
+
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        user = await conn.fetchrow(
+            """
+            UPDATE users SET role = $1
+            FROM users old
+            WHERE users.id = $2 AND old.id = users.id
+            RETURNING users.id, users.username, users.role, old.role AS old_role
+            """,
+            role_data.role,
+            user_id
+        )
+
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="ユーザーが見つかりません"
+        )
+
+    user = dict(user)
+    _audit("users", user_id, "UPDATE", {"role": user.pop("old_role")}, {"role": user["role"]})
+
+    # El nuevo rol aplica en la siguiente petición (sin esperar al TTL)
+    user_state_cache.invalidate(user_id)
+
+    return {
+        "message": f"ユーザー {user['username']} の権限を変更しました",
+        "user": user
+    }
+
+@router.get("/hash-metrics", dependencies=[Depends(require_role(["admin"]))])
+async def hash_metrics():
+    """
+    パスワードハッシュの統計 - bcrypt thread pool metrics (Admin only)
+    """
+    return get_hash_metrics()
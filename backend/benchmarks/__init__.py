@@ -0,0 +1,10 @@
+"""
+Benchmarks del backend UNS Visa (ejecutar desde backend/):
+
+  python -m benchmarks.seed --scale 10k              # datos sintéticos en Postgres local
+  python -m benchmarks.load --base-url http://localhost:8000
+  python -m benchmarks.micro
+
+Cada script escribe un JSON en benchmarks/results/ (o --output) y acepta
+--compare <json anterior> para ver la diferencia entre commits.
+"""
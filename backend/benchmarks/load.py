@@ -0,0 +1,144 @@
+"""
+Prueba de carga HTTP contra un API en marcha (datos de benchmarks.seed).
+Ejemplo (desde backend/):
+  python -m benchmarks.load --base-url http://localhost:8000 --requests 500 --concurrency 20
+  python -m benchmarks.load --scenarios list,alerts --compare benchmarks/results/load-....json
+
+Mide throughput y p50/p95/p99 por escenario: list, search, get_by_card,
+stats, alerts, export y login.
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from benchmarks.common import compare, summarize, write_results
+
+SEARCH_TERMS = ["工業", "製作所", "精工", "株式会社", "中部", "三河"]
+
+
+class LoadContext:
+    """Datos de muestra (ids, tarjetas) y token compartidos por los escenarios"""
+
+    def __init__(self, client: httpx.AsyncClient, username: str, password: str, rng: random.Random):
+        self.client = client
+        self.username = username
+        self.password = password
+        self.rng = rng
+        self.token: Optional[str] = None
+        self.employee_ids: List[int] = []
+        self.cards: List[str] = []
+
+    async def prepare(self):
+        response = await self.login()
+        response.raise_for_status()
+        self.token = response.json()["access_token"]
+
+        response = await self.client.get("/api/employees", params={"limit": 500})
+        response.raise_for_status()
+        employees = response.json()
+        self.employee_ids = [e["id"] for e in employees]
+        self.cards = [e["residence_card_number"] for e in employees if e.get("residence_card_number")]
+        if not self.employee_ids:
+            raise SystemExit("No hay empleados: ejecute antes python -m benchmarks.seed")
+
+    def login(self) -> Awaitable[httpx.Response]:
+        return self.client.post("/api/auth/login",
+                                data={"username": self.username, "password": self.password})
+
+    @property
+    def auth_headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.token}"} if self.token else {}
+
+
+Scenario = Callable[[LoadContext], Awaitable[httpx.Response]]
+
+SCENARIOS: Dict[str, Scenario] = {
+    "list": lambda ctx: ctx.client.get("/api/employees", params={
+        "limit": 100, "skip": ctx.rng.randint(0, max(0, len(ctx.employee_ids) - 100))}),
+    "search": lambda ctx: ctx.client.get("/api/haken-saki/search/by-name", params={
+        "name": ctx.rng.choice(SEARCH_TERMS)}),
+    "get_by_card": lambda ctx: ctx.client.get(f"/api/employees/card/{ctx.rng.choice(ctx.cards)}"),
+    "stats": lambda ctx: ctx.client.get("/api/stats"),
+    "alerts": lambda ctx: ctx.client.get("/api/alerts/expiring", params={"days": 90}),
+    "export": lambda ctx: ctx.client.get(
+        f"/api/export/visa-renewal/{ctx.rng.choice(ctx.employee_ids)}", headers=ctx.auth_headers),
+    "login": lambda ctx: ctx.login(),
+}
+
+
+async def run_scenario(ctx: LoadContext, name: str, requests: int, concurrency: int) -> Dict[str, Any]:
+    scenario = SCENARIOS[name]
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await scenario(ctx)
+                await response.aread()
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - started
+        statuses[status] = statuses.get(status, 0) + 1
+        if status.isdigit() and int(status) < 400:
+            latencies.append(elapsed)
+        else:
+            errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    wall = time.perf_counter() - started
+    return {**summarize(latencies, wall, errors), "statuses": statuses}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga del API UNS Visa.")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--requests", type=int, default=200, help="Peticiones por escenario")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Lista separada por comas")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="admin123")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--warmup", type=int, default=10, help="Peticiones de calentamiento por escenario")
+    parser.add_argument("--output", default=None, help="Ruta del JSON de resultados")
+    parser.add_argument("--compare", default=None, help="JSON anterior con el que comparar p95")
+    args = parser.parse_args()
+
+    names = [n.strip() for n in args.scenarios.split(",") if n.strip()]
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"Escenarios desconocidos: {unknown} (disponibles: {', '.join(SCENARIOS)})")
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=60, limits=limits) as client:
+        ctx = LoadContext(client, args.username, args.password, random.Random(args.seed))
+        await ctx.prepare()
+
+        results: Dict[str, Any] = {}
+        for name in names:
+            if args.warmup:
+                await run_scenario(ctx, name, args.warmup, args.concurrency)
+            results[name] = run = await run_scenario(ctx, name, args.requests, args.concurrency)
+            print(f"{name:<12} {run['throughput_per_s']!s:>8} req/s  p50 {run['p50_ms']!s:>9} ms  "
+                  f"p95 {run['p95_ms']!s:>9} ms  p99 {run['p99_ms']!s:>9} ms  errores {run['errors']}")
+
+    results["_config"] = {"base_url": args.base_url, "requests": args.requests,
+                          "concurrency": args.concurrency, "employees_sampled": len(ctx.employee_ids)}
+    print(f"Resultados: {write_results('load', results, args.output)}")
+    if args.compare and compare(results, args.compare):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
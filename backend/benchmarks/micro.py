@@ -0,0 +1,163 @@
+"""
+Micro-benchmarks sin base de datos ni servidor.
+Ejemplo (desde backend/):
+  python -m benchmarks.micro
+  python -m benchmarks.micro --only excel --iterations 50 --compare benchmarks/results/micro-....json
+
+Casos: VisaFormExcelGenerator.generate_renewal_form, import_sync.normalize_employee_row
+(requiere pandas) y Validators.
+"""
+
+import argparse
+import time
+from datetime import date
+from typing import Any, Callable, Dict, List, Optional
+
+from benchmarks.common import compare, summarize, write_results
+from validators import Validators
+
+# Mismos datos que el ejemplo de excel_generator.py
+SAMPLE_FORM = {
+    "submission_office": "名古屋",
+    "nationality": "ベトナム",
+    "date_of_birth": date(1990, 5, 15),
+    "family_name": "NGUYEN",
+    "given_name": "VAN MINH",
+    "sex": "male",
+    "marital_status": "single",
+    "occupation": "会社員",
+    "home_town_city": "ホーチミン市",
+    "address_japan": "愛知県名古屋市中区栄1-1-1",
+    "telephone_japan": "052-123-4567",
+    "cellular_phone": "090-1234-5678",
+    "passport_number": "B12345678",
+    "passport_expiration": date(2030, 1, 15),
+    "current_visa_status": "技術・人文知識・国際業務",
+    "current_period_of_stay": "3年",
+    "current_expiration_date": date(2025, 4, 1),
+    "residence_card_number": "AB12345678CD",
+    "desired_visa_status": "技術・人文知識・国際業務",
+    "desired_period": "5年",
+    "reason_for_extension": "引き続き日本で就労するため",
+    "school_name": "ハノイ工科大学",
+    "graduation_date": date(2015, 3, 31),
+    "major_field": "情報工学",
+    "company_name": "株式会社UNS",
+    "company_address": "愛知県春日井市○○町1-2-3",
+    "company_telephone": "0568-00-0000",
+    "employer_name": "株式会社UNS",
+    "corporation_number": "1234567890123",
+    "capital": 10000000,
+    "annual_sales": 100000000,
+    "employee_count": 50,
+    "foreign_employee_count": 30,
+    "salary": 300000,
+    "salary_type": "monthly",
+    "position": "正社員",
+    "activity_details": "システム開発業務",
+}
+
+# Una fila de la hoja DBGenzaiX
+SAMPLE_LEDGER_ROW = {
+    "現在": "在職中",
+    "社員№": "200101",
+    "氏名": "NGUYEN VAN MINH",
+    "性別": "男",
+    "国籍": "ベトナム",
+    "生年月日": "1990-05-15",
+    "ビザ期限": "2026-04-01",
+    "ビザ種類": "技術・人文知識・国際業務",
+    "〒": "460-0008",
+    "住所": "愛知県名古屋市中区栄1-1-1",
+    "ｱﾊﾟｰﾄ": "栄ハイツ101",
+    "入社日": "2020-04-01",
+    "退社日": None,
+}
+
+
+def _validators_case() -> Callable[[], Any]:
+    cards = ["AB12345678CD", "ab12345678cd", "A1234567890B", ""]
+    def run():
+        for card in cards:
+            Validators.residence_card(card)
+        Validators.corporation_number("1234567890123")
+        Validators.insurance_number("12345678901")
+        Validators.phone_japan("090-1234-5678")
+        Validators.postal_code("460-0008")
+        Validators.visa_status(date(2026, 4, 1))
+    return run
+
+
+def _excel_case() -> Optional[Callable[[], Any]]:
+    try:
+        from excel_generator import VisaFormExcelGenerator
+    except ImportError:
+        return None
+    generator = VisaFormExcelGenerator()
+    return lambda: generator.generate_renewal_form(SAMPLE_FORM)
+
+
+def _normalize_case() -> Optional[Callable[[], Any]]:
+    try:
+        import pandas as pd
+        from import_sync import normalize_employee_row
+    except ImportError:
+        return None
+    row = pd.Series(SAMPLE_LEDGER_ROW)
+    return lambda: normalize_employee_row(row)
+
+
+CASES: Dict[str, Callable[[], Optional[Callable[[], Any]]]] = {
+    "excel_generate_renewal_form": _excel_case,
+    "import_normalize_employee_row": _normalize_case,
+    "validators_batch": _validators_case,
+}
+DEFAULT_ITERATIONS = {
+    "excel_generate_renewal_form": 30,
+    "import_normalize_employee_row": 2_000,
+    "validators_batch": 20_000,
+}
+
+
+def bench(func: Callable[[], Any], iterations: int, warmup: int) -> Dict[str, Any]:
+    for _ in range(warmup):
+        func()
+    latencies: List[float] = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - t0)
+    return {**summarize(latencies, time.perf_counter() - started), "iterations": iterations}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks del backend UNS Visa.")
+    parser.add_argument("--only", default=None, help="Subcadena del nombre del caso")
+    parser.add_argument("--iterations", type=int, default=None, help="Override de iteraciones por caso")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--output", default=None, help="Ruta del JSON de resultados")
+    parser.add_argument("--compare", default=None, help="JSON anterior con el que comparar p95")
+    args = parser.parse_args()
+
+    results: Dict[str, Any] = {}
+    for name, factory in CASES.items():
+        if args.only and args.only not in name:
+            continue
+        func = factory()
+        if func is None:
+            print(f"{name:<32} omitido (falta una dependencia)")
+            results[name] = {"skipped": True}
+            continue
+        run = bench(func, args.iterations or DEFAULT_ITERATIONS[name], args.warmup)
+        results[name] = run
+        print(f"{name:<32} {run['throughput_per_s']!s:>10} ops/s  p50 {run['p50_ms']!s:>8} ms  "
+              f"p95 {run['p95_ms']!s:>8} ms  p99 {run['p99_ms']!s:>8} ms")
+
+    print(f"Resultados: {write_results('micro', results, args.output)}")
+    if args.compare and compare(results, args.compare):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Carga datos sintéticos para benchmarks en una base PostgreSQL local.
+Ejemplo (desde backend/):
+  python -m benchmarks.seed --scale 10k --reset
+  python -m benchmarks.seed --scale 100k --db-url postgresql://postgres:pw@localhost:5433/uns_visa
+
+Las filas salen de benchmarks.synthetic (misma semilla -> mismos datos).
+Las filas sembradas llevan notes = 'benchmark-seed' y --reset solo borra esas.
+"""
+
+import argparse
+import asyncio
+import time
+from datetime import date
+from typing import Any, Dict, Iterator, List, Tuple
+
+import asyncpg
+
+from database import get_db_url
+from benchmarks import synthetic
+from benchmarks.common import parse_scale, redact_dsn, write_results
+
+SEED_MARK = "benchmark-seed"
+BATCH_SIZE = 5_000
+
+EMPLOYEE_COLUMNS = [
+    "employee_code", "family_name", "given_name", "nationality", "date_of_birth", "sex",
+    "postal_code_japan", "address_japan", "cellular_phone", "passport_number", "passport_expiration",
+    "current_visa_status", "current_period_of_stay", "current_expiration_date",
+    "residence_card_number", "hire_date", "termination_date", "employment_status",
+]
+HAKEN_SAKI_COLUMNS = [
+    "company_name", "branch_name", "corporation_number", "employment_insurance_number",
+    "postal_code", "prefecture", "full_address", "telephone", "contact_person",
+    "business_type_name", "is_active",
+]
+
+
+def _employee(i: int, seed_value: int, today: date) -> Tuple:
+    emp = synthetic.employee(i, seed_value, today)
+    return (*(emp[c] for c in EMPLOYEE_COLUMNS), SEED_MARK)
+
+
+def _haken_saki(i: int, seed_value: int) -> Tuple:
+    # Mismo mapeo que import_sync.normalize_factory (sin pandas)
+    factory = synthetic.factory(i, seed_value)
+    client, plant = factory["client_company"], factory["plant"]
+    address = plant["address"] or client["address"]
+    return (
+        client["name"],
+        plant["name"],
+        client["corporation_number"],
+        client["employment_insurance_number"],
+        plant["postal_code"],
+        address[:3],
+        address,
+        plant["phone"] or client["phone"],
+        client["responsible_person"]["name"],
+        "製造業",
+        True,
+        SEED_MARK,
+    )
+
+
+def _batches(rows: Iterator[Tuple], size: int) -> Iterator[List[Tuple]]:
+    batch: List[Tuple] = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def reset(conn: asyncpg.Connection):
+    # employment_contracts / dispatch_assignments caen en cascada con employees
+    await conn.execute("""
+        DELETE FROM dispatch_assignments
+        WHERE haken_saki_id IN (SELECT id FROM haken_saki_company WHERE notes = $1)
+    """, SEED_MARK)
+    await conn.execute("DELETE FROM employees WHERE notes = $1", SEED_MARK)
+    await conn.execute("DELETE FROM haken_saki_company WHERE notes = $1", SEED_MARK)
+
+
+async def seed(db_url: str, employees: int, seed_value: int, do_reset: bool) -> Dict[str, Any]:
+    today = date.today()
+    timings: Dict[str, Any] = {}
+    conn = await asyncpg.connect(db_url)
+    try:
+        if do_reset:
+            started = time.perf_counter()
+            await reset(conn)
+            timings["reset_s"] = round(time.perf_counter() - started, 2)
+
+        companies = max(10, employees // 25)
+        started = time.perf_counter()
+        await conn.copy_records_to_table(
+            "haken_saki_company", columns=HAKEN_SAKI_COLUMNS + ["notes"],
+            records=[_haken_saki(i, seed_value) for i in range(companies)],
+        )
+        timings["haken_saki_s"] = round(time.perf_counter() - started, 2)
+
+        started = time.perf_counter()
+        # Sin --reset se continúa tras los índices ya sembrados (código y tarjeta únicos)
+        offset = await conn.fetchval("SELECT COUNT(*) FROM employees WHERE notes = $1", SEED_MARK)
+        rows = (_employee(offset + i, seed_value, today) for i in range(employees))
+        for batch in _batches(rows, BATCH_SIZE):
+            await conn.copy_records_to_table("employees", columns=EMPLOYEE_COLUMNS + ["notes"], records=batch)
+        timings["employees_s"] = round(time.perf_counter() - started, 2)
+
+        started = time.perf_counter()
+        await conn.execute("""
+            INSERT INTO employment_contracts (
+                employee_id, haken_moto_id, contract_number, contract_type, employment_type,
+                contract_start_date, salary_amount, salary_type, position_title, contract_status
+            )
+            SELECT e.id, (SELECT id FROM haken_moto_company ORDER BY id LIMIT 1),
+                   'BN-C-' || e.id, 'fixed', 'dispatch', e.hire_date,
+                   200000 + (e.id % 15) * 10000, 'monthly', '製造スタッフ',
+                   CASE WHEN e.employment_status = 'active' THEN 'active' ELSE 'ended' END
+            FROM employees e
+            WHERE e.notes = $1
+            AND NOT EXISTS (SELECT 1 FROM employment_contracts c WHERE c.employee_id = e.id)
+        """, SEED_MARK)
+        await conn.execute("""
+            WITH hs AS (
+                SELECT id, ROW_NUMBER() OVER (ORDER BY id) - 1 AS rn, COUNT(*) OVER () AS n
+                FROM haken_saki_company WHERE notes = $1
+            )
+            INSERT INTO dispatch_assignments (
+                employee_id, employment_contract_id, haken_saki_id, dispatch_start_date,
+                job_title, assignment_status
+            )
+            SELECT c.employee_id, c.id, hs.id, c.contract_start_date, '製造ライン作業',
+                   CASE WHEN c.contract_status = 'active' THEN 'active' ELSE 'ended' END
+            FROM employment_contracts c
+            JOIN employees e ON e.id = c.employee_id AND e.notes = $1
+            JOIN hs ON hs.rn = c.employee_id % hs.n
+            WHERE NOT EXISTS (SELECT 1 FROM dispatch_assignments d WHERE d.employee_id = c.employee_id)
+        """, SEED_MARK)
+        timings["contracts_dispatch_s"] = round(time.perf_counter() - started, 2)
+
+        started = time.perf_counter()
+        await conn.execute("ANALYZE employees, haken_saki_company, employment_contracts, dispatch_assignments")
+        timings["analyze_s"] = round(time.perf_counter() - started, 2)
+
+        totals = await conn.fetchrow("""
+            SELECT (SELECT COUNT(*) FROM employees WHERE notes = $1) AS employees,
+                   (SELECT COUNT(*) FROM haken_saki_company WHERE notes = $1) AS haken_saki
+        """, SEED_MARK)
+    finally:
+        await conn.close()
+
+    return {"requested_employees": employees, "seed": seed_value, **dict(totals), **timings}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Siembra datos sintéticos para benchmarks.")
+    parser.add_argument("--scale", default="10k", help="1k / 10k / 100k o un número de empleados")
+    parser.add_argument("--seed", type=int, default=42, help="Semilla (datos reproducibles)")
+    parser.add_argument("--reset", action="store_true", help="Borra antes los datos sembrados")
+    parser.add_argument("--db-url", default=None, help="URL de la base (override DATABASE_URL)")
+    parser.add_argument("--output", default=None, help="Ruta del JSON de resultados")
+    args = parser.parse_args()
+
+    db_url = args.db_url or get_db_url()
+    employees = parse_scale(args.scale)
+    print(f"DB URL: {redact_dsn(db_url)}")
+    print(f"Empleados a sembrar: {employees}")
+
+    result = await seed(db_url, employees, args.seed, args.reset)
+    for key, value in result.items():
+        print(f"  {key}: {value}")
+    print(f"Resultados: {write_results('seed', {'seed': result}, args.output)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
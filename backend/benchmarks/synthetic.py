@@ -0,0 +1,358 @@
+"""
+Generador determinista de datos sintéticos (sin datos reales de empleados).
+Ejemplo (desde backend/):
+  python -m benchmarks.synthetic employees --count 1000000 --out /tmp/employees.jsonl
+  python -m benchmarks.synthetic employees --count 5000 --format json --out /tmp/employees_import.json
+  python -m benchmarks.synthetic factories --count 300 --out /tmp/factories
+  python -m benchmarks.synthetic ledger --count 200000 --out /tmp/ledger.xlsx
+
+- Cada fila se genera con su propio Random(seed, índice): la fila i es siempre
+  la misma, se puede generar cualquier tramo y nada se guarda en memoria.
+- employees: dicts con las columnas de la tabla employees (mismo formato que employees_import.json).
+- factories: un JSON por fábrica con la forma client_company/plant que lee import_sync.normalize_factory.
+- ledger: Excel con la hoja DBGenzaiX que lee import_sync.load_employees_from_excel
+  (openpyxl en modo write_only; más de ~1M filas se reparten en varios archivos).
+"""
+
+import argparse
+import json
+import random
+import string
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_SEED = 42
+EMPLOYEE_CODE_PREFIX = "SY"
+
+# Nacionalidad -> (peso, códigos de pasaporte, visados típicos con peso)
+NATIONALITIES: Dict[str, Tuple[int, str, List[Tuple[str, int]]]] = {
+    "ベトナム": (78, "C", [("技能実習", 25), ("特定技能1号", 35), ("技術・人文知識・国際業務", 30),
+                        ("永住者", 5), ("家族滞在", 5)]),
+    "ブラジル": (6, "F", [("定住者", 45), ("永住者", 40), ("日本人の配偶者等", 15)]),
+    "インドネシア": (4, "X", [("技能実習", 40), ("特定技能1号", 50), ("技術・人文知識・国際業務", 10)]),
+    "フィリピン": (3, "P", [("特定技能1号", 30), ("定住者", 30), ("永住者", 25), ("日本人の配偶者等", 15)]),
+    "ペルー": (2, "", [("定住者", 50), ("永住者", 50)]),
+    "ネパール": (2, "", [("技術・人文知識・国際業務", 60), ("特定技能1号", 25), ("家族滞在", 15)]),
+    "中国": (2, "E", [("技術・人文知識・国際業務", 50), ("永住者", 30), ("特定技能1号", 20)]),
+    "ミャンマー": (2, "M", [("特定技能1号", 60), ("技能実習", 40)]),
+    "タイ": (1, "A", [("特定技能1号", 60), ("技能実習", 40)]),
+}
+
+# Nombre en el台帳 (katakana de ancho medio, como en el Excel real)
+NATIONALITY_LEDGER = {
+    "ベトナム": "ﾍﾞﾄﾅﾑ", "ブラジル": "ﾌﾞﾗｼﾞﾙ", "インドネシア": "ｲﾝﾄﾞﾈｼｱ", "フィリピン": "ﾌｨﾘﾋﾟﾝ",
+    "ペルー": "ﾍﾟﾙｰ", "ネパール": "ﾈﾊﾟｰﾙ", "中国": "中国", "ミャンマー": "ﾐｬﾝﾏｰ", "タイ": "ﾀｲ",
+}
+
+NAMES: Dict[str, Tuple[List[str], List[str]]] = {
+    "ベトナム": (["NGUYEN", "TRAN", "LE", "PHAM", "HOANG", "HUYNH", "PHAN", "VU", "VO", "DANG", "BUI", "DO"],
+                ["VAN MINH", "THI HOA", "DUC ANH", "THI LAN", "VAN HUNG", "QUOC BAO", "THI MAI",
+                 "MINH TUAN", "THI NGOC", "VAN NAM", "HOANG LONG", "THI THU"]),
+    "ブラジル": (["SILVA", "SANTOS", "OLIVEIRA", "SOUZA", "PEREIRA", "COSTA", "RODRIGUES", "ALMEIDA"],
+                ["JOAO PAULO", "MARIA APARECIDA", "LUCAS", "ANA CAROLINA", "RAFAEL", "JULIANA", "MARCOS"]),
+    "インドネシア": (["SARI", "PUTRA", "WIJAYA", "SANTOSO", "HIDAYAT", "PRATAMA"],
+                   ["DEWI", "AGUS", "RINA", "BUDI", "SITI", "ADI"]),
+    "フィリピン": (["SANTOS", "REYES", "CRUZ", "BAUTISTA", "GARCIA", "MENDOZA"],
+                  ["MARIA CRISTINA", "JOSE", "MARK ANTHONY", "JENNIFER", "RICARDO"]),
+    "ペルー": (["QUISPE", "FLORES", "RAMIREZ", "TORRES", "GONZALES"],
+              ["LUIS ALBERTO", "ROSA", "CARLOS", "MILAGROS"]),
+    "ネパール": (["GURUNG", "TAMANG", "SHRESTHA", "RAI", "MAGAR", "THAPA"],
+                ["RAM", "SITA", "BIKASH", "ANJALI", "SURESH"]),
+    "中国": (["WANG", "LI", "ZHANG", "LIU", "CHEN", "YANG"],
+            ["WEI", "FANG", "JING", "LEI", "XIN", "HAO"]),
+    "ミャンマー": (["AUNG", "KYAW", "HTET", "ZAW", "WIN"],
+                  ["MIN THU", "SU SU", "THIHA", "NAING", "HNIN"]),
+    "タイ": (["SRISUK", "CHAIYAPORN", "BOONMA", "SAETANG"],
+            ["SOMCHAI", "NATTAYA", "ANAN", "PIMCHANOK"]),
+}
+
+# Visado -> duraciones posibles (meses)
+PERIODS = {
+    "技能実習": [12, 24],
+    "特定技能1号": [6, 12],
+    "技術・人文知識・国際業務": [12, 36, 60],
+    "定住者": [12, 36, 60],
+    "日本人の配偶者等": [12, 36],
+    "家族滞在": [12, 36],
+    "永住者": [0],  # sin caducidad de estancia (sí de tarjeta: 7 años)
+}
+
+# (prefectura, ciudad, prefijo postal, peso)
+CITIES = [
+    ("愛知県", "豊田市", "471", 20), ("愛知県", "岡崎市", "444", 10), ("愛知県", "名古屋市中区", "460", 8),
+    ("愛知県", "名古屋市港区", "455", 6), ("愛知県", "春日井市", "486", 8), ("愛知県", "小牧市", "485", 6),
+    ("愛知県", "安城市", "446", 5), ("愛知県", "刈谷市", "448", 5), ("愛知県", "半田市", "475", 4),
+    ("愛知県", "弥富市", "498", 3), ("岐阜県", "可児市", "509", 5), ("岐阜県", "美濃加茂市", "505", 4),
+    ("三重県", "四日市市", "510", 4), ("三重県", "鈴鹿市", "513", 4), ("静岡県", "浜松市中央区", "430", 5),
+    ("静岡県", "磐田市", "438", 3),
+]
+TOWNS = ["美里", "栄", "本町", "若宮町", "緑町", "中央", "旭町", "桜町", "新町", "東町", "西町", "南町"]
+APARTMENTS = ["ハイツ", "コーポ", "レジデンス", "メゾン", "荘", "ビレッジ"]
+COMPANY_WORDS = ["工業", "製作所", "精工", "技研", "産業", "化成", "電装", "金属", "樹脂", "物流"]
+COMPANY_PREFIXES = ["高雄", "中部", "東海", "三河", "尾張", "昭和", "大和", "旭", "新栄", "豊和", "明和", "丸八"]
+PLANT_NAMES = ["本社工場", "第一工場", "第二工場", "第三工場", "物流センター", "技術センター"]
+AREA_CODES = ["052", "0565", "0564", "0568", "0566", "0569", "0574", "059", "053", "0538"]
+PERSON_NAMES = ["安藤　忍", "鈴木　一郎", "加藤　誠", "山田　花子", "伊藤　健", "佐藤　美穂", "近藤　大輔"]
+
+LETTERS = string.ascii_uppercase
+
+
+def _cumulative(items: List[Tuple[Any, int]]) -> Tuple[List[Any], List[int]]:
+    values, weights, total = [], [], 0
+    for value, weight in items:
+        total += weight
+        values.append(value)
+        weights.append(total)
+    return values, weights
+
+
+_NATIONALITY_CHOICES = _cumulative([(k, v[0]) for k, v in NATIONALITIES.items()])
+_CITY_CHOICES = _cumulative([(c[:3], c[3]) for c in CITIES])
+_VISA_CHOICES = {k: _cumulative(v[2]) for k, v in NATIONALITIES.items()}
+
+
+def _pick(rng: random.Random, choices: Tuple[List[Any], List[int]]) -> Any:
+    values, cumulative = choices
+    return rng.choices(values, cum_weights=cumulative)[0]
+
+
+def _rng(seed: int, kind: str, index: int) -> random.Random:
+    # Semilla por fila: reproducible aunque se genere solo un tramo
+    return random.Random(f"{seed}:{kind}:{index}")
+
+
+def residence_card_number(index: int) -> str:
+    """Único por índice (hasta 10^8 filas), con formato válido AB12345678CD"""
+    return (f"{LETTERS[index // 26 % 26]}{LETTERS[index % 26]}{index % 100_000_000:08d}"
+            f"{LETTERS[index // 676 % 26]}{LETTERS[index // 17576 % 26]}")
+
+
+def _address(rng: random.Random) -> Tuple[str, str, str]:
+    """(〒 sin guion, 住所, ｱﾊﾟｰﾄ)"""
+    prefecture, city, postal_prefix = _pick(rng, _CITY_CHOICES)
+    address = f"{prefecture}{city}{rng.choice(TOWNS)}{rng.randint(1, 5)}-{rng.randint(1, 30)}-{rng.randint(1, 20)}"
+    apartment = ""
+    if rng.random() < 0.6:
+        apartment = f"{rng.choice(COMPANY_PREFIXES)}{rng.choice(APARTMENTS)}{rng.randint(1, 4)}0{rng.randint(1, 9)}"
+    return f"{postal_prefix}{rng.randint(0, 9999):04d}", address, apartment
+
+
+def _expiration(rng: random.Random, today: date, months: int) -> Optional[date]:
+    """
+    Distribución de caducidades: ~3 % ya vencidas (renovación en trámite),
+    ~12 % en los próximos 90 días y el resto repartido a lo largo del periodo.
+    """
+    if months == 0:
+        return today + timedelta(days=rng.randint(90, 7 * 365))  # tarjeta de永住者
+    roll = rng.random()
+    if roll < 0.03:
+        return today - timedelta(days=rng.randint(1, 60))
+    if roll < 0.15:
+        return today + timedelta(days=rng.randint(0, 90))
+    return today + timedelta(days=rng.randint(91, max(92, months * 30)))
+
+
+def employee(index: int, seed: int = DEFAULT_SEED, today: Optional[date] = None) -> Dict[str, Any]:
+    """Empleado número `index` (siempre el mismo para la misma semilla)"""
+    rng = _rng(seed, "employee", index)
+    today = today or date.today()
+
+    nationality = _pick(rng, _NATIONALITY_CHOICES)
+    families, givens = NAMES[nationality]
+    passport_prefix = NATIONALITIES[nationality][1]
+    visa = _pick(rng, _VISA_CHOICES[nationality])
+    months = rng.choice(PERIODS[visa])
+    postal, address, apartment = _address(rng)
+    birth = today - timedelta(days=rng.randint(19 * 365, 50 * 365))
+    hire = today - timedelta(days=int(rng.expovariate(1 / 700)) + 7)
+    active = rng.random() < 0.93
+
+    return {
+        "employee_code": f"{EMPLOYEE_CODE_PREFIX}{index:08d}",
+        "family_name": rng.choice(families),
+        "given_name": rng.choice(givens),
+        "nationality": nationality,
+        "date_of_birth": birth,
+        "sex": "male" if rng.random() < 0.68 else "female",
+        "postal_code_japan": postal,
+        "address_japan": f"{address} {apartment}".strip(),
+        "cellular_phone": f"0{rng.choice((70, 80, 90))}-{rng.randint(1000, 9999)}-{rng.randint(1000, 9999)}",
+        "passport_number": f"{passport_prefix or rng.choice(LETTERS)}{rng.randint(1_000_000, 9_999_999)}",
+        "passport_expiration": today + timedelta(days=rng.randint(120, 10 * 365)),
+        "current_visa_status": visa,
+        "current_period_of_stay": "" if months == 0 else (f"{months // 12}年" if months % 12 == 0 else f"{months}月"),
+        "current_expiration_date": _expiration(rng, today, months),
+        "residence_card_number": residence_card_number(index),
+        "hire_date": hire,
+        "termination_date": None if active else min(today, hire + timedelta(days=rng.randint(30, 900))),
+        "employment_status": "active" if active else "inactive",
+    }
+
+
+def employees(count: int, seed: int = DEFAULT_SEED, start: int = 0,
+              today: Optional[date] = None) -> Iterator[Dict[str, Any]]:
+    today = today or date.today()
+    for index in range(start, start + count):
+        yield employee(index, seed, today)
+
+
+def _landline(rng: random.Random) -> str:
+    return f"{rng.choice(AREA_CODES)}-{rng.randint(10, 99)}-{rng.randint(1000, 9999)}"
+
+
+def factory(index: int, seed: int = DEFAULT_SEED) -> Dict[str, Any]:
+    """Fábrica cliente en el formato de config/factories/*.json"""
+    rng = _rng(seed, "factory", index)
+    postal, address, _ = _address(rng)
+    company = f"{rng.choice(COMPANY_PREFIXES)}{rng.choice(COMPANY_WORDS)}株式会社"
+    phone = _landline(rng)
+    return {
+        "factory_id": f"SYF{index:05d}",
+        "client_company": {
+            "name": company,
+            "address": _address(rng)[1],
+            "phone": phone,
+            "corporation_number": f"{rng.randint(10**12, 10**13 - 1)}" if rng.random() < 0.7 else "",
+            "employment_insurance_number": f"{rng.randint(10**10, 10**11 - 1)}" if rng.random() < 0.5 else "",
+            "responsible_person": {"name": f"部長　{rng.choice(PERSON_NAMES)}", "phone": phone},
+        },
+        "plant": {
+            "name": rng.choice(PLANT_NAMES),
+            "address": address,
+            "phone": _landline(rng),
+            "postal_code": postal,
+        },
+    }
+
+
+def factories(count: int, seed: int = DEFAULT_SEED, start: int = 0) -> Iterator[Dict[str, Any]]:
+    for index in range(start, start + count):
+        yield factory(index, seed)
+
+
+# ============================================================
+# FORMATOS DE SALIDA (streaming)
+# ============================================================
+
+LEDGER_SHEET = "DBGenzaiX"
+LEDGER_HEADERS = ["現在", "社員№", "氏名", "性別", "国籍", "生年月日", "ビザ期限", "ビザ種類",
+                  "〒", "住所", "ｱﾊﾟｰﾄ", "入社日", "退社日"]
+# Límite de filas de una hoja de Excel (menos la cabecera)
+LEDGER_MAX_ROWS = 1_048_575
+
+
+def ledger_row(emp: Dict[str, Any]) -> List[Any]:
+    """Fila DBGenzaiX (lo contrario de import_sync.normalize_employee_row)"""
+    postal = emp["postal_code_japan"]
+    # address_japan = "住所 ｱﾊﾟｰﾄ" (el住所 generado no lleva espacios)
+    address, _, apartment = emp["address_japan"].partition(" ")
+    return [
+        "退社" if emp["employment_status"] == "inactive" else "在職中",
+        emp["employee_code"],
+        f"{emp['family_name']} {emp['given_name']}",
+        "男" if emp["sex"] == "male" else "女",
+        NATIONALITY_LEDGER.get(emp["nationality"], emp["nationality"]),
+        emp["date_of_birth"],
+        emp["current_expiration_date"],
+        emp["current_visa_status"],
+        f"{postal[:3]}-{postal[3:]}",
+        address,
+        apartment,
+        emp["hire_date"],
+        emp["termination_date"],
+    ]
+
+
+def write_ledger(path: Path, rows: Iterator[Dict[str, Any]], max_rows: int = LEDGER_MAX_ROWS) -> List[Path]:
+    """
+    Escribe el台帳 en modo write_only (memoria constante). Si hay más filas de
+    las que caben en una hoja, continúa en ledger_2.xlsx, ledger_3.xlsx, ...
+    """
+    from openpyxl import Workbook
+
+    written: List[Path] = []
+    part, wb, ws, in_sheet = 0, None, None, 0
+
+    def close():
+        if wb is not None:
+            target = path if part == 1 else path.with_name(f"{path.stem}_{part}{path.suffix}")
+            wb.save(target)
+            written.append(target)
+
+    for emp in rows:
+        if wb is None or in_sheet >= max_rows:
+            close()
+            part += 1
+            wb = Workbook(write_only=True)
+            ws = wb.create_sheet(LEDGER_SHEET)
+            ws.append(LEDGER_HEADERS)
+            in_sheet = 0
+        ws.append(ledger_row(emp))
+        in_sheet += 1
+    close()
+    return written
+
+
+def _json_default(value: Any) -> str:
+    return value.isoformat() if isinstance(value, date) else str(value)
+
+
+def write_json_lines(path: Path, rows: Iterator[Dict[str, Any]]) -> int:
+    n = 0
+    with path.open("w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False, default=_json_default))
+            f.write("\n")
+            n += 1
+    return n
+
+
+def write_json_array(path: Path, rows: Iterator[Dict[str, Any]]) -> int:
+    """Array JSON escrito elemento a elemento (como employees_import.json)"""
+    n = 0
+    with path.open("w", encoding="utf-8") as f:
+        f.write("[\n")
+        for row in rows:
+            if n:
+                f.write(",\n")
+            f.write("  " + json.dumps(row, ensure_ascii=False, default=_json_default))
+            n += 1
+        f.write("\n]\n")
+    return n
+
+
+def write_factories(directory: Path, rows: Iterator[Dict[str, Any]]) -> int:
+    directory.mkdir(parents=True, exist_ok=True)
+    n = 0
+    for row in rows:
+        target = directory / f"{row['factory_id']}.json"
+        target.write_text(json.dumps(row, ensure_ascii=False, indent=2), encoding="utf-8")
+        n += 1
+    return n
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera datos sintéticos deterministas.")
+    parser.add_argument("kind", choices=("employees", "factories", "ledger"))
+    parser.add_argument("--count", type=int, required=True)
+    parser.add_argument("--start", type=int, default=0, help="Primer índice (para generar por tramos)")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--format", choices=("jsonl", "json"), default="jsonl", help="Solo employees")
+    parser.add_argument("--out", required=True, help="Archivo (employees/ledger) o carpeta (factories)")
+    args = parser.parse_args()
+
+    out = Path(args.out)
+    if args.kind == "employees":
+        rows = employees(args.count, args.seed, args.start)
+        writer = write_json_array if args.format == "json" else write_json_lines
+        print(f"Empleados escritos: {writer(out, rows)} -> {out}")
+    elif args.kind == "factories":
+        print(f"Factories escritas: {write_factories(out, factories(args.count, args.seed, args.start))} -> {out}")
+    else:
+        paths = write_ledger(out, employees(args.count, args.seed, args.start))
+        print(f"台帳 escrito: {', '.join(str(p) for p in paths)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+# ============================================================
+# UNS VISA SYSTEM - Dispatch (派遣) Lifecycle
+# Contratos de empleo y asignaciones a派遣先: alta, fin, traslado,
+# historial y reasignación masiva. Invariante: como mucho un contrato
+# y una asignación activos por empleado (índices únicos parciales).
+# ============================================================
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional
+from datetime import date, timedelta
+import asyncpg
+
+import queries
+from auth import require_role
+from database import get_db_pool, get_read_pool
+
+router = APIRouter(prefix="/api/dispatch-assignments", tags=["Dispatch Assignments"])
+contracts_router = APIRouter(prefix="/api/employment-contracts", tags=["Employment Contracts"])
+
+# Estados de assignment_status / contract_status
+ACTIVE = "active"
+ENDED = "ended"
+TRANSFERRED = "transferred"
+
+# Campos del puesto que se conservan al trasladar a otro派遣先
+_CARRIED_OVER = ("job_title", "job_description", "work_start_time", "work_end_time", "break_time_minutes")
+
+# ============================================================
+# MODELS
+# ============================================================
+
+class EmploymentContractCreate(BaseModel):
+    employee_id: int
+    haken_moto_id: int = 1
+    contract_start_date: date
+    salary_amount: int
+    salary_type: str = "monthly"
+
+class DispatchAssignmentCreate(BaseModel):
+    employee_id: int
+    haken_saki_id: int = 1
+    dispatch_start_date: date
+    # Por defecto el contrato activo del empleado
+    employment_contract_id: Optional[int] = None
+    job_title: Optional[str] = Field(None, max_length=100)
+    work_location_department: Optional[str] = Field(None, max_length=100)
+    notes: Optional[str] = None
+
+class EndRequest(BaseModel):
+    end_date: Optional[date] = None  # hoy por defecto
+    reason: Optional[str] = None
+
+class TransferRequest(BaseModel):
+    haken_saki_id: int
+    transfer_date: date
+    job_title: Optional[str] = Field(None, max_length=100)
+    work_location_department: Optional[str] = Field(None, max_length=100)
+    notes: Optional[str] = None
+
+class BulkReassignRequest(BaseModel):
+    from_haken_saki_id: int
+    to_haken_saki_id: int
+    transfer_date: date
+    # Solo estos empleados (por defecto toda la plantilla activa del派遣先)
+    employee_ids: Optional[List[int]] = None
+
+# ============================================================
+# CURRENT ASSIGNMENT (compartido con export.py)
+# ============================================================
+
+async def get_current_assignment(conn, employee_id: int) -> Optional[Dict[str, Any]]:
+    """
+    派遣先 actual del empleado: columnas de haken_saki_company más los datos de la
+    asignación (assignment_id, dispatch_start_date, job_title, ...).
+    Búsqueda por idx_dispatch_one_active (único parcial): una fila como mucho.
+    """
+    row = await queries.fetchrow(conn, "current_assignment", employee_id)
+    return dict(row) if row else None
+
+
+async def _ensure_haken_saki(conn, haken_saki_id: int):
+    active = await conn.fetchval("SELECT is_active FROM haken_saki_company WHERE id = $1", haken_saki_id)
+    if active is None:
+        raise HTTPException(404, "派遣先が見つかりません")
+    if not active:
+        raise HTTPException(400, "無効な派遣先には配属できません")
+
+
+async def _end_active_assignment(conn, employee_id: int, end_date: date, status: str,
+                                 reason: Optional[str] = None) -> asyncpg.Record:
+    """Cierra la asignación activa (bloqueándola); 409 si no hay ninguna"""
+    row = await conn.fetchrow("""
+        SELECT * FROM dispatch_assignments
+        WHERE employee_id = $1 AND assignment_status = 'active'
+        FOR UPDATE
+    """, employee_id)
+    if not row:
+        raise HTTPException(409, "現在有効な派遣契約がありません")
+    if end_date < row["dispatch_start_date"]:
+        raise HTTPException(400, "終了日は派遣開始日以降にしてください")
+    return await conn.fetchrow("""
+        UPDATE dispatch_assignments
+        SET assignment_status = $2, dispatch_end_date = $3,
+            notes = COALESCE($4, notes)
+        WHERE id = $1
+        RETURNING *
+    """, row["id"], status, end_date, reason)
+
+# ============================================================
+# ENDPOINTS - EMPLOYMENT CONTRACTS
+# ============================================================
+
+@contracts_router.post("")
+async def create_employment_contract(contract: EmploymentContractCreate):
+    """雇用契約を作成"""
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        try:
+            row = await conn.fetchrow("""
+                INSERT INTO employment_contracts (employee_id, haken_moto_id, contract_start_date, salary_amount, salary_type)
+                VALUES ($1, $2, $3, $4, $5)
+                RETURNING *
+            """, contract.employee_id, contract.haken_moto_id, contract.contract_start_date,
+                contract.salary_amount, contract.salary_type)
+        except asyncpg.UniqueViolationError:
+            raise HTTPException(409, "この従業員には既に有効な雇用契約があります")
+        except asyncpg.ForeignKeyViolationError:
+            raise HTTPException(404, "従業員または派遣元会社が見つかりません")
+        return dict(row)
+
+@contracts_router.get("/employee/{employee_id}")
+async def list_employee_contracts(employee_id: int):
+    """雇用契約の履歴 - Contract history (newest first)"""
+    pool = await get_read_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT * FROM employment_contracts
+            WHERE employee_id = $1
+            ORDER BY contract_start_date DESC, id DESC
+        """, employee_id)
+        return [dict(r) for r in rows]
+
+@contracts_router.post("/{contract_id}/end")
+async def end_employment_contract(contract_id: int, request: EndRequest):
+    """
+    雇用契約を終了
+    End a contract; its active dispatch assignment ends on the same date
+    """
+    end_date = request.end_date or date.today()
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            contract = await conn.fetchrow(
+                "SELECT * FROM employment_contracts WHERE id = $1 FOR UPDATE", contract_id
+            )
+            if not contract:
+                raise HTTPException(404, "雇用契約が見つかりません")
+            if contract["contract_status"] != ACTIVE:
+                raise HTTPException(409, "この雇用契約は既に終了しています")
+            if end_date < contract["contract_start_date"]:
+                raise HTTPException(400, "終了日は契約開始日以降にしてください")
+
+            ended = await conn.fetch("""
+                UPDATE dispatch_assignments
+                SET assignment_status = 'ended', dispatch_end_date = GREATEST($2, dispatch_start_date)
+                WHERE employment_contract_id = $1 AND assignment_status = 'active'
+                RETURNING id
+            """, contract_id, end_date)
+            row = await conn.fetchrow("""
+                UPDATE employment_contracts
+                SET contract_status = 'ended', contract_end_date = $2
+                WHERE id = $1
+                RETURNING *
+            """, contract_id, end_date)
+    return {**dict(row), "ended_assignment_ids": [r["id"] for r in ended]}
+
+# ============================================================
+# ENDPOINTS - DISPATCH ASSIGNMENTS
+# ============================================================
+
+@router.post("")
+async def create_dispatch_assignment(assignment: DispatchAssignmentCreate):
+    """派遣契約を作成"""
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        await _ensure_haken_saki(conn, assignment.haken_saki_id)
+        try:
+            row = await conn.fetchrow("""
+                INSERT INTO dispatch_assignments (
+                    employee_id, employment_contract_id, haken_saki_id, dispatch_start_date,
+                    job_title, work_location_department, notes
+                )
+                VALUES ($1, COALESCE($2, (
+                    SELECT id FROM employment_contracts WHERE employee_id = $1 AND contract_status = 'active'
+                )), $3, $4, $5, $6, $7)
+                RETURNING *
+            """, assignment.employee_id, assignment.employment_contract_id, assignment.haken_saki_id,
+                assignment.dispatch_start_date, assignment.job_title,
+                assignment.work_location_department, assignment.notes)
+        except asyncpg.UniqueViolationError:
+            raise HTTPException(409, "この従業員には既に有効な派遣契約があります（異動は transfer を使用）")
+        except asyncpg.ForeignKeyViolationError:
+            raise HTTPException(404, "従業員または雇用契約が見つかりません")
+        return dict(row)
+
+@router.get("/employee/{employee_id}/current")
+async def get_employee_current_assignment(employee_id: int):
+    """現在の派遣先 - Current assignment with its client company"""
+    pool = await get_read_pool()
+    async with pool.acquire() as conn:
+        current = await get_current_assignment(conn, employee_id)
+    if not current:
+        raise HTTPException(404, "現在有効な派遣契約がありません")
+    return current
+
+@router.get("/employee/{employee_id}/history")
+async def get_employee_assignment_history(employee_id: int):
+    """派遣履歴 - Assignment history (newest first)"""
+    pool = await get_read_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT da.*, hs.company_name AS haken_saki_name, hs.branch_name AS haken_saki_branch
+            FROM dispatch_assignments da
+            LEFT JOIN haken_saki_company hs ON hs.id = da.haken_saki_id
+            WHERE da.employee_id = $1
+            ORDER BY da.dispatch_start_date DESC, da.id DESC
+        """, employee_id)
+        return [dict(r) for r in rows]
+
+@router.post("/{assignment_id}/end")
+async def end_dispatch_assignment(assignment_id: int, request: EndRequest):
+    """派遣契約を終了 - End an active assignment"""
+    end_date = request.end_date or date.today()
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            # Se bloquea y cierra la asignación de la URL: un traslado concurrente
+            # ya habrá cambiado su estado y no se cierra la nueva
+            current = await conn.fetchrow(
+                "SELECT * FROM dispatch_assignments WHERE id = $1 FOR UPDATE",
+                assignment_id
+            )
+            if not current:
+                raise HTTPException(404, "派遣契約が見つかりません")
+            if current["assignment_status"] != ACTIVE:
+                raise HTTPException(409, "この派遣契約は既に終了しています")
+            if end_date < current["dispatch_start_date"]:
+                raise HTTPException(400, "終了日は派遣開始日以降にしてください")
+            row = await conn.fetchrow("""
+                UPDATE dispatch_assignments
+                SET assignment_status = $2, dispatch_end_date = $3,
+                    notes = COALESCE($4, notes)
+                WHERE id = $1
+                RETURNING *
+            """, assignment_id, ENDED, end_date, request.reason)
+        return dict(row)
+
+@router.post("/employee/{employee_id}/transfer")
+async def transfer_employee(employee_id: int, request: TransferRequest):
+    """
+    派遣先を異動
+    Close the current assignment the day before transfer_date and open a new one
+    """
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await _ensure_haken_saki(conn, request.haken_saki_id)
+            previous = await _end_active_assignment(
+                conn, employee_id, request.transfer_date - timedelta(days=1), TRANSFERRED
+            )
+            if previous["haken_saki_id"] == request.haken_saki_id:
+                raise HTTPException(400, "異動先が現在の派遣先と同じです")
+            carried = {f: previous[f] for f in _CARRIED_OVER}
+            row = await conn.fetchrow("""
+                INSERT INTO dispatch_assignments (
+                    employee_id, employment_contract_id, haken_saki_id, dispatch_start_date,
+                    job_title, job_description, work_start_time, work_end_time, break_time_minutes,
+                    work_location_department, notes
+                )
+                VALUES ($1, $2, $3, $4, COALESCE($5, $6), $7, $8, $9, $10, $11, $12)
+                RETURNING *
+            """, employee_id, previous["employment_contract_id"], request.haken_saki_id,
+                request.transfer_date, request.job_title, carried["job_title"],
+                carried["job_description"], carried["work_start_time"], carried["work_end_time"],
+                carried["break_time_minutes"], request.work_location_department, request.notes)
+    return {"previous": dict(previous), "current": dict(row)}
+
+@router.post("/bulk-reassign")
+async def bulk_reassign(request: BulkReassignRequest, current_user=Depends(require_role(["admin"]))):
+    """
+    派遣先の一括異動
+    Move a client company's active roster to another one in a single transaction
+    """
+    if request.from_haken_saki_id == request.to_haken_saki_id:
+        raise HTTPException(400, "異動元と異動先が同じです")
+
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await _ensure_haken_saki(conn, request.to_haken_saki_id)
+            # El UPDATE bloquea las filas: un traslado concurrente del mismo empleado espera
+            # y luego ya no las ve activas. Las que empezaron en transfer_date o después no se mueven.
+            ended = await conn.fetch("""
+                UPDATE dispatch_assignments
+                SET assignment_status = 'transferred', dispatch_end_date = $2::date - 1
+                WHERE haken_saki_id = $1 AND assignment_status = 'active'
+                AND dispatch_start_date < $2
+                AND ($3::int[] IS NULL OR employee_id = ANY($3::int[]))
+                RETURNING id
+            """, request.from_haken_saki_id, request.transfer_date, request.employee_ids)
+            if not ended:
+                return {"moved": 0, "employee_ids": []}
+
+            rows = await conn.fetch(f"""
+                INSERT INTO dispatch_assignments (
+                    employee_id, employment_contract_id, haken_saki_id, dispatch_start_date,
+                    {', '.join(_CARRIED_OVER)}, notes
+                )
+                SELECT employee_id, employment_contract_id, $2, $3,
+                       {', '.join(_CARRIED_OVER)}, 'bulk reassign from haken_saki ' || $4::text
+                FROM dispatch_assignments
+                WHERE id = ANY($1::int[])
+                RETURNING employee_id
+            """, [r["id"] for r in ended], request.to_haken_saki_id, request.transfer_date,
+                request.from_haken_saki_id)
+    return {"moved": len(rows), "employee_ids": sorted(r["employee_id"] for r in rows)}
@@ -0,0 +1,59 @@
+# ============================================================
+# UNS VISA SYSTEM - Employee Detail
+# Empleado con familia, historial laboral, contrato,派遣先 actual y
+# solicitudes de visa en una sola consulta (GET /api/employees/{id}/full
+# y exportaciones Excel).
+# ============================================================
+
+from typing import Any, Dict, List, Optional
+
+import queries
+
+
+async def get_employee_full(conn, employee_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Columnas de employees más family, work_history, visa_applications (listas),
+    contract y dispatch (objeto o None). dispatch tiene las mismas claves que
+    dispatch.get_current_assignment. Las fechas anidadas llegan como texto ISO (JSON).
+    """
+    row = await queries.fetchrow(conn, "employee_full", employee_id)
+    return dict(row) if row else None
+
+
+def _month(value: Optional[str]) -> str:
+    # "2015-04-01" -> "2015年04月"
+    return f"{value[:4]}年{value[5:7]}月" if value else ""
+
+
+def form_relations(employee: Dict[str, Any]) -> Dict[str, Any]:
+    """Familia en Japón (hoja 2) e historial laboral (hoja 3) en el formato de excel_generator"""
+    family: List[Dict[str, Any]] = [
+        {
+            "relationship": member.get("relationship") or "",
+            "name": f"{member.get('family_name') or ''} {member.get('given_name') or ''}".strip(),
+            "date_of_birth": member.get("date_of_birth") or "",
+            "nationality": member.get("nationality") or "",
+            "residing_with": bool(member.get("is_residing_together")),
+            "place_of_employment": member.get("place_of_employment") or member.get("occupation") or "",
+            "residence_card_number": member.get("residence_card_number") or "",
+        }
+        for member in employee.get("family") or []
+    ]
+    work_history: List[Dict[str, Any]] = []
+    for work in employee.get("work_history") or []:
+        period = work.get("period_description")
+        if not period and work.get("start_date"):
+            period = f"{_month(work['start_date'])} ～ {_month(work.get('end_date')) or '現在'}"
+        position = work.get("position_title") or ""
+        if work.get("job_description"):
+            position = f"{position}（{work['job_description']}）" if position else work["job_description"]
+        work_history.append({
+            "company_name": work.get("company_name") or "",
+            "period": period or "",
+            "position": position,
+        })
+    return {
+        "has_family_in_japan": bool(family),
+        "family_in_japan": family,
+        "work_history": work_history,
+    }
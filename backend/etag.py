@@ -0,0 +1,77 @@
+# ============================================================
+# UNS VISA SYSTEM - ETag / If-None-Match
+# Lecturas condicionales: el ETag sale de table_versions + table_changes (un
+# contador por tabla que incrementan triggers sin bloquear) y de la fecha, así
+# un 304 no cuesta ni la consulta de datos ni la serialización de la respuesta.
+# ============================================================
+
+from fastapi import HTTPException, Request, Response
+from datetime import date
+from typing import Optional
+
+import queries
+from database import get_read_pool
+
+# El navegador revalida siempre (fetch() manda If-None-Match solo)
+CACHE_CONTROL = "private, no-cache"
+
+
+def _opaque(tag: str) -> str:
+    # Comparación débil (RFC 9110): W/"x" y "x" son el mismo ETag
+    return tag.strip().removeprefix("W/")
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return _opaque(etag) in {_opaque(t) for t in if_none_match.split(",")}
+
+
+def check_not_modified(request: Request, response: Response, etag: str):
+    """304 si el cliente ya tiene esta versión; si no, pone ETag en la respuesta"""
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        raise HTTPException(304, headers=headers)
+    response.headers.update(headers)
+
+
+def table_etag(*tables: str, daily: bool = False):
+    """
+    Dependencia para endpoints que solo leen `tables`. daily=True añade
+    CURRENT_DATE (visa_status, días restantes). Débil: nginx recomprime la respuesta.
+
+    La versión se lee antes que los datos y del mismo pool: si entre medias
+    entra un cambio, el ETag queda viejo y el siguiente GET es un 200, nunca un 304 erróneo.
+    """
+    names = sorted(tables)
+
+    async def dependency(request: Request, response: Response) -> str:
+        pool = await get_read_pool()
+        async with pool.acquire() as conn:
+            row = await queries.fetchrow(conn, "table_versions", names)
+        versions = ".".join(str(v) for v in row["versions"] or [])
+        etag = f'W/"{versions}@{row["today"]}"' if daily else f'W/"{versions}"'
+        check_not_modified(request, response, etag)
+        return etag
+
+    return dependency
+
+
+def row_version_tag(updated_at, daily: bool = True) -> Optional[str]:
+    """
+    ETag de una fila por su updated_at (más la fecha si la respuesta depende del día).
+    Lo emiten GET y PATCH /api/employees/{id}: el ETag de un PATCH vale para el siguiente GET
+    """
+    if not updated_at:
+        return None
+    return f'W/"{updated_at.isoformat()}@{date.today()}"' if daily else f'W/"{updated_at.isoformat()}"'
+
+
+def row_etag(request: Request, response: Response, updated_at, daily: bool = True) -> Optional[str]:
+    """304 / ETag de una fila (row_version_tag)"""
+    etag = row_version_tag(updated_at, daily)
+    if etag:
+        check_not_modified(request, response, etag)
+    return etag
@@ -8,10 +8,19 @@ from pydantic import BaseModel, Field, validator
 from typing import Optional, List
 from datetime import date, datetime
 import re
-from database import get_db_pool
+import audit
+from database import get_db_pool, get_read_pool
+from etag import table_etag
 
 router = APIRouter(prefix="/api/haken-saki", tags=["Haken Saki (派遣先)"])
 
+# employee_count sale de haken_saki_stats (mantenida por triggers, ver init.sql)
+SELECT_WITH_COUNT = """
+    SELECT hs.*, COALESCE(s.active_employees, 0) AS employee_count
+    FROM haken_saki_company hs
+    LEFT JOIN haken_saki_stats s ON s.haken_saki_id = hs.id
+"""
+
 # ============================================================
 # MODELS
 # ============================================================
@@ -191,6 +200,7 @@ async def create_haken_saki(company: HakenSakiCreate):
         """
         
         row = await conn.fetchrow(query, *values)
+        audit.record("haken_saki_company", row["id"], "INSERT", new=dict(row))
         return dict(row)
 
 @router.get("", response_model=List[HakenSakiResponse])
@@ -198,30 +208,31 @@ async def list_haken_saki(
     skip: int = 0,
     limit: int = 100,
     search: Optional[str] = None,
-    active_only: bool = True
+    active_only: bool = True,
+    etag: str = Depends(table_etag("haken_saki_company", "haken_saki_stats"))
 ):
     """
     派遣先会社一覧を取得
-    List all client companies
+    List all client companies (ETag: 304 si no cambió ni el派遣先 ni su plantilla)
     """
-    pool = await get_db_pool()
+    pool = await get_read_pool()
     
-    query = "SELECT * FROM haken_saki_company WHERE 1=1"
+    query = f"{SELECT_WITH_COUNT} WHERE 1=1"
     params = []
     
     if active_only:
-        query += " AND is_active = TRUE"
+        query += " AND hs.is_active = TRUE"
     
     if search:
         search_lower = f"%{search.lower()}%"
         query += """ AND (
-            LOWER(company_name) LIKE $1 OR 
-            LOWER(branch_name) LIKE $1 OR 
-            LOWER(full_address) LIKE $1
+            LOWER(hs.company_name) LIKE $1 OR 
+            LOWER(hs.branch_name) LIKE $1 OR 
+            LOWER(hs.full_address) LIKE $1
         )"""
         params.append(search_lower)
     
-    query += f" ORDER BY id DESC LIMIT {limit} OFFSET {skip}"
+    query += f" ORDER BY hs.id DESC LIMIT {limit} OFFSET {skip}"
     
     async with pool.acquire() as conn:
         rows = await conn.fetch(query, *params)
@@ -233,9 +244,9 @@ async def get_haken_saki(company_id: int):
     派遣先会社を取得
     Get a client company by ID
     """
-    pool = await get_db_pool()
+    pool = await get_read_pool()
     async with pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT * FROM haken_saki_company WHERE id = $1", company_id)
+        row = await conn.fetchrow(f"{SELECT_WITH_COUNT} WHERE hs.id = $1", company_id)
         if not row:
             raise HTTPException(status_code=404, detail="派遣先が見つかりません")
         return dict(row)
@@ -258,18 +269,22 @@ async def update_haken_saki(company_id: int, update_data: HakenSakiUpdate):
         set_clauses.append(f"{k} = ${i+2}")
         values.append(v)
     
+    # old: la fila anterior, para el diff de auditoría
     query = f"""
         UPDATE haken_saki_company 
         SET {', '.join(set_clauses)}, updated_at = CURRENT_TIMESTAMP
-        WHERE id = $1
-        RETURNING *
+        FROM haken_saki_company old
+        WHERE haken_saki_company.id = $1 AND old.id = haken_saki_company.id
+        RETURNING haken_saki_company.*, old AS _old
     """
     
     async with pool.acquire() as conn:
         row = await conn.fetchrow(query, company_id, *values)
         if not row:
             raise HTTPException(status_code=404, detail="派遣先が見つかりません")
-        return dict(row)
+        result, old = audit.split_old(row)
+        audit.record("haken_saki_company", company_id, "UPDATE", old, result)
+        return result
 
 @router.delete("/{company_id}")
 async def delete_haken_saki(company_id: int, hard_delete: bool = False):
@@ -280,19 +295,23 @@ async def delete_haken_saki(company_id: int, hard_delete: bool = False):
     pool = await get_db_pool()
     async with pool.acquire() as conn:
         if hard_delete:
-            result = await conn.execute("DELETE FROM haken_saki_company WHERE id = $1", company_id)
-            if result == "DELETE 0":
+            row = await conn.fetchrow("DELETE FROM haken_saki_company WHERE id = $1 RETURNING *", company_id)
+            if not row:
                 raise HTTPException(status_code=404, detail="派遣先が見つかりません")
+            audit.record("haken_saki_company", company_id, "DELETE", old=dict(row))
             return {"message": "派遣先を完全に削除しました"}
         else:
             row = await conn.fetchrow("""
                 UPDATE haken_saki_company 
                 SET is_active = FALSE, updated_at = CURRENT_TIMESTAMP
-                WHERE id = $1
-                RETURNING id
+                FROM haken_saki_company old
+                WHERE haken_saki_company.id = $1 AND old.id = haken_saki_company.id
+                RETURNING old.is_active
             """, company_id)
             if not row:
                 raise HTTPException(status_code=404, detail="派遣先が見つかりません")
+            audit.record("haken_saki_company", company_id, "DELETE",
+                         {"is_active": row["is_active"]}, {"is_active": False})
             return {"message": "派遣先を無効化しました"}
 
 @router.post("/bulk-import")
@@ -341,13 +360,16 @@ async def bulk_import_haken_saki(import_data: HakenSakiBulkImport):
                 query = f"""
                     INSERT INTO haken_saki_company ({', '.join(columns)})
                     VALUES ({', '.join(placeholders)})
-                    RETURNING id, company_name, branch_name
+                    RETURNING *
                 """
                 
                 row = await conn.fetchrow(query, *values)
+                audit.record("haken_saki_company", row["id"], "INSERT", new=dict(row))
                 
                 results['success'] += 1
-                results['imported'].append(dict(row))
+                results['imported'].append(
+                    {"id": row["id"], "company_name": row["company_name"], "branch_name": row["branch_name"]}
+                )
                 
             except Exception as e:
                 results['failed'] += 1
@@ -364,18 +386,57 @@ async def get_haken_saki_stats():
     派遣先統計情報を取得
     Get statistics about client companies
     """
-    pool = await get_db_pool()
+    pool = await get_read_pool()
     async with pool.acquire() as conn:
-        total = await conn.fetchval("SELECT COUNT(*) FROM haken_saki_company WHERE is_active = TRUE")
-        
-        # Simple stats for now
-        return {
-            "total_companies": total,
-            "total_employees_at_clients": 0, # To be implemented with dispatch assignments
-            "total_foreign_at_clients": 0,
-            "by_prefecture": {},
-            "by_business_type": {}
+        totals = await conn.fetchrow("""
+            SELECT COUNT(*) AS total_companies,
+                   COALESCE(SUM(s.active_employees), 0) AS employees,
+                   COALESCE(SUM(s.foreign_employees), 0) AS foreign_employees,
+                   MIN(s.nearest_visa_expiration) AS nearest_visa_expiration
+            FROM haken_saki_company hs
+            LEFT JOIN haken_saki_stats s ON s.haken_saki_id = hs.id
+            WHERE hs.is_active = TRUE
+        """)
+        groups = await conn.fetch("""
+            SELECT 'prefecture' AS dimension, COALESCE(NULLIF(hs.prefecture, ''), '不明') AS key,
+                   COUNT(*) AS companies, COALESCE(SUM(s.active_employees), 0) AS employees
+            FROM haken_saki_company hs
+            LEFT JOIN haken_saki_stats s ON s.haken_saki_id = hs.id
+            WHERE hs.is_active = TRUE
+            GROUP BY 2
+            UNION ALL
+            SELECT 'business_type', COALESCE(NULLIF(hs.business_type_name, ''), '不明'),
+                   COUNT(*), COALESCE(SUM(s.active_employees), 0)
+            FROM haken_saki_company hs
+            LEFT JOIN haken_saki_stats s ON s.haken_saki_id = hs.id
+            WHERE hs.is_active = TRUE
+            GROUP BY 2
+            ORDER BY 1, 4 DESC, 2
+        """)
+        nationalities = await conn.fetch("""
+            SELECT n.key AS nationality, SUM(n.value::int) AS employees
+            FROM haken_saki_company hs
+            JOIN haken_saki_stats s ON s.haken_saki_id = hs.id
+            CROSS JOIN LATERAL jsonb_each_text(s.nationality_counts) AS n
+            WHERE hs.is_active = TRUE
+            GROUP BY n.key
+            ORDER BY 2 DESC
+        """)
+
+    by_dimension = {"prefecture": {}, "business_type": {}}
+    for row in groups:
+        by_dimension[row["dimension"]][row["key"]] = {
+            "companies": row["companies"], "employees": row["employees"]
         }
+    return {
+        "total_companies": totals["total_companies"],
+        "total_employees_at_clients": totals["employees"],
+        "total_foreign_at_clients": totals["foreign_employees"],
+        "nearest_visa_expiration": totals["nearest_visa_expiration"],
+        "by_prefecture": by_dimension["prefecture"],
+        "by_business_type": by_dimension["business_type"],
+        "by_nationality": {r["nationality"]: r["employees"] for r in nationalities},
+    }
 
 @router.get("/search/by-name")
 async def search_haken_saki_by_name(name: str, limit: int = 10):
@@ -383,7 +444,7 @@ async def search_haken_saki_by_name(name: str, limit: int = 10):
     会社名で派遣先を検索
     Search client companies by name (for autocomplete)
     """
-    pool = await get_db_pool()
+    pool = await get_read_pool()
     async with pool.acquire() as conn:
         rows = await conn.fetch("""
             SELECT id, company_name, branch_name, full_address 
@@ -3,25 +3,55 @@
 # FastAPI + PostgreSQL
 # ============================================================
 
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request, Response, Header, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from starlette.datastructures import UploadFile as FormFile
 from pydantic import BaseModel, Field, validator
 from typing import Optional, List
 from datetime import date, datetime
+import asyncio
+import time
 import asyncpg
+import json
 import re
 import os
 from ocr_service import OCRService
+from validators import Validators
+from ocr_preprocess import decode_base64_image
+from ocr_cache import ocr_cache
+import queries
+import metrics
+import audit
+from visa_alerts import get_expiring
+from employee_detail import get_employee_full
+from etag import table_etag, row_etag, row_version_tag
 
 # Import routers
 try:
     from auth import router as auth_router
     from haken_saki import router as haken_saki_router
     from export import router as export_router
+    from ocr_audit import router as ocr_audit_router
+    from notifications import router as notifications_router, stop_notification_listener
+    from scheduler import router as scheduler_router, start_scheduler, stop_scheduler
+    from profiler import router as profiler_router
+    from dispatch import router as dispatch_router, contracts_router
+    from visa_applications import router as visa_applications_router
+    from auth import decode_token
 except ImportError:
     auth_router = None
     haken_saki_router = None
     export_router = None
+    ocr_audit_router = None
+    notifications_router = None
+    stop_notification_listener = None
+    scheduler_router = None
+    profiler_router = None
+    dispatch_router = contracts_router = None
+    visa_applications_router = None
+    decode_token = None
+    start_scheduler = stop_scheduler = None
 
 app = FastAPI(
     title="UNS Visa Management API",
@@ -36,6 +66,20 @@ if haken_saki_router:
     app.include_router(haken_saki_router)
 if export_router:
     app.include_router(export_router)
+if ocr_audit_router:
+    app.include_router(ocr_audit_router)
+if notifications_router:
+    app.include_router(notifications_router)
+if scheduler_router:
+    app.include_router(scheduler_router)
+if profiler_router:
+    app.include_router(profiler_router)
+if dispatch_router:
+    app.include_router(dispatch_router)
+    app.include_router(contracts_router)
+if visa_applications_router:
+    app.include_router(visa_applications_router)
+app.include_router(audit.router)
 
 # CORS
 app.add_middleware(
@@ -50,7 +94,10 @@ app.add_middleware(
 # CONFIGURACIÓN
 # ============================================================
 
-from database import init_db, close_db, get_db_pool
+from database import (
+    init_db, close_db, get_db_pool, get_read_pool, get_pool_stats,
+    has_read_replica, use_primary_for_reads, reset_read_routing, DB_READ_YOUR_WRITES_SECONDS,
+)
 
 # ... (imports)
 
@@ -61,63 +108,119 @@ from database import init_db, close_db, get_db_pool
 @app.on_event("startup")
 async def startup():
     await init_db()
+    await audit.start_audit_writer()
+    if start_scheduler:
+        await start_scheduler()
 
 @app.on_event("shutdown")
 async def shutdown():
+    if stop_scheduler:
+        await stop_scheduler()
+    if stop_notification_listener:
+        await stop_notification_listener()
+    # Lo que quede en la cola de auditoría se escribe antes de cerrar el pool
+    await audit.stop_audit_writer()
     await close_db()
 
-# ============================================================
-# VALIDADORES
-# ============================================================
+# Métricas por petición: latencia por ruta, estados, en curso, tiempo de BD/Excel/OCR
+@app.middleware("http")
+async def request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    timing, token = metrics.start_request()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - started
+        # Plantilla de la ruta ("/api/employees/{id}"), no la URL: cardinalidad acotada
+        route = getattr(request.scope.get("route"), "path", None) or "unmatched"
+        metrics.finish_request(token, timing, request.method, route, status, elapsed)
+    response.headers["Server-Timing"] = metrics.server_timing_header(timing, elapsed)
+    return response
 
-class Validators:
-    @staticmethod
-    def residence_card(card: str) -> bool:
-        """在留カード番号: 2文字 + 8数字 + 2文字 (例: AB12345678CD)"""
-        return bool(re.match(r'^[A-Z]{2}\d{8}[A-Z]{2}$', card.upper())) if card else False
-    
-    @staticmethod
-    def corporation_number(num: str) -> bool:
-        """法人番号: 13桁"""
-        return bool(re.match(r'^\d{13}$', num)) if num else True
-    
-    @staticmethod
-    def insurance_number(num: str) -> bool:
-        """雇用保険番号: 11桁"""
-        return bool(re.match(r'^\d{11}$', num)) if num else True
-    
-    @staticmethod
-    def phone_japan(phone: str) -> bool:
-        """日本の電話番号"""
-        if not phone:
-            return True
-        clean = re.sub(r'[-\s]', '', phone)
-        return bool(re.match(r'^0\d{9,10}$', clean))
-    
-    @staticmethod
-    def postal_code(code: str) -> bool:
-        """郵便番号: 7桁"""
-        if not code:
-            return True
-        clean = re.sub(r'[-\s]', '', code)
-        return bool(re.match(r'^\d{7}$', clean))
-    
-    @staticmethod
-    def visa_status(expiration: date) -> dict:
-        """ビザ期限のステータス計算"""
-        days = (expiration - date.today()).days
-        return {
-            "days_remaining": days,
-            "is_expired": days < 0,
-            "status": "expired" if days < 0 else "critical" if days <= 30 else "warning" if days <= 90 else "ok",
-            "can_renew": 0 < days <= 90,
-            "message": f"期限まで{days}日" if days > 0 else f"期限切れ（{abs(days)}日経過）"
-        }
+# Read-your-writes: tras una escritura, el mismo cliente lee del primario durante
+# DB_READ_YOUR_WRITES_SECONDS (la réplica puede ir unos segundos por detrás)
+READ_PRIMARY_COOKIE = "uns_read_primary"
+
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    if not has_read_replica():
+        return await call_next(request)
+
+    force = (
+        request.cookies.get(READ_PRIMARY_COOKIE) is not None
+        or request.headers.get("x-read-primary", "").lower() in ("1", "true")
+    )
+    token = use_primary_for_reads(force)
+    try:
+        response = await call_next(request)
+    finally:
+        reset_read_routing(token)
+
+    if request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        response.set_cookie(READ_PRIMARY_COOKIE, "1", max_age=DB_READ_YOUR_WRITES_SECONDS,
+                            httponly=True, samesite="lax")
+    return response
+
+# Auditoría: usuario e IP de la petición para audit.record(). Solo en escrituras;
+# el token se decodifica sin consultar la BD (la autorización la hace cada endpoint)
+@app.middleware("http")
+async def audit_context(request: Request, call_next):
+    if request.method in ("GET", "HEAD", "OPTIONS"):
+        return await call_next(request)
+
+    user_id = user_name = None
+    authorization = request.headers.get("authorization", "")
+    if decode_token and authorization.lower().startswith("bearer "):
+        try:
+            token_data = decode_token(authorization[7:])
+            user_id, user_name = token_data.user_id, token_data.username
+        except HTTPException:
+            pass
+    # X-Real-IP lo fija nginx con $remote_addr (sobrescribe el del cliente); el primer
+    # valor de X-Forwarded-For lo controla el cliente y no sirve para auditar
+    ip_address = request.headers.get("x-real-ip") or (request.client.host if request.client else None)
+
+    token = audit.set_actor(user_id, user_name, ip_address)
+    try:
+        return await call_next(request)
+    finally:
+        audit.reset_actor(token)
 
 # ============================================================
 # MODELOS
 # ============================================================
 
+# Validadores compartidos por EmployeeBase (alta / PUT) y EmployeeUpdate (PATCH)
+def _check_residence_card(cls, v):
+    if v and not Validators.residence_card(v):
+        raise ValueError('在留カード番号の形式が無効です（例：AB12345678CD）')
+    return v.upper() if v else v
+
+def _check_postal_code(cls, v):
+    if not Validators.postal_code(v):
+        raise ValueError('郵便番号の形式が無効です')
+    return v
+
+def _check_phone(cls, v):
+    if not Validators.phone_japan(v):
+        raise ValueError('電話番号の形式が無効です')
+    return v
+
+def _naive_timestamp(value: Optional[datetime]) -> Optional[datetime]:
+    """
+    employees.updated_at es TIMESTAMP (sin zona) y la API lo devuelve así. Un valor
+    con zona (toISOString() -> "...Z") se pasa a la hora local, que es la de la BD
+    (backend y postgres usan la misma TZ del contenedor), y se le quita la zona.
+    """
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone().replace(tzinfo=None)
+    return value
+
+def _check_naive_timestamp(cls, v):
+    return _naive_timestamp(v)
+
 class EmployeeBase(BaseModel):
     family_name: str = Field(..., min_length=1, max_length=100)
     given_name: str = Field(..., min_length=1, max_length=100)
@@ -160,27 +263,60 @@ class EmployeeBase(BaseModel):
     # Criminal
     has_criminal_record: bool = False
     
-    @validator('residence_card_number')
-    def validate_card(cls, v):
-        if v and not Validators.residence_card(v):
-            raise ValueError('在留カード番号の形式が無効です（例：AB12345678CD）')
-        return v.upper() if v else v
-    
-    @validator('postal_code_japan')
-    def validate_postal(cls, v):
-        if not Validators.postal_code(v):
-            raise ValueError('郵便番号の形式が無効です')
-        return v
-    
-    @validator('telephone_japan', 'cellular_phone')
-    def validate_phone(cls, v):
-        if not Validators.phone_japan(v):
-            raise ValueError('電話番号の形式が無効です')
-        return v
+    validate_card = validator('residence_card_number', allow_reuse=True)(_check_residence_card)
+    validate_postal = validator('postal_code_japan', allow_reuse=True)(_check_postal_code)
+    validate_phone = validator('telephone_japan', 'cellular_phone', allow_reuse=True)(_check_phone)
 
 class EmployeeCreate(EmployeeBase):
     employee_code: Optional[str] = None
 
+# Obligatorios en EmployeeBase: un PATCH no puede ponerlos a null
+EMPLOYEE_REQUIRED_FIELDS = {
+    'family_name', 'given_name', 'nationality', 'date_of_birth', 'sex',
+    'passport_number', 'passport_expiration', 'has_it_qualification', 'has_criminal_record',
+}
+
+class EmployeeUpdate(BaseModel):
+    """PATCH: solo se escriben los campos enviados"""
+    family_name: Optional[str] = Field(None, min_length=1, max_length=100)
+    given_name: Optional[str] = Field(None, min_length=1, max_length=100)
+    family_name_kanji: Optional[str] = None
+    given_name_kanji: Optional[str] = None
+    nationality: Optional[str] = None
+    date_of_birth: Optional[date] = None
+    sex: Optional[str] = Field(None, pattern='^(male|female)$')
+    marital_status: Optional[str] = None
+    place_of_birth: Optional[str] = None
+    home_town_city: Optional[str] = None
+    postal_code_japan: Optional[str] = None
+    address_japan: Optional[str] = None
+    telephone_japan: Optional[str] = None
+    cellular_phone: Optional[str] = None
+    email: Optional[str] = None
+    passport_number: Optional[str] = None
+    passport_expiration: Optional[date] = None
+    passport_issue_country: Optional[str] = None
+    current_visa_status: Optional[str] = None
+    current_period_of_stay: Optional[str] = None
+    current_expiration_date: Optional[date] = None
+    residence_card_number: Optional[str] = None
+    school_location: Optional[str] = None
+    school_name: Optional[str] = None
+    graduation_date: Optional[date] = None
+    major_field: Optional[str] = None
+    has_it_qualification: Optional[bool] = None
+    it_qualification_name: Optional[str] = None
+    japanese_level: Optional[str] = None
+    has_criminal_record: Optional[bool] = None
+
+    # Concurrencia optimista (alternativa a If-Match): el updated_at que leyó el cliente
+    updated_at: Optional[datetime] = None
+
+    validate_updated_at = validator('updated_at', allow_reuse=True)(_check_naive_timestamp)
+    validate_card = validator('residence_card_number', allow_reuse=True)(_check_residence_card)
+    validate_postal = validator('postal_code_japan', allow_reuse=True)(_check_postal_code)
+    validate_phone = validator('telephone_japan', 'cellular_phone', allow_reuse=True)(_check_phone)
+
 class HakenMoto(BaseModel):
     company_name: str
     corporation_number: Optional[str] = None
@@ -228,6 +364,15 @@ class OCRExtractRequest(BaseModel):
     document_type: str = Field(..., pattern='^(zairyu_card|passport)$')
     employee_id: Optional[int] = None
 
+class OCRBatchItem(BaseModel):
+    image_base64: str
+    document_type: Optional[str] = Field(None, pattern='^(zairyu_card|passport)$')
+    filename: Optional[str] = None
+
+class OCRBatchRequest(BaseModel):
+    images: List[OCRBatchItem] = Field(..., min_length=1)
+    document_type: str = Field("zairyu_card", pattern='^(zairyu_card|passport)$')
+
 class OCRExtractResponse(BaseModel):
     success: bool
     document_type: Optional[str] = None
@@ -235,25 +380,6 @@ class OCRExtractResponse(BaseModel):
     missing_fields: Optional[dict] = None
     error: Optional[str] = None
 
-class VisaApplication(BaseModel):
-    employee_id: int
-    application_type: str = Field(..., pattern='^(認定|変更|更新)$')
-    submission_office: str
-    requested_period: str
-    reason: str
-
-class EmploymentContractCreate(BaseModel):
-    employee_id: int
-    haken_moto_id: int = 1
-    contract_start_date: date
-    salary_amount: int
-    salary_type: str = "monthly"
-
-class DispatchAssignmentCreate(BaseModel):
-    employee_id: int
-    haken_saki_id: int = 1
-    dispatch_start_date: date
-
 class HakenSakiCreate(BaseModel):
     company_name: str
 
@@ -292,13 +418,15 @@ async def create_employee(emp: EmployeeCreate):
             emp.has_it_qualification, emp.it_qualification_name, emp.japanese_level, emp.has_criminal_record)
         
         result = dict(row)
+        audit.record("employees", result["id"], "INSERT", new=result)
         if result.get('current_expiration_date'):
             result['visa_status'] = Validators.visa_status(result['current_expiration_date'])
         return result
 
 @app.get("/api/employees", tags=["Employees"])
-async def list_employees(skip: int = 0, limit: int = 100, nationality: Optional[str] = None):
-    """従業員一覧"""
+async def list_employees(skip: int = 0, limit: int = 100, nationality: Optional[str] = None,
+                         etag: str = Depends(table_etag("employees", daily=True))):
+    """従業員一覧 (ETag: 304 si employees no cambió desde la última lectura)"""
     query = "SELECT * FROM employees WHERE employment_status = 'active'"
     params = []
     if nationality:
@@ -306,7 +434,7 @@ async def list_employees(skip: int = 0, limit: int = 100, nationality: Optional[
         params.append(nationality)
     query += f" ORDER BY current_expiration_date ASC LIMIT {limit} OFFSET {skip}"
     
-    pool = await get_db_pool()
+    pool = await get_read_pool()
     async with pool.acquire() as conn:
         rows = await conn.fetch(query, *params)
         results = []
@@ -318,29 +446,105 @@ async def list_employees(skip: int = 0, limit: int = 100, nationality: Optional[
         return results
 
 @app.get("/api/employees/{id}", tags=["Employees"])
-async def get_employee(id: int):
-    """従業員詳細"""
-    pool = await get_db_pool()
+async def get_employee(id: int, request: Request, response: Response):
+    """従業員詳細 (ETag: updated_at de la fila; vale como If-Match en PATCH)"""
+    pool = await get_read_pool()
     async with pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT * FROM employees WHERE id = $1", id)
+        row = await queries.fetchrow(conn, "employee_by_id", id)
         if not row:
             raise HTTPException(404, "従業員が見つかりません")
+        row_etag(request, response, row['updated_at'])
         emp = dict(row)
         if emp.get('current_expiration_date'):
             emp['visa_status'] = Validators.visa_status(emp['current_expiration_date'])
         return emp
 
+@app.get("/api/employees/{id}/full", tags=["Employees"])
+async def get_employee_full_detail(id: int):
+    """従業員詳細（家族・職歴・契約・派遣先・申請履歴を含む）"""
+    pool = await get_read_pool()
+    async with pool.acquire() as conn:
+        emp = await get_employee_full(conn, id)
+    if not emp:
+        raise HTTPException(404, "従業員が見つかりません")
+    if emp.get('current_expiration_date'):
+        emp['visa_status'] = Validators.visa_status(emp['current_expiration_date'])
+    return emp
+
+def _if_match_updated_at(if_match: str) -> Optional[datetime]:
+    """
+    updated_at esperado según If-Match; None para "*". Un ETag ilegible no puede coincidir: 412.
+
+    Desviación de RFC 9110 (If-Match exige comparación fuerte): se acepta el ETag
+    débil de GET/PATCH (row_version_tag) y solo cuenta el updated_at, no la fecha
+    tras "@". Es débil porque nginx recomprime las respuestas; updated_at identifica
+    igualmente la versión de la fila, que es lo que protege la concurrencia optimista.
+    """
+    tag = if_match.strip()
+    if tag == "*":
+        return None
+    tag = tag.removeprefix("W/").strip('"').split("@")[0]
+    try:
+        return _naive_timestamp(datetime.fromisoformat(tag))
+    except ValueError:
+        raise HTTPException(412, "If-Match が一致しません")
+
+@app.patch("/api/employees/{id}", tags=["Employees"])
+async def patch_employee(id: int, changes: EmployeeUpdate, response: Response,
+                         if_match: Optional[str] = Header(None)):
+    """
+    従業員の部分更新 - Partial update: only the fields sent are written.
+    Con If-Match (ETag) o updated_at en el cuerpo, 412 si otro usuario lo cambió antes.
+    """
+    data = changes.dict(exclude_unset=True)
+    expected = data.pop("updated_at", None)
+    if if_match:
+        expected = _if_match_updated_at(if_match)
+    cleared = sorted(k for k in EMPLOYEE_REQUIRED_FIELDS if k in data and data[k] is None)
+    if cleared:
+        raise HTTPException(422, f"必須項目は空にできません: {', '.join(cleared)}")
+
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        if not data:
+            row = await queries.fetchrow(conn, "employee_by_id", id)
+            if not row:
+                raise HTTPException(404, "従業員が見つかりません")
+            result = dict(row)
+        else:
+            set_clauses = [f"{k} = ${i + 3}" for i, k in enumerate(data)]
+            # La condición sobre updated_at va en la tabla destino: con una edición
+            # concurrente Postgres la vuelve a evaluar sobre la versión nueva de la fila
+            row = await conn.fetchrow(f"""
+                UPDATE employees SET {', '.join(set_clauses)}
+                FROM employees old
+                WHERE employees.id = $1 AND old.id = employees.id
+                AND ($2::timestamp IS NULL OR employees.updated_at = $2)
+                RETURNING employees.*, old AS _old
+            """, id, expected, *data.values())
+            if not row:
+                current = await conn.fetchrow("SELECT updated_at FROM employees WHERE id = $1", id)
+                if not current:
+                    raise HTTPException(404, "従業員が見つかりません")
+                etag = row_version_tag(current["updated_at"])
+                raise HTTPException(412, "他のユーザーが先に更新しました。再読み込みしてください",
+                                    headers={"ETag": etag} if etag else None)
+            result, old = audit.split_old(row)
+            audit.record("employees", id, "UPDATE", old, result)
+
+    if result.get('current_expiration_date'):
+        result['visa_status'] = Validators.visa_status(result['current_expiration_date'])
+    # El mismo ETag que daría GET /api/employees/{id}
+    if result.get('updated_at'):
+        response.headers["ETag"] = row_version_tag(result['updated_at'])
+    return result
+
 @app.put("/api/employees/{id}", tags=["Employees"])
 async def update_employee(id: int, emp: EmployeeCreate):
-    """従業員更新"""
+    """従業員更新（全項目）- Para cambios parciales, PATCH"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        # Check if exists
-        exists = await conn.fetchval("SELECT 1 FROM employees WHERE id = $1", id)
-        if not exists:
-            raise HTTPException(404, "従業員が見つかりません")
-
-        # Update
+        # Update (old: la fila anterior, para el diff de auditoría)
         row = await conn.fetchrow("""
             UPDATE employees SET
                 family_name = $2, given_name = $3, family_name_kanji = $4, given_name_kanji = $5,
@@ -350,8 +554,9 @@ async def update_employee(id: int, emp: EmployeeCreate):
                 current_visa_status = $20, current_period_of_stay = $21, current_expiration_date = $22, residence_card_number = $23,
                 school_location = $24, school_name = $25, graduation_date = $26, major_field = $27,
                 has_it_qualification = $28, it_qualification_name = $29, japanese_level = $30, has_criminal_record = $31
-            WHERE id = $1
-            RETURNING *
+            FROM employees old
+            WHERE employees.id = $1 AND old.id = employees.id
+            RETURNING employees.*, old AS _old
         """, id, emp.family_name, emp.given_name, emp.family_name_kanji, emp.given_name_kanji,
             emp.nationality, emp.date_of_birth, emp.sex, emp.marital_status, emp.place_of_birth, emp.home_town_city,
             emp.postal_code_japan, emp.address_japan, emp.telephone_japan, emp.cellular_phone, emp.email,
@@ -359,8 +564,12 @@ async def update_employee(id: int, emp: EmployeeCreate):
             emp.current_visa_status, emp.current_period_of_stay, emp.current_expiration_date, emp.residence_card_number,
             emp.school_location, emp.school_name, emp.graduation_date, emp.major_field,
             emp.has_it_qualification, emp.it_qualification_name, emp.japanese_level, emp.has_criminal_record)
-        
-        return dict(row)
+        if not row:
+            raise HTTPException(404, "従業員が見つかりません")
+
+        result, old = audit.split_old(row)
+        audit.record("employees", id, "UPDATE", old, result)
+        return result
 
 
 @app.delete("/api/employees/{id}", tags=["Employees"])
@@ -368,12 +577,17 @@ async def delete_employee(id: int):
     """従業員削除 (論理削除)"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        # Verificar si existe primero
-        exists = await conn.fetchval("SELECT 1 FROM employees WHERE id = $1", id)
-        if not exists:
+        row = await conn.fetchrow("""
+            UPDATE employees SET employment_status = 'inactive'
+            FROM employees old
+            WHERE employees.id = $1 AND old.id = employees.id
+            RETURNING old.employment_status
+        """, id)
+        if not row:
             raise HTTPException(404, "従業員が見つかりません")
 
-        await conn.execute("UPDATE employees SET employment_status = 'inactive' WHERE id = $1", id)
+        audit.record("employees", id, "DELETE",
+                     {"employment_status": row["employment_status"]}, {"employment_status": "inactive"})
         return {"message": "削除しました"}
 
 @app.get("/api/employees/card/{card_number}", tags=["Employees"])
@@ -382,40 +596,13 @@ async def get_by_card(card_number: str):
     if not Validators.residence_card(card_number):
         raise HTTPException(400, "在留カード番号の形式が無効です")
     
-    pool = await get_db_pool()
+    pool = await get_read_pool()
     async with pool.acquire() as conn:
-        row = await conn.fetchrow(
-            "SELECT * FROM employees WHERE residence_card_number = $1",
-            card_number.upper()
-        )
+        row = await queries.fetchrow(conn, "employee_by_card", card_number.upper())
         if not row:
             raise HTTPException(404, "従業員が見つかりません")
         return dict(row)
 
-@app.post("/api/employment-contracts", tags=["Employment Contracts"])
-async def create_employment_contract(contract: EmploymentContractCreate):
-    """雇用契約を作成"""
-    pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow("""
-            INSERT INTO employment_contracts (employee_id, haken_moto_id, contract_start_date, salary_amount, salary_type)
-            VALUES ($1, $2, $3, $4, $5)
-            RETURNING *
-        """, contract.employee_id, contract.haken_moto_id, contract.contract_start_date, contract.salary_amount, contract.salary_type)
-        return dict(row)
-
-@app.post("/api/dispatch-assignments", tags=["Dispatch Assignments"])
-async def create_dispatch_assignment(assignment: DispatchAssignmentCreate):
-    """派遣契約を作成"""
-    pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow("""
-            INSERT INTO dispatch_assignments (employee_id, haken_saki_id, dispatch_start_date)
-            VALUES ($1, $2, $3)
-            RETURNING *
-        """, assignment.employee_id, assignment.haken_saki_id, assignment.dispatch_start_date)
-        return dict(row)
-
 # ============================================================
 # ENDPOINTS - OCR
 # ============================================================
@@ -477,34 +664,14 @@ async def import_ocr(data: OCRData):
 # ============================================================
 
 @app.get("/api/alerts/expiring", tags=["Alerts"])
-async def expiring_visas(days: int = 90):
+async def expiring_visas(days: int = 90, etag: str = Depends(table_etag("visa_expiry_alerts", daily=True))):
     """期限切れ間近のビザ"""
-    pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        rows = await conn.fetch("""
-            SELECT id, employee_code, family_name, given_name, nationality,
-                   current_visa_status, current_expiration_date, residence_card_number,
-                   (current_expiration_date - CURRENT_DATE) as days_left
-            FROM employees
-            WHERE employment_status = 'active'
-              AND current_expiration_date BETWEEN CURRENT_DATE AND CURRENT_DATE + $1::interval
-            ORDER BY current_expiration_date
-        """, f"{days} days")
-        
-        alerts = []
-        for row in rows:
-            a = dict(row)
-            d = a['days_left'].days
-            a['days_remaining'] = d
-            a['urgency'] = 'critical' if d <= 30 else 'warning' if d <= 60 else 'info'
-            del a['days_left']
-            alerts.append(a)
-        
-        return {
-            "total": len(alerts),
-            "critical": len([a for a in alerts if a['urgency'] == 'critical']),
-            "alerts": alerts
-        }
+    alerts = await get_expiring(days)
+    return {
+        "total": len(alerts),
+        "critical": len([a for a in alerts if a['urgency'] == 'critical']),
+        "alerts": alerts
+    }
 
 # ============================================================
 # ENDPOINTS - VALIDATE
@@ -532,9 +699,9 @@ async def validate_corp(number: str):
 # ============================================================
 
 @app.get("/api/stats", tags=["Stats"])
-async def dashboard_stats():
+async def dashboard_stats(etag: str = Depends(table_etag("employees", daily=True))):
     """ダッシュボード統計"""
-    pool = await get_db_pool()
+    pool = await get_read_pool()
     async with pool.acquire() as conn:
         total = await conn.fetchval("SELECT COUNT(*) FROM employees WHERE employment_status='active'")
         
@@ -564,22 +731,8 @@ async def dashboard_stats():
 # ENDPOINTS - OCR
 # ============================================================
 
-@app.post("/api/ocr/scan", tags=["OCR"])
-async def ocr_scan(request: OCRExtractRequest):
-    """
-    OCRで在留カード・パスポートを読み取り
-    Scan residence card or passport using Claude Vision OCR
-
-    - document_type: "zairyu_card" or "passport"
-    - image_base64: Base64 encoded image (without data:image/... prefix)
-    - employee_id: Optional - if provided, will show which fields are missing
-    """
-    # Extraer datos de la imagen
-    result = OCRService.extract_from_image(
-        request.image_base64,
-        request.document_type
-    )
-
+async def _build_scan_response(result: dict, document_type: str, employee_id: Optional[int]) -> dict:
+    """Respuesta común de /api/ocr/scan y /api/ocr/scan/upload"""
     if not result["success"]:
         raise HTTPException(
             status_code=400,
@@ -588,18 +741,20 @@ async def ocr_scan(request: OCRExtractRequest):
 
     response = {
         "success": True,
-        "document_type": request.document_type,
-        "extracted_data": result["extracted_data"]
+        "document_type": document_type,
+        "extracted_data": result["extracted_data"],
+        "cached": result.get("cached", False),
+        "source": result.get("source"),
+        "confidence": result.get("confidence"),
+        "field_confidence": result.get("field_confidence"),
+        "scan_id": result.get("scan_id")
     }
 
     # Si se proporciona employee_id, mostrar campos faltantes
-    if request.employee_id:
+    if employee_id:
         pool = await get_db_pool()
         async with pool.acquire() as conn:
-            emp_row = await conn.fetchrow(
-                "SELECT * FROM employees WHERE id = $1",
-                request.employee_id
-            )
+            emp_row = await queries.fetchrow(conn, "employee_by_id", employee_id)
             if emp_row:
                 employee_data = dict(emp_row)
                 response["missing_fields"] = OCRService.get_missing_fields(employee_data)
@@ -611,6 +766,176 @@ async def ocr_scan(request: OCRExtractRequest):
 
     return response
 
+@app.post("/api/ocr/scan", tags=["OCR"])
+async def ocr_scan(request: OCRExtractRequest):
+    """
+    OCRで在留カード・パスポートを読み取り
+    Scan residence card or passport using Claude Vision OCR
+
+    - document_type: "zairyu_card" or "passport"
+    - image_base64: Base64 encoded image (without data:image/... prefix)
+    - employee_id: Optional - if provided, will show which fields are missing
+    """
+    try:
+        image_bytes = decode_base64_image(request.image_base64)
+    except ValueError:
+        raise HTTPException(400, "画像のbase64が無効です")
+
+    # Preprocesado + caché + Claude Vision (fuera del event loop)
+    result = await OCRService.scan(image_bytes, request.document_type, request.employee_id)
+    return await _build_scan_response(result, request.document_type, request.employee_id)
+
+@app.post("/api/ocr/scan/upload", tags=["OCR"])
+async def ocr_scan_upload(
+    file: UploadFile = File(...),
+    document_type: str = Form(..., pattern='^(zairyu_card|passport)$'),
+    employee_id: Optional[int] = Form(None)
+):
+    """
+    OCRで読み取り（multipartアップロード）
+    Same as /api/ocr/scan but takes the image as a multipart file (no base64 overhead)
+    """
+    image_bytes = await file.read()
+    if not image_bytes:
+        raise HTTPException(400, "画像がありません")
+
+    result = await OCRService.scan(image_bytes, document_type, employee_id)
+    return await _build_scan_response(result, document_type, employee_id)
+
+
+# Límites del escaneo por lotes
+OCR_BATCH_CONCURRENCY = int(os.getenv("OCR_BATCH_CONCURRENCY", "4"))
+OCR_BATCH_MAX_IMAGES = int(os.getenv("OCR_BATCH_MAX_IMAGES", "100"))
+
+async def _parse_ocr_batch(request: Request) -> List[dict]:
+    """Lee el lote desde multipart (campo files, repetido) o JSON (images[] en base64)"""
+    content_type = request.headers.get("content-type", "")
+
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        default_type = form.get("document_type") or "zairyu_card"
+        if default_type not in ("zairyu_card", "passport"):
+            raise HTTPException(400, f"Tipo de documento no soportado: {default_type}")
+        items = []
+        for upload in form.getlist("files"):
+            # request.form() da UploadFile de starlette (fastapi.UploadFile es una subclase)
+            if not isinstance(upload, FormFile):
+                raise HTTPException(400, "files にはファイルを指定してください")
+            items.append({
+                "image_bytes": await upload.read(),
+                "document_type": default_type,
+                "filename": upload.filename,
+            })
+    else:
+        try:
+            batch = OCRBatchRequest(**(await request.json()))
+        except Exception as e:
+            raise HTTPException(422, f"リクエストの形式が無効です: {str(e)}")
+        items = []
+        for item in batch.images:
+            try:
+                image_bytes = decode_base64_image(item.image_base64)
+            except ValueError:
+                raise HTTPException(400, f"画像のbase64が無効です: {item.filename or len(items)}")
+            items.append({
+                "image_bytes": image_bytes,
+                "document_type": item.document_type or batch.document_type,
+                "filename": item.filename,
+            })
+
+    if not items:
+        raise HTTPException(400, "画像がありません")
+    if len(items) > OCR_BATCH_MAX_IMAGES:
+        raise HTTPException(400, f"一度に処理できる画像は{OCR_BATCH_MAX_IMAGES}枚までです")
+    return items
+
+async def _match_employee_by_card(card_number: Optional[str]) -> Optional[dict]:
+    """在留カード番号で既存の従業員を検索"""
+    if not card_number or not Validators.residence_card(card_number):
+        return None
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow(
+            "SELECT id, employee_code, family_name, given_name FROM employees WHERE residence_card_number = $1",
+            card_number.upper()
+        )
+    return dict(row) if row else None
+
+async def _ocr_batch_stream(items: List[dict]):
+    """Procesa el lote con concurrencia limitada y emite NDJSON según terminan"""
+    semaphore = asyncio.Semaphore(OCR_BATCH_CONCURRENCY)
+
+    async def run(index: int, item: dict):
+        async with semaphore:
+            result = await OCRService.scan(item["image_bytes"], item["document_type"])
+        return index, item, result
+
+    tasks = [asyncio.create_task(run(i, item)) for i, item in enumerate(items)]
+    succeeded = 0
+    matched = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            index, item, result = await next_done
+            line = {
+                "index": index,
+                "scan_id": result.get("scan_id"),
+                "filename": item.get("filename"),
+                "document_type": item["document_type"],
+                "success": result["success"],
+            }
+            if result["success"]:
+                succeeded += 1
+                extracted = result["extracted_data"]
+                line["extracted_data"] = extracted
+                line["cached"] = result.get("cached", False)
+                line["confidence"] = result.get("confidence")
+                line["field_confidence"] = result.get("field_confidence")
+                employee = await _match_employee_by_card(extracted.get("residence_card_number"))
+                line["matched_employee"] = employee
+                if employee:
+                    matched += 1
+            else:
+                line["error"] = result.get("error", "OCR処理に失敗しました")
+            yield json.dumps(line, ensure_ascii=False, default=str) + "\n"
+
+        yield json.dumps({
+            "summary": True,
+            "total": len(items),
+            "succeeded": succeeded,
+            "failed": len(items) - succeeded,
+            "matched": matched,
+        }, ensure_ascii=False) + "\n"
+    finally:
+        # Si el cliente se desconecta, cancelar lo pendiente
+        for task in tasks:
+            task.cancel()
+
+@app.post("/api/ocr/batch", tags=["OCR"])
+async def ocr_batch(request: Request):
+    """
+    複数の在留カード・パスポートを一括OCR
+    Batch scan residence cards / passports, streamed as NDJSON
+
+    - multipart/form-data: files (una parte por imagen) + document_type
+    - application/json: {"document_type": "...", "images": [{"image_base64": "...", "filename": "..."}]}
+
+    Cada línea es un resultado en orden de finalización (campo "index" = posición
+    original); la última línea es un resumen con "summary": true.
+    """
+    items = await _parse_ocr_batch(request)
+    return StreamingResponse(
+        _ocr_batch_stream(items),
+        media_type="application/x-ndjson",
+        # Cada línea sale en cuanto termina su imagen: sin buffering en nginx
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/ocr/cache/stats", tags=["OCR"])
+async def ocr_cache_stats():
+    """OCRキャッシュの統計 - OCR result cache statistics"""
+    return ocr_cache.stats()
+
 
 @app.get("/api/employees/{id}/missing-fields", tags=["Employees"])
 async def get_employee_missing_fields(id: int):
@@ -618,9 +943,9 @@ async def get_employee_missing_fields(id: int):
     従業員の未入力フィールドを取得
     Get missing/empty fields for an employee
     """
-    pool = await get_db_pool()
+    pool = await get_read_pool()
     async with pool.acquire() as conn:
-        emp_row = await conn.fetchrow("SELECT * FROM employees WHERE id = $1", id)
+        emp_row = await queries.fetchrow(conn, "employee_by_id", id)
         if not emp_row:
             raise HTTPException(404, "従業員が見つかりません")
 
@@ -650,7 +975,7 @@ async def fill_employee_from_ocr(id: int, ocr_data: dict):
     pool = await get_db_pool()
     async with pool.acquire() as conn:
         # Obtener datos actuales
-        emp_row = await conn.fetchrow("SELECT * FROM employees WHERE id = $1", id)
+        emp_row = await queries.fetchrow(conn, "employee_by_id", id)
         if not emp_row:
             raise HTTPException(404, "従業員が見つかりません")
 
@@ -691,6 +1016,7 @@ async def fill_employee_from_ocr(id: int, ocr_data: dict):
         # Ejecutar UPDATE
         query = f"UPDATE employees SET {', '.join(updates)} WHERE id = $1 RETURNING *"
         updated_row = await conn.fetchrow(query, *values)
+        audit.record("employees", id, "UPDATE", employee_data, dict(updated_row))
 
         return {
             "message": "従業員情報を更新しました",
@@ -712,7 +1038,8 @@ async def generate_excel(data: dict):
     Generate visa renewal application form (Excel)
     """
     try:
-        excel_file = generate_visa_renewal_excel(data)
+        with metrics.timed("excel"):
+            excel_file = generate_visa_renewal_excel(data)
 
         # Get employee name for filename
         name = f"{data.get('family_name', '')}_{data.get('given_name', '')}"
@@ -743,7 +1070,8 @@ async def generate_coe_excel(data: dict):
         data['submission_office'] = data.get('submission_office', '名古屋')
 
         # Generate renewal form (COE format is similar)
-        excel_file = generator.generate_renewal_form(data)
+        with metrics.timed("excel"):
+            excel_file = generator.generate_renewal_form(data)
 
         # Get applicant name for filename
         name = f"{data.get('family_name', '')}_{data.get('given_name', '')}"
@@ -769,6 +1097,25 @@ async def health():
     except Exception:
         return {"status": "error", "db": "disconnected"}
 
+@app.get("/metrics", tags=["Metrics"], response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """
+    Prometheus text format: per-route latency histograms, status counts,
+    in-flight requests, DB/Excel/OCR time and pool gauges
+    """
+    return PlainTextResponse(
+        metrics.render_prometheus(get_pool_stats()),
+        media_type="text/plain; version=0.0.4"
+    )
+
+@app.get("/metrics/db", tags=["Metrics"])
+async def db_metrics():
+    """
+    DBプールの状態 - Connection pool size, idle count and acquire wait time,
+    plus per-query timing for the prepared-statement registry
+    """
+    return {"pools": get_pool_stats(), "queries": queries.get_query_stats()}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,204 @@
+# ============================================================
+# UNS VISA SYSTEM - Metrics
+# Latencia por ruta, códigos de estado, peticiones en curso y desglose por
+# petición (BD / Excel / OCR). Formato texto de Prometheus en /metrics y
+# cabecera Server-Timing en cada respuesta.
+# ============================================================
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Límites (segundos) de los histogramas
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SECTION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Secciones que se miden aparte dentro de una petición
+SECTIONS = ("db", "excel", "ocr")
+
+
+class Histogram:
+    def __init__(self, buckets: Iterable[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class RequestTiming:
+    """
+    Acumulador mutable de la petición actual. Vive en un ContextVar: las tareas
+    y hilos lanzados desde la petición copian el contexto, pero comparten este
+    mismo objeto, así que todo suma en la misma petición.
+    """
+
+    __slots__ = ("sections", "db_queries")
+
+    def __init__(self):
+        self.sections: Dict[str, float] = {}
+        self.db_queries = 0
+
+    def add(self, section: str, seconds: float):
+        self.sections[section] = self.sections.get(section, 0.0) + seconds
+
+
+_current: ContextVar[Optional[RequestTiming]] = ContextVar("request_timing", default=None)
+
+# Los callbacks de asyncpg y los hilos de to_thread también escriben
+_lock = threading.Lock()
+
+_request_duration: Dict[Tuple[str, str], Histogram] = {}
+_request_sections: Dict[Tuple[str, str, str], float] = {}
+_request_db_queries: Dict[Tuple[str, str], int] = {}
+_requests_total: Dict[Tuple[str, str, str], int] = {}
+_section_duration: Dict[str, Histogram] = {}
+_in_flight = 0
+
+
+def start_request() -> Tuple[RequestTiming, object]:
+    global _in_flight
+    with _lock:
+        _in_flight += 1
+    timing = RequestTiming()
+    return timing, _current.set(timing)
+
+
+def finish_request(token, timing: RequestTiming, method: str, route: str, status: int, seconds: float):
+    global _in_flight
+    _current.reset(token)
+    with _lock:
+        _in_flight -= 1
+        key = (method, route)
+        _request_duration.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(seconds)
+        status_key = (method, route, str(status))
+        _requests_total[status_key] = _requests_total.get(status_key, 0) + 1
+        for section, value in timing.sections.items():
+            section_key = (method, route, section)
+            _request_sections[section_key] = _request_sections.get(section_key, 0.0) + value
+        _request_db_queries[key] = _request_db_queries.get(key, 0) + timing.db_queries
+
+
+def record_section(section: str, seconds: float):
+    """Suma tiempo a una sección (petición actual + histograma global)"""
+    timing = _current.get()
+    with _lock:
+        if timing is not None:
+            timing.add(section, seconds)
+        _section_duration.setdefault(section, Histogram(SECTION_BUCKETS)).observe(seconds)
+
+
+@contextmanager
+def timed(section: str):
+    """with timed("excel"): ... — mide un bloque síncrono o un await"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_section(section, time.perf_counter() - started)
+
+
+def record_query(record):
+    """
+    Query logger de asyncpg (Connection.add_query_logger). asyncpg lo invoca con
+    loop.call_soon desde la tarea que hizo la consulta, así que ve su contexto.
+    """
+    timing = _current.get()
+    with _lock:
+        if timing is not None:
+            timing.add("db", record.elapsed)
+            timing.db_queries += 1
+        _section_duration.setdefault("db", Histogram(SECTION_BUCKETS)).observe(record.elapsed)
+
+
+def server_timing_header(timing: RequestTiming, total_seconds: float) -> str:
+    parts = [f"app;dur={total_seconds * 1000:.1f}"]
+    for section in SECTIONS:
+        if section in timing.sections:
+            entry = f"{section};dur={timing.sections[section] * 1000:.1f}"
+            if section == "db":
+                entry += f';desc="{timing.db_queries} queries"'
+            parts.append(entry)
+    return ", ".join(parts)
+
+
+# ============================================================
+# PROMETHEUS
+# ============================================================
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _histogram_lines(name: str, hist: Histogram, **labels) -> List[str]:
+    lines = []
+    cumulative = 0
+    for bound, count in zip(hist.buckets, hist.counts):
+        cumulative += count
+        lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}")
+    lines.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {hist.count}")
+    lines.append(f"{name}_sum{_labels(**labels)} {hist.sum:.6f}")
+    lines.append(f"{name}_count{_labels(**labels)} {hist.count}")
+    return lines
+
+
+def render_prometheus(pool_stats: Optional[List[dict]] = None) -> str:
+    lines: List[str] = []
+    with _lock:
+        lines += ["# HELP http_requests_in_flight Requests currently being served",
+                  "# TYPE http_requests_in_flight gauge",
+                  f"http_requests_in_flight {_in_flight}"]
+
+        lines += ["# HELP http_requests_total Requests by route and status code",
+                  "# TYPE http_requests_total counter"]
+        for (method, route, status), count in sorted(_requests_total.items()):
+            lines.append(f"http_requests_total{_labels(method=method, route=route, status=status)} {count}")
+
+        lines += ["# HELP http_request_duration_seconds Request latency by route",
+                  "# TYPE http_request_duration_seconds histogram"]
+        for (method, route), hist in sorted(_request_duration.items()):
+            lines += _histogram_lines("http_request_duration_seconds", hist, method=method, route=route)
+
+        lines += ["# HELP http_request_section_seconds_total Time spent in DB / Excel / OCR by route",
+                  "# TYPE http_request_section_seconds_total counter"]
+        for (method, route, section), value in sorted(_request_sections.items()):
+            lines.append(f"http_request_section_seconds_total"
+                         f"{_labels(method=method, route=route, section=section)} {value:.6f}")
+
+        lines += ["# HELP http_request_db_queries_total DB queries issued by route",
+                  "# TYPE http_request_db_queries_total counter"]
+        for (method, route), count in sorted(_request_db_queries.items()):
+            lines.append(f"http_request_db_queries_total{_labels(method=method, route=route)} {count}")
+
+        lines += ["# HELP section_duration_seconds Duration of each DB query / Excel build / OCR call",
+                  "# TYPE section_duration_seconds histogram"]
+        for section, hist in sorted(_section_duration.items()):
+            lines += _histogram_lines("section_duration_seconds", hist, section=section)
+
+    if pool_stats:
+        gauges = (("size", "db_pool_size"), ("idle", "db_pool_idle"), ("in_use", "db_pool_in_use"),
+                  ("waiting", "db_pool_waiting"))
+        for key, name in gauges:
+            lines += [f"# TYPE {name} gauge"]
+            lines += [f"{name}{_labels(pool=p['name'])} {p[key]}" for p in pool_stats]
+        lines += ["# TYPE db_pool_acquire_wait_seconds_total counter"]
+        lines += [f"db_pool_acquire_wait_seconds_total{_labels(pool=p['name'])} "
+                  f"{p['acquire_wait_total_ms'] / 1000:.6f}" for p in pool_stats]
+        lines += ["# TYPE db_pool_acquire_timeouts_total counter"]
+        lines += [f"db_pool_acquire_timeouts_total{_labels(pool=p['name'])} {p['acquire_timeouts']}"
+                  for p in pool_stats]
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,178 @@
+# ============================================================
+# UNS VISA SYSTEM - Passport MRZ Reader
+# Lectura local de la zona MRZ (ICAO 9303, TD3) con dígitos de control
+# ============================================================
+
+import io
+import os
+import re
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+try:
+    import pytesseract
+    from PIL import Image, ImageOps
+except ImportError:  # Sin Tesseract/Pillow: siempre se usa Claude Vision
+    pytesseract = None
+
+OCR_MRZ_ENABLED = os.getenv("OCR_MRZ_ENABLED", "true").lower() == "true"
+
+# Fracción inferior de la página donde buscar la MRZ
+_MRZ_BAND = 0.35
+_TD3_LENGTH = 44
+
+# ISO 3166-1 alpha-3 -> nacionalidad en japonés (mismo formato que el prompt de pasaporte)
+NATIONALITY_ISO3 = {
+    "VNM": "ベトナム",
+    "CHN": "中国",
+    "PHL": "フィリピン",
+    "IDN": "インドネシア",
+    "NPL": "ネパール",
+    "BRA": "ブラジル",
+    "MMR": "ミャンマー",
+    "THA": "タイ",
+    "KHM": "カンボジア",
+    "LKA": "スリランカ",
+    "BGD": "バングラデシュ",
+    "IND": "インド",
+    "MNG": "モンゴル",
+    "UZB": "ウズベキスタン",
+    "PER": "ペルー",
+    "KOR": "韓国",
+}
+
+# Confusiones típicas de OCR en campos numéricos
+_TO_DIGIT = str.maketrans({"O": "0", "Q": "0", "D": "0", "I": "1", "L": "1", "Z": "2",
+                           "S": "5", "G": "6", "B": "8"})
+
+
+def check_digit(value: str) -> str:
+    """Dígito de control ICAO 9303 (pesos 7-3-1)"""
+    weights = (7, 3, 1)
+    total = 0
+    for i, ch in enumerate(value):
+        if ch.isdigit():
+            n = int(ch)
+        elif "A" <= ch <= "Z":
+            n = ord(ch) - 55
+        else:  # '<'
+            n = 0
+        total += n * weights[i % 3]
+    return str(total % 10)
+
+
+def _parse_date(yymmdd: str, future: bool) -> Optional[str]:
+    """YYMMDD -> YYYY-MM-DD; las fechas de caducidad siempre son 20xx"""
+    try:
+        yy, mm, dd = int(yymmdd[0:2]), int(yymmdd[2:4]), int(yymmdd[4:6])
+    except ValueError:
+        return None
+    if future:
+        year = 2000 + yy
+    else:
+        year = 1900 + yy if yy > date.today().year % 100 else 2000 + yy
+    try:
+        return date(year, mm, dd).isoformat()
+    except ValueError:
+        return None
+
+
+def parse_td3(line1: str, line2: str) -> Optional[Dict[str, Any]]:
+    """
+    Interpreta las dos líneas MRZ de un pasaporte (TD3, 44 caracteres)
+
+    Returns:
+        {"extracted_data": {...}, "checks": {...}, "valid": bool} o None si no es TD3
+    """
+    line1 = line1.strip().upper().replace(" ", "")
+    line2 = line2.strip().upper().replace(" ", "")
+    if len(line1) != _TD3_LENGTH or len(line2) != _TD3_LENGTH or not line1.startswith("P"):
+        return None
+
+    issuer = line1[2:5].replace("<", "")
+    names = line1[5:].split("<<", 1)
+    family_name = names[0].replace("<", " ").strip()
+    given_name = names[1].replace("<", " ").strip() if len(names) > 1 else ""
+
+    number = line2[0:9]
+    number_cd = line2[9]
+    nationality = line2[10:13].replace("<", "")
+    dob = line2[13:19].translate(_TO_DIGIT)
+    dob_cd = line2[19].translate(_TO_DIGIT)
+    sex = line2[20]
+    expiry = line2[21:27].translate(_TO_DIGIT)
+    expiry_cd = line2[27].translate(_TO_DIGIT)
+    optional = line2[28:42]
+    optional_cd = line2[42].translate(_TO_DIGIT)
+    composite_cd = line2[43].translate(_TO_DIGIT)
+
+    checks = {
+        "passport_number": check_digit(number) == number_cd,
+        "date_of_birth": check_digit(dob) == dob_cd,
+        "passport_expiration": check_digit(expiry) == expiry_cd,
+        "personal_number": optional_cd in ("<", "0") if optional.strip("<") == "" else check_digit(optional) == optional_cd,
+        "composite": check_digit(number + number_cd + dob + dob_cd + expiry + expiry_cd + optional + optional_cd) == composite_cd,
+    }
+
+    extracted = {
+        "passport_number": number.replace("<", ""),
+        "family_name": family_name,
+        "given_name": given_name,
+        "nationality": NATIONALITY_ISO3.get(nationality, nationality),
+        "date_of_birth": _parse_date(dob, future=False),
+        "sex": {"M": "male", "F": "female"}.get(sex),
+        "passport_expiration": _parse_date(expiry, future=True),
+        "passport_issue_country": NATIONALITY_ISO3.get(issuer, issuer),
+    }
+    extracted = {k: v for k, v in extracted.items() if v}
+
+    valid = all(checks.values()) and bool(family_name) and "date_of_birth" in extracted \
+        and "passport_expiration" in extracted
+    return {"extracted_data": extracted, "checks": checks, "valid": valid}
+
+
+def find_mrz_lines(text: str) -> Optional[List[str]]:
+    """Busca dos líneas consecutivas con forma de MRZ TD3 en el texto OCR"""
+    candidates = []
+    for raw in text.splitlines():
+        line = re.sub(r"[^A-Z0-9<]", "", raw.upper())
+        if len(line) >= _TD3_LENGTH - 2 and "<" in line:
+            # Tesseract a veces pierde o añade algún '<' final
+            candidates.append(line[:_TD3_LENGTH].ljust(_TD3_LENGTH, "<"))
+    for i in range(len(candidates) - 1):
+        if candidates[i].startswith("P"):
+            return [candidates[i], candidates[i + 1]]
+    return None
+
+
+def read_passport_mrz(image_bytes: bytes) -> Optional[Dict[str, Any]]:
+    """
+    Lee la MRZ de una foto de pasaporte sin salir del servidor.
+
+    Returns:
+        Resultado de parse_td3 más "raw_text", o None si Tesseract no está
+        disponible o no se encontró una MRZ legible.
+    """
+    if not OCR_MRZ_ENABLED or pytesseract is None:
+        return None
+
+    try:
+        img = ImageOps.exif_transpose(Image.open(io.BytesIO(image_bytes))).convert("L")
+        band = img.crop((0, int(img.height * (1 - _MRZ_BAND)), img.width, img.height))
+        band = ImageOps.autocontrast(band)
+        text = pytesseract.image_to_string(
+            band,
+            config="--psm 6 -c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789<"
+        )
+    except Exception:
+        return None
+
+    lines = find_mrz_lines(text)
+    if not lines:
+        return None
+
+    parsed = parse_td3(*lines)
+    if parsed is None:
+        return None
+    parsed["raw_text"] = "\n".join(lines)
+    return parsed
@@ -0,0 +1,266 @@
+# ============================================================
+# UNS VISA SYSTEM - Notifications
+# Generación de avisos de caducidad de visa, bandeja de notificaciones y
+# stream SSE alimentado por LISTEN/NOTIFY de PostgreSQL
+# ============================================================
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Any, Dict, Iterable, List, Optional, Set
+import asyncio
+import json
+import logging
+import os
+
+import asyncpg
+
+from auth import require_role
+from database import get_db_pool, get_db_url, get_read_pool
+
+router = APIRouter(prefix="/api/notifications", tags=["Notifications"])
+
+logger = logging.getLogger(__name__)
+
+# Umbrales en días, p.ej. "90,60,30,14,7"
+NOTIFICATION_THRESHOLDS: List[int] = sorted(
+    {int(t) for t in os.getenv("NOTIFICATION_THRESHOLDS", "90,60,30,14,7").split(",") if t.strip()},
+    reverse=True,
+)
+
+# Canal de pg_notify (trigger notify_notifications_changed en init.sql)
+NOTIFY_CHANNEL = "notifications"
+# Comentario SSE periódico para que proxies no cierren la conexión
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+# Eventos pendientes por cliente; si un cliente lento se llena se descartan los más viejos
+SSE_CLIENT_QUEUE_SIZE = 100
+
+
+async def generate_visa_notifications(thresholds: Optional[Iterable[int]] = None) -> Dict[str, Any]:
+    """
+    Crea los avisos de visa por vencer que falten (una sola sentencia en la BD).
+
+    Returns:
+        {"created": n, "removed": n, "by_threshold": {"30": n, ...}}
+    """
+    values = sorted({int(t) for t in (thresholds or NOTIFICATION_THRESHOLDS) if int(t) >= 0}, reverse=True)
+    if not values:
+        raise ValueError("Se necesita al menos un umbral")
+
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        summary = await conn.fetchval("SELECT create_visa_expiration_notifications($1::int[])", values)
+    summary["thresholds"] = values
+    return summary
+
+
+class NotificationListener:
+    """
+    Una única conexión LISTEN por proceso que reparte los eventos a todos los
+    clientes SSE (en lugar de una conexión por cliente).
+    """
+
+    def __init__(self):
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.connected = False
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SSE_CLIENT_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="notifications-listener")
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def _publish(self, event: str, data: Dict[str, Any]):
+        for queue in list(self._subscribers):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait((event, data))
+
+    def _on_notify(self, conn, pid, channel, payload):
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            return
+        self._publish("notifications", data)
+
+    async def _run(self):
+        backoff = 1.0
+        while self._subscribers:
+            conn = None
+            try:
+                conn = await asyncpg.connect(get_db_url())
+                closed = asyncio.Event()
+                conn.add_termination_listener(lambda _: closed.set())
+                await conn.add_listener(NOTIFY_CHANNEL, self._on_notify)
+                self.connected = True
+                backoff = 1.0
+                # Lo perdido durante la reconexión no llega por NOTIFY: los clientes recargan
+                self._publish("resync", {})
+                while self._subscribers and not closed.is_set():
+                    try:
+                        await asyncio.wait_for(closed.wait(), timeout=SSE_HEARTBEAT_SECONDS)
+                    except asyncio.TimeoutError:
+                        pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("LISTEN %s: conexión perdida: %s", NOTIFY_CHANNEL, e)
+            finally:
+                self.connected = False
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+            if self._subscribers:
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+
+    async def stop(self):
+        self._subscribers.clear()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+notification_listener = NotificationListener()
+
+
+async def stop_notification_listener():
+    await notification_listener.stop()
+
+
+async def _unread_count(conn) -> int:
+    return await conn.fetchval("SELECT COUNT(*) FROM notifications WHERE is_read = FALSE")
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+class MarkReadRequest(BaseModel):
+    ids: List[int] = Field(default_factory=list, max_length=1000)
+    # all=True marca todas (opcionalmente solo un tipo / hasta un id)
+    all: bool = False
+    notification_type: Optional[str] = None
+    up_to_id: Optional[int] = None
+
+
+# ============================================================
+# ENDPOINTS
+# ============================================================
+
+@router.get("")
+async def list_notifications(
+    limit: int = 50,
+    before_id: Optional[int] = None,
+    unread_only: bool = False,
+    notification_type: Optional[str] = None
+):
+    """
+    通知一覧 - Notifications, newest first
+    Keyset pagination: pass next_before_id from the previous page as before_id
+    """
+    limit = max(1, min(limit, 200))
+    pool = await get_read_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT n.id, n.employee_id, n.visa_application_id, n.notification_type,
+                   n.title, n.message, n.due_date, n.days_before_due, n.threshold_days,
+                   n.is_read, n.is_actioned, n.created_at, n.read_at
+            FROM notifications n
+            WHERE ($1::int IS NULL OR n.id < $1)
+              AND (NOT $2::boolean OR n.is_read = FALSE)
+              AND ($3::varchar IS NULL OR n.notification_type = $3)
+            ORDER BY n.id DESC
+            LIMIT $4
+        """, before_id, unread_only, notification_type, limit)
+
+    items = [dict(r) for r in rows]
+    return {
+        "items": items,
+        "next_before_id": items[-1]["id"] if len(items) == limit else None
+    }
+
+
+@router.get("/unread-count")
+async def unread_count():
+    """未読件数 - Unread count (for badges)"""
+    pool = await get_read_pool()
+    async with pool.acquire() as conn:
+        return {"unread": await _unread_count(conn)}
+
+
+@router.post("/mark-read")
+async def mark_read(request: MarkReadRequest):
+    """既読にする - Mark notifications as read (by ids, or all)"""
+    if not request.ids and not request.all:
+        raise HTTPException(400, "ids または all を指定してください")
+
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        if request.all:
+            status = await conn.execute("""
+                UPDATE notifications SET is_read = TRUE, read_at = CURRENT_TIMESTAMP
+                WHERE is_read = FALSE
+                  AND ($1::varchar IS NULL OR notification_type = $1)
+                  AND ($2::int IS NULL OR id <= $2)
+            """, request.notification_type, request.up_to_id)
+        else:
+            status = await conn.execute("""
+                UPDATE notifications SET is_read = TRUE, read_at = CURRENT_TIMESTAMP
+                WHERE id = ANY($1::int[]) AND is_read = FALSE
+            """, request.ids)
+        unread = await _unread_count(conn)
+
+    return {"updated": int(status.split()[-1]), "unread": unread}
+
+
+@router.get("/stream")
+async def notifications_stream(request: Request):
+    """
+    通知ストリーム (Server-Sent Events)
+    Events: "unread" on connect, "notifications" on every insert/update/delete
+    ({op, count, last_id, unread}), "resync" after the listener reconnects
+    """
+    queue = notification_listener.subscribe()
+
+    async def events():
+        try:
+            pool = await get_read_pool()
+            async with pool.acquire() as conn:
+                yield _sse("unread", {"unread": await _unread_count(conn)})
+            while not await request.is_disconnected():
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield _sse(event, data)
+        finally:
+            notification_listener.unsubscribe(queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/generate")
+async def generate_notifications(
+    thresholds: Optional[str] = None,
+    current_user=Depends(require_role(["admin"]))
+):
+    """
+    在留期限通知を生成 - Generate visa-expiry notifications now
+    (thresholds: comma-separated days, defaults to NOTIFICATION_THRESHOLDS)
+    """
+    try:
+        values = [int(t) for t in thresholds.split(",") if t.strip()] if thresholds else None
+        return await generate_visa_notifications(values)
+    except ValueError:
+        raise HTTPException(400, "thresholds は日数のカンマ区切りで指定してください（例：90,60,30）")
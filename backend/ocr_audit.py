@@ -0,0 +1,151 @@
+# ============================================================
+# UNS VISA SYSTEM - OCR Audit
+# Registro de cada escaneo OCR, cola de revisión y estadísticas
+# ============================================================
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import Any, Dict, Optional
+import logging
+from auth import TokenData, get_current_active_user
+from database import get_db_pool, get_read_pool
+
+router = APIRouter(prefix="/api/ocr", tags=["OCR"])
+
+logger = logging.getLogger(__name__)
+
+
+async def record_scan(image_hash: str, document_type: str, model: str, result: Dict[str, Any],
+                      latency_ms: int, employee_id: Optional[int] = None) -> Optional[int]:
+    """
+    Guarda un escaneo en ocr_scans. Nunca lanza: un fallo al auditar no debe
+    romper el escaneo del usuario.
+
+    Returns:
+        id del registro, o None si no se pudo guardar
+    """
+    success = bool(result.get("success"))
+    confidence = result.get("confidence") if success else None
+    try:
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            return await conn.fetchval("""
+                INSERT INTO ocr_scans (
+                    image_hash, document_type, source, model, cached, success,
+                    latency_ms, raw_response, extracted_data, field_confidence,
+                    confidence, confidence_score, needs_review, error, employee_id
+                ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15)
+                RETURNING id
+            """,
+                image_hash,
+                document_type,
+                result.get("source"),
+                model if result.get("source") != "mrz" else None,
+                bool(result.get("cached")),
+                success,
+                latency_ms,
+                result.get("raw_response"),
+                result.get("extracted_data") if success else None,
+                result.get("field_confidence") if success else None,
+                confidence,
+                result.get("confidence_score"),
+                not success or confidence != "high",
+                result.get("error"),
+                employee_id,
+            )
+    except Exception as e:
+        logger.warning("No se pudo registrar el escaneo OCR: %s", e)
+        return None
+
+
+# ============================================================
+# ENDPOINTS
+# ============================================================
+
+@router.get("/review-queue")
+async def ocr_review_queue(limit: int = Query(50, ge=1, le=200), before_id: Optional[int] = None, document_type: Optional[str] = None):
+    """
+    確認待ちのOCR結果
+    Low-confidence or failed scans pending human review (newest first)
+    """
+    pool = await get_read_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT id, document_type, source, cached, success, latency_ms,
+                   extracted_data, field_confidence, confidence, confidence_score,
+                   error, employee_id, created_at
+            FROM ocr_scans
+            WHERE needs_review = TRUE AND reviewed_at IS NULL
+              AND ($1::int IS NULL OR id < $1)
+              AND ($2::varchar IS NULL OR document_type = $2)
+            ORDER BY id DESC
+            LIMIT $3
+        """, before_id, document_type, limit)
+
+    items = [dict(r) for r in rows]
+    return {
+        "items": items,
+        "next_before_id": items[-1]["id"] if len(items) == limit else None
+    }
+
+
+@router.get("/scans/{scan_id}")
+async def get_ocr_scan(scan_id: int):
+    """OCR結果の詳細 - Full audit record, including the raw model response"""
+    pool = await get_read_pool()
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow("SELECT * FROM ocr_scans WHERE id = $1", scan_id)
+    if not row:
+        raise HTTPException(404, "スキャン記録が見つかりません")
+    return dict(row)
+
+
+@router.post("/scans/{scan_id}/review")
+async def review_ocr_scan(scan_id: int, current_user: TokenData = Depends(get_current_active_user)):
+    """確認済みにする - Mark a scan as reviewed by the current user (removes it from the queue)"""
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow("""
+            UPDATE ocr_scans SET reviewed_at = CURRENT_TIMESTAMP, reviewed_by = $2
+            WHERE id = $1
+            RETURNING id, reviewed_at, reviewed_by
+        """, scan_id, current_user.user_id)
+    if not row:
+        raise HTTPException(404, "スキャン記録が見つかりません")
+    return dict(row)
+
+
+@router.get("/stats")
+async def ocr_stats(hours: int = 24):
+    """
+    OCR統計
+    Latency (avg/p50/p95/max), throughput, success, cache and MRZ rates per document type
+    """
+    pool = await get_read_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT document_type,
+                   COUNT(*) AS scans,
+                   COUNT(*) FILTER (WHERE success) AS succeeded,
+                   COUNT(*) FILTER (WHERE cached) AS cached,
+                   COUNT(*) FILTER (WHERE source = 'mrz') AS mrz,
+                   COUNT(*) FILTER (WHERE needs_review) AS needs_review,
+                   ROUND(AVG(latency_ms)) AS avg_latency_ms,
+                   PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY latency_ms) AS p50_latency_ms,
+                   PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY latency_ms) AS p95_latency_ms,
+                   MAX(latency_ms) AS max_latency_ms,
+                   PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY latency_ms)
+                       FILTER (WHERE NOT cached AND source = 'vision') AS p50_vision_latency_ms
+            FROM ocr_scans
+            WHERE created_at > CURRENT_TIMESTAMP - make_interval(hours => $1)
+            GROUP BY document_type
+            ORDER BY document_type
+        """, hours)
+
+    by_type = {}
+    for row in rows:
+        stats = dict(row)
+        document_type = stats.pop("document_type")
+        stats["scans_per_hour"] = round(stats["scans"] / hours, 2) if hours else None
+        by_type[document_type] = stats
+
+    return {"hours": hours, "by_document_type": by_type}
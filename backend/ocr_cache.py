@@ -0,0 +1,133 @@
+# ============================================================
+# UNS VISA SYSTEM - OCR Result Cache
+# Evita volver a llamar a Claude Vision al re-escanear la misma imagen
+# ============================================================
+
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from database import get_db_pool
+
+OCR_CACHE_MAX_ENTRIES = int(os.getenv("OCR_CACHE_MAX_ENTRIES", "500"))
+OCR_CACHE_TTL_SECONDS = int(os.getenv("OCR_CACHE_TTL_SECONDS", str(24 * 3600)))
+OCR_CACHE_PERSIST = os.getenv("OCR_CACHE_PERSIST", "false").lower() == "true"
+
+
+def make_cache_key(image_bytes: bytes, document_type: str, prompt_version: str) -> str:
+    """
+    Clave = hash SHA-256 de la imagen normalizada + tipo de documento + versión del prompt.
+
+    Se usa hash de contenido (no perceptual): dos 在留カード distintas comparten
+    el mismo diseño y un hash perceptual podría devolver los datos de otra persona.
+    """
+    digest = hashlib.sha256()
+    digest.update(image_bytes)
+    digest.update(b"\0" + document_type.encode() + b"\0" + prompt_version.encode())
+    return digest.hexdigest()
+
+
+class OCRResultCache:
+    """Caché LRU en memoria con TTL, opcionalmente respaldada en la tabla ocr_result_cache"""
+
+    def __init__(self, max_entries: int = OCR_CACHE_MAX_ENTRIES,
+                 ttl_seconds: int = OCR_CACHE_TTL_SECONDS,
+                 persist: bool = OCR_CACHE_PERSIST):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persist = persist
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _get_memory(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _set_memory(self, key: str, value: Dict[str, Any]):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self._get_memory(key)
+        if value is None and self.persist:
+            value = await self._get_persisted(key)
+            if value is not None:
+                self._set_memory(key, value)
+
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, document_type: str, value: Dict[str, Any]):
+        self._set_memory(key, value)
+        if self.persist:
+            await self._set_persisted(key, document_type, value)
+
+    async def _get_persisted(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            pool = await get_db_pool()
+            async with pool.acquire() as conn:
+                row = await conn.fetchrow("""
+                    UPDATE ocr_result_cache
+                    SET hit_count = hit_count + 1, last_hit_at = CURRENT_TIMESTAMP
+                    WHERE cache_key = $1 AND expires_at > CURRENT_TIMESTAMP
+                    RETURNING result
+                """, key)
+        except Exception:
+            # La caché nunca debe romper el escaneo
+            return None
+        if not row:
+            return None
+        return row["result"]
+
+    async def _set_persisted(self, key: str, document_type: str, value: Dict[str, Any]):
+        try:
+            pool = await get_db_pool()
+            async with pool.acquire() as conn:
+                await conn.execute("""
+                    INSERT INTO ocr_result_cache (cache_key, document_type, result, expires_at)
+                    VALUES ($1, $2, $3, CURRENT_TIMESTAMP + make_interval(secs => $4))
+                    ON CONFLICT (cache_key) DO UPDATE SET
+                        result = EXCLUDED.result,
+                        expires_at = EXCLUDED.expires_at
+                """, key, document_type, value, float(self.ttl_seconds))
+        except Exception:
+            pass
+
+    def purge_expired(self) -> int:
+        """Elimina entradas caducadas de memoria; devuelve cuántas"""
+        now = time.monotonic()
+        expired = [k for k, (expires_at, _) in self._entries.items() if expires_at < now]
+        for key in expired:
+            del self._entries[key]
+        return len(expired)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "persist": self.persist,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+        }
+
+
+# Instancia compartida por el proceso
+ocr_cache = OCRResultCache()
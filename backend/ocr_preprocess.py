@@ -0,0 +1,106 @@
+# ============================================================
+# UNS VISA SYSTEM - OCR Preprocessing
+# Normaliza fotos de 在留カード / パスポート antes de enviarlas al modelo
+# ============================================================
+
+import base64
+import io
+import os
+from typing import Tuple
+
+try:
+    from PIL import Image, ImageChops, ImageOps
+except ImportError:  # Pillow no instalado: se envía la imagen original
+    Image = None
+
+# Lado más largo que necesita el modelo de visión (más píxeles no mejoran la lectura)
+OCR_MAX_DIMENSION = int(os.getenv("OCR_MAX_DIMENSION", "1568"))
+OCR_JPEG_QUALITY = int(os.getenv("OCR_JPEG_QUALITY", "85"))
+
+# Umbral de diferencia con el fondo para el recorte automático
+_CROP_THRESHOLD = 24
+# No recortar si el documento detectado ocupa menos de esta fracción del área
+_CROP_MIN_AREA = 0.3
+_CROP_MARGIN = 12
+
+
+def decode_base64_image(image_base64: str) -> bytes:
+    """Decodifica base64, aceptando también el prefijo data:image/...;base64,"""
+    if image_base64.startswith("data:"):
+        image_base64 = image_base64.split(",", 1)[-1]
+    return base64.b64decode(image_base64)
+
+
+def detect_media_type(data: bytes) -> str:
+    """Detecta el tipo de imagen por su cabecera"""
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data.startswith(b"\x89PNG"):
+        return "image/png"
+    if data.startswith(b"GIF8"):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+
+def _auto_crop(img: "Image.Image") -> "Image.Image":
+    """Recorta el fondo uniforme alrededor del documento"""
+    background = Image.new(img.mode, img.size, img.getpixel((0, 0)))
+    diff = ImageChops.difference(img, background).convert("L")
+    mask = diff.point(lambda p: 255 if p > _CROP_THRESHOLD else 0)
+    bbox = mask.getbbox()
+    if not bbox:
+        return img
+
+    left, top, right, bottom = bbox
+    area = (right - left) * (bottom - top)
+    if area < img.width * img.height * _CROP_MIN_AREA:
+        # Probablemente ruido o fondo no uniforme: mejor no tocar
+        return img
+
+    return img.crop((
+        max(left - _CROP_MARGIN, 0),
+        max(top - _CROP_MARGIN, 0),
+        min(right + _CROP_MARGIN, img.width),
+        min(bottom + _CROP_MARGIN, img.height),
+    ))
+
+
+def preprocess_image(data: bytes) -> Tuple[bytes, str]:
+    """
+    Prepara la imagen para OCR: orienta según EXIF, recorta bordes,
+    reduce al tamaño que usa el modelo y re-codifica como JPEG.
+
+    Args:
+        data: Bytes de la imagen original (JPEG/PNG/GIF/WebP)
+
+    Returns:
+        (bytes de la imagen procesada, media type)
+    """
+    if Image is None:
+        return data, detect_media_type(data)
+
+    try:
+        original = Image.open(io.BytesIO(data))
+        original_size = original.size
+        img = ImageOps.exif_transpose(original)
+        rotated = img.size != original_size or original.getexif().get(0x0112, 1) != 1
+        img = img.convert("RGB")
+    except Exception:
+        # Formato que Pillow no entiende: dejar que el modelo lo intente
+        return data, detect_media_type(data)
+
+    img = _auto_crop(img)
+    img.thumbnail((OCR_MAX_DIMENSION, OCR_MAX_DIMENSION), Image.LANCZOS)
+    untouched = not rotated and img.size == original_size
+
+    output = io.BytesIO()
+    img.save(output, format="JPEG", quality=OCR_JPEG_QUALITY, optimize=True)
+    processed = output.getvalue()
+
+    # Si la original no necesitaba cambios y ocupa menos, no inflarla
+    if untouched and len(processed) >= len(data):
+        return data, detect_media_type(data)
+
+    return processed, "image/jpeg"
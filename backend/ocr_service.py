@@ -4,11 +4,21 @@
 # ============================================================
 
 import anthropic
+import asyncio
 import base64
+import hashlib
+import json
 import os
 import re
+import time
 from typing import Optional, Dict, Any
-from datetime import datetime
+from datetime import date, datetime
+from ocr_preprocess import decode_base64_image, preprocess_image
+from ocr_cache import make_cache_key, ocr_cache
+from mrz import read_passport_mrz
+from ocr_audit import record_scan
+from validators import Validators
+import metrics
 
 # Inicializar cliente Anthropic
 client = anthropic.Anthropic(
@@ -63,39 +73,187 @@ IMPORTANTE:
 - Nombres en MAYÚSCULAS
 - Devuelve SOLO el JSON, sin explicaciones"""
 
+    MODEL = os.getenv("OCR_MODEL", "claude-sonnet-4-20250514")
+
+    # Cambia automáticamente al editar los prompts o el modelo -> invalida la caché
+    PROMPT_VERSION = hashlib.sha256(
+        (MODEL + ZAIRYU_CARD_PROMPT + PASSPORT_PROMPT).encode("utf-8")
+    ).hexdigest()[:12]
+
+    @staticmethod
+    def _prompt_for(document_type: str) -> str:
+        if document_type == "zairyu_card":
+            return OCRService.ZAIRYU_CARD_PROMPT
+        if document_type == "passport":
+            return OCRService.PASSPORT_PROMPT
+        raise ValueError(f"Tipo de documento no soportado: {document_type}")
+
     @staticmethod
     def extract_from_image(image_base64: str, document_type: str) -> Dict[str, Any]:
         """
         Extrae datos de una imagen usando Claude Vision
 
         Args:
-            image_base64: Imagen en base64 (sin el prefijo data:image/...)
+            image_base64: Imagen en base64 (se acepta también con prefijo data:image/...)
             document_type: "zairyu_card" o "passport"
 
         Returns:
             Diccionario con los datos extraídos
         """
-        # Determinar el prompt según el tipo de documento
-        if document_type == "zairyu_card":
-            prompt = OCRService.ZAIRYU_CARD_PROMPT
-        elif document_type == "passport":
-            prompt = OCRService.PASSPORT_PROMPT
+        try:
+            image_bytes = decode_base64_image(image_base64)
+        except ValueError as e:
+            return {
+                "success": False,
+                "error": f"Imagen base64 inválida: {str(e)}"
+            }
+        return OCRService.extract_from_bytes(image_bytes, document_type)
+
+    @staticmethod
+    def extract_from_bytes(image_bytes: bytes, document_type: str) -> Dict[str, Any]:
+        """
+        Extrae datos de una imagen (bytes crudos, p.ej. subida multipart)
+
+        La imagen se orienta, recorta, reduce y re-codifica como JPEG antes de
+        enviarla, para bajar el tamaño de la petición y el coste en tokens.
+        """
+        OCRService._prompt_for(document_type)
+        processed, media_type = preprocess_image(image_bytes)
+        return OCRService._extract(processed, media_type, document_type)
+
+    @staticmethod
+    async def scan(image_bytes: bytes, document_type: str, employee_id: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Punto de entrada async usado por los endpoints: preprocesa, consulta la
+        caché de resultados y solo llama a Claude Vision si no hay acierto.
+        Cada escaneo queda registrado en ocr_scans (ver ocr_audit).
+
+        Returns:
+            Igual que extract_from_bytes, más "cached": bool y "scan_id"
+        """
+        started = time.perf_counter()
+        OCRService._prompt_for(document_type)
+        with metrics.timed("ocr"):
+            processed, media_type = await asyncio.to_thread(preprocess_image, image_bytes)
+
+        cache_key = make_cache_key(processed, document_type, OCRService.PROMPT_VERSION)
+        cached = await ocr_cache.get(cache_key)
+        if cached is not None:
+            result = {**cached, "cached": True}
         else:
-            raise ValueError(f"Tipo de documento no soportado: {document_type}")
+            with metrics.timed("ocr"):
+                result = await asyncio.to_thread(OCRService._extract, processed, media_type, document_type)
+            if result["success"]:
+                await ocr_cache.set(cache_key, document_type, result)
+            result = {**result, "cached": False}
+
+        latency_ms = int((time.perf_counter() - started) * 1000)
+        result["scan_id"] = await record_scan(
+            image_hash=hashlib.sha256(processed).hexdigest(),
+            document_type=document_type,
+            model=OCRService.MODEL,
+            result=result,
+            latency_ms=latency_ms,
+            employee_id=employee_id,
+        )
+        return result
+
+    # Campos mínimos que debe traer cada documento
+    REQUIRED_FIELDS = {
+        "zairyu_card": ("residence_card_number", "family_name", "given_name", "nationality",
+                        "date_of_birth", "current_visa_status", "current_expiration_date"),
+        "passport": ("passport_number", "family_name", "given_name", "nationality",
+                     "date_of_birth", "passport_expiration"),
+    }
+
+    @staticmethod
+    def assess_confidence(document_type: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Confianza por campo a partir de validaciones de formato y sentido de fechas
+
+        Returns:
+            {"confidence": "high|medium|low", "confidence_score": 0..1,
+             "field_confidence": {campo: "ok" | "invalid" | "missing"}}
+        """
+        today = date.today()
+
+        def parse(value) -> Optional[date]:
+            try:
+                return date.fromisoformat(str(value)[:10])
+            except (TypeError, ValueError):
+                return None
+
+        def date_between(value, min_years: int, max_years: int) -> bool:
+            d = parse(value)
+            return d is not None and \
+                today.replace(year=today.year + min_years, day=min(today.day, 28)) <= d <= \
+                today.replace(year=today.year + max_years, day=min(today.day, 28))
+
+        checks = {
+            "residence_card_number": lambda v: Validators.residence_card(v),
+            "passport_number": lambda v: bool(re.match(r'^[A-Z0-9]{6,12}$', str(v).upper())),
+            "family_name": lambda v: bool(re.match(r"^[A-Z][A-Z '\-]*$", str(v))),
+            "given_name": lambda v: bool(re.match(r"^[A-Z][A-Z '\-]*$", str(v))),
+            "sex": lambda v: v in ("male", "female"),
+            # Edad entre 15 y 90 años
+            "date_of_birth": lambda v: date_between(v, -90, -15),
+            "current_expiration_date": lambda v: date_between(v, -5, 10),
+            "passport_expiration": lambda v: date_between(v, -10, 11),
+        }
 
-        # Detectar tipo de imagen
-        media_type = "image/jpeg"
-        if image_base64.startswith("/9j/"):
-            media_type = "image/jpeg"
-        elif image_base64.startswith("iVBOR"):
-            media_type = "image/png"
-        elif image_base64.startswith("R0lGOD"):
-            media_type = "image/gif"
+        field_confidence = {}
+        for field in set(OCRService.REQUIRED_FIELDS.get(document_type, ())) | set(data):
+            value = data.get(field)
+            if value in (None, ""):
+                field_confidence[field] = "missing"
+            elif field in checks and not checks[field](value):
+                field_confidence[field] = "invalid"
+            else:
+                field_confidence[field] = "ok"
+
+        score = sum(1 for v in field_confidence.values() if v == "ok") / len(field_confidence) \
+            if field_confidence else 0.0
+        level = "high" if score >= 0.95 else "medium" if score >= 0.75 else "low"
+        return {
+            "confidence": level,
+            "confidence_score": round(score, 3),
+            "field_confidence": field_confidence,
+        }
+
+    @staticmethod
+    def _extract(image: bytes, media_type: str, document_type: str) -> Dict[str, Any]:
+        """
+        Pasaportes: intenta primero la MRZ local (milisegundos, sin coste) y solo
+        recurre a Claude Vision si no se lee o falla algún dígito de control.
+        """
+        if document_type == "passport":
+            mrz_result = read_passport_mrz(image)
+            if mrz_result and mrz_result["valid"]:
+                result = {
+                    "success": True,
+                    "document_type": document_type,
+                    "extracted_data": mrz_result["extracted_data"],
+                    "source": "mrz",
+                    "raw_response": mrz_result["raw_text"]
+                }
+                result.update(OCRService.assess_confidence(document_type, result["extracted_data"]))
+                return result
+
+        result = OCRService._call_vision(image, media_type, document_type)
+        if result["success"]:
+            result.update(OCRService.assess_confidence(document_type, result["extracted_data"]))
+        return result
+
+    @staticmethod
+    def _call_vision(image: bytes, media_type: str, document_type: str) -> Dict[str, Any]:
+        """Llama a Claude Vision con una imagen ya preprocesada"""
+        prompt = OCRService._prompt_for(document_type)
+        image_base64 = base64.b64encode(image).decode("ascii")
 
         try:
             # Llamar a Claude Vision
             message = client.messages.create(
-                model="claude-sonnet-4-20250514",
+                model=OCRService.MODEL,
                 max_tokens=1024,
                 messages=[
                     {
@@ -127,7 +285,6 @@ IMPORTANTE:
                 json_text = re.sub(r'^```json?\s*', '', json_text)
                 json_text = re.sub(r'\s*```$', '', json_text)
 
-            import json
             extracted_data = json.loads(json_text)
 
             # Convertir nacionalidad a formato japonés si es necesario
@@ -160,7 +317,8 @@ IMPORTANTE:
                 "success": True,
                 "document_type": document_type,
                 "extracted_data": extracted_data,
-                "confidence": "high"  # Claude es bastante preciso
+                "source": "vision",
+                "raw_response": response_text
             }
 
         except json.JSONDecodeError as e:
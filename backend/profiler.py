@@ -0,0 +1,233 @@
+# ============================================================
+# UNS VISA SYSTEM - Query Profiler
+# Registro de consultas lentas (por sentencia, con la forma de los
+# parámetros pero nunca sus valores) y captura opcional de
+# EXPLAIN (ANALYZE, BUFFERS) para una muestra de los SELECT lentos.
+# ============================================================
+
+from fastapi import APIRouter, Depends, HTTPException
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import asyncio
+import contextvars
+import hashlib
+import logging
+import os
+import random
+import re
+import time
+
+from auth import require_role
+
+router = APIRouter(prefix="/api/profiler", tags=["Profiler"])
+
+logger = logging.getLogger(__name__)
+
+# Umbral de consulta lenta (ms); 0 desactiva el profiler
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+# Fracción de consultas lentas de las que se captura EXPLAIN ANALYZE (0 = nunca)
+SLOW_QUERY_EXPLAIN_SAMPLE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE", "0"))
+# Como mucho un EXPLAIN por sentencia en este intervalo
+SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS", "300"))
+SLOW_QUERY_EXPLAIN_TIMEOUT_MS = int(os.getenv("SLOW_QUERY_EXPLAIN_TIMEOUT_MS", "10000"))
+# Sentencias distintas que se guardan (se descartan las de menor tiempo total)
+SLOW_QUERY_MAX_STATEMENTS = 500
+
+_WHITESPACE = re.compile(r"\s+")
+# Solo lecturas: EXPLAIN ANALYZE ejecuta la consulta (aunque sea en una transacción revertida)
+_READ_ONLY = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+_NOT_EXPLAINABLE = re.compile(
+    r"\b(INSERT|UPDATE|DELETE|MERGE|FOR\s+UPDATE|FOR\s+SHARE|pg_advisory\w*|pg_try_advisory\w*|pg_notify)\b",
+    re.IGNORECASE,
+)
+
+
+def normalize_query(query: str) -> str:
+    return _WHITESPACE.sub(" ", query).strip()
+
+
+def param_shape(value: Any) -> str:
+    """Tipo (y tamaño) de un parámetro, sin su valor: los parámetros llevan datos personales"""
+    if value is None:
+        return "null"
+    if isinstance(value, (str, bytes)):
+        return f"{type(value).__name__}({len(value)})"
+    if isinstance(value, (list, tuple)):
+        inner = sorted({type(v).__name__ for v in value}) or ["?"]
+        return f"{type(value).__name__}[{'|'.join(inner)}]({len(value)})"
+    if isinstance(value, dict):
+        return f"dict({len(value)})"
+    return type(value).__name__
+
+
+class SlowQuery:
+    """Agregado de una sentencia (texto normalizado)"""
+
+    def __init__(self, query: str):
+        self.query = query
+        self.fingerprint = hashlib.md5(query.encode("utf-8")).hexdigest()[:12]
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.last_seconds = 0.0
+        self.last_at: Optional[datetime] = None
+        self.param_shapes: List[str] = []
+        self.explain: Optional[Dict[str, Any]] = None
+        self.explain_started = 0.0  # monotonic
+
+    def observe(self, seconds: float, args, failed: bool):
+        self.count += 1
+        self.errors += failed
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.last_seconds = seconds
+        self.last_at = datetime.now()
+        self.param_shapes = [param_shape(a) for a in args or ()]
+
+    def to_dict(self, include_plan: bool = True) -> Dict[str, Any]:
+        data = {
+            "fingerprint": self.fingerprint,
+            "query": self.query,
+            "count": self.count,
+            "errors": self.errors,
+            "total_ms": round(self.total_seconds * 1000, 1),
+            "mean_ms": round(self.total_seconds * 1000 / self.count, 1) if self.count else None,
+            "max_ms": round(self.max_seconds * 1000, 1),
+            "last_ms": round(self.last_seconds * 1000, 1),
+            "last_at": self.last_at,
+            "param_shapes": self.param_shapes,
+            "has_explain": self.explain is not None,
+        }
+        if include_plan:
+            data["explain"] = self.explain
+        return data
+
+
+_slow: Dict[str, SlowQuery] = {}
+# Referencias a las tareas de EXPLAIN en curso (si no, el GC puede cancelarlas)
+_explain_tasks: set = set()
+_started_at = datetime.now()
+
+
+def _evict():
+    victim = min(_slow.values(), key=lambda s: s.total_seconds)
+    del _slow[victim.query]
+
+
+def record_slow_query(record):
+    """
+    Query logger de asyncpg (Connection.add_query_logger), junto a metrics.record_query.
+    Solo hace algo si la consulta supera SLOW_QUERY_MS.
+    """
+    if SLOW_QUERY_MS <= 0 or record.elapsed * 1000 < SLOW_QUERY_MS:
+        return
+    query = normalize_query(record.query)
+    if query.upper().startswith("EXPLAIN"):
+        return
+
+    entry = _slow.get(query)
+    if entry is None:
+        if len(_slow) >= SLOW_QUERY_MAX_STATEMENTS:
+            _evict()
+        entry = _slow[query] = SlowQuery(query)
+    entry.observe(record.elapsed, record.args, record.exception is not None)
+
+    logger.warning("Consulta lenta %.0f ms [%s] params=%s: %.300s",
+                   record.elapsed * 1000, entry.fingerprint, entry.param_shapes, query)
+
+    if _should_explain(entry, record):
+        entry.explain_started = time.monotonic()
+        # Contexto vacío: el EXPLAIN no cuenta en el Server-Timing de la petición
+        # ni hereda el enrutado a primaria de read-your-writes
+        task = asyncio.get_running_loop().create_task(
+            _capture_explain(entry, record.query, record.args), context=contextvars.Context()
+        )
+        _explain_tasks.add(task)
+        task.add_done_callback(_explain_tasks.discard)
+
+
+def _should_explain(entry: SlowQuery, record) -> bool:
+    if SLOW_QUERY_EXPLAIN_SAMPLE <= 0 or record.exception is not None:
+        return False
+    if not _READ_ONLY.match(record.query) or _NOT_EXPLAINABLE.search(record.query):
+        return False
+    if entry.explain_started and time.monotonic() - entry.explain_started < SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS:
+        return False
+    return random.random() < SLOW_QUERY_EXPLAIN_SAMPLE
+
+
+async def _capture_explain(entry: SlowQuery, query: str, args):
+    # Import diferido: database.py registra este módulo como query logger
+    from database import get_read_pool
+
+    started = time.perf_counter()
+    try:
+        pool = await get_read_pool()
+        async with pool.acquire() as conn:
+            tr = conn.transaction(readonly=True)
+            await tr.start()
+            try:
+                await conn.execute(f"SET LOCAL statement_timeout = {SLOW_QUERY_EXPLAIN_TIMEOUT_MS}")
+                plan = await conn.fetchval(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}", *(args or ()))
+            finally:
+                await tr.rollback()
+    except Exception as e:
+        entry.explain = {"error": f"{type(e).__name__}: {e}", "captured_at": datetime.now()}
+        logger.info("EXPLAIN fallido [%s]: %s", entry.fingerprint, e)
+        return
+
+    # FORMAT JSON devuelve una lista con un único objeto (codec json de database.py)
+    root = plan[0] if isinstance(plan, list) and plan else {}
+    entry.explain = {
+        "captured_at": datetime.now(),
+        "capture_ms": round((time.perf_counter() - started) * 1000, 1),
+        "planning_ms": root.get("Planning Time"),
+        "execution_ms": root.get("Execution Time"),
+        "plan": root.get("Plan", plan),
+    }
+
+
+def get_slow_queries(limit: int = 20, order_by: str = "total") -> List[SlowQuery]:
+    keys = {
+        "total": lambda s: s.total_seconds,
+        "max": lambda s: s.max_seconds,
+        "mean": lambda s: s.total_seconds / s.count,
+        "count": lambda s: s.count,
+        "last": lambda s: s.last_at,
+    }
+    return sorted(_slow.values(), key=keys.get(order_by, keys["total"]), reverse=True)[:limit]
+
+
+# ============================================================
+# ENDPOINTS
+# ============================================================
+
+@router.get("/slow-queries")
+async def list_slow_queries(limit: int = 20, order_by: str = "total", include_plan: bool = False,
+                            current_user=Depends(require_role(["admin"]))):
+    """遅いクエリ Top-N - Slow statements of this worker (order_by: total, max, mean, count, last)"""
+    return {
+        "worker_since": _started_at,
+        "threshold_ms": SLOW_QUERY_MS,
+        "explain_sample": SLOW_QUERY_EXPLAIN_SAMPLE,
+        "statements": len(_slow),
+        "items": [s.to_dict(include_plan) for s in get_slow_queries(min(limit, 100), order_by)],
+    }
+
+
+@router.get("/slow-queries/{fingerprint}")
+async def get_slow_query(fingerprint: str, current_user=Depends(require_role(["admin"]))):
+    """遅いクエリ詳細 - One statement with its captured EXPLAIN plan"""
+    for entry in _slow.values():
+        if entry.fingerprint == fingerprint:
+            return entry.to_dict()
+    raise HTTPException(404, "クエリが見つかりません")
+
+
+@router.delete("/slow-queries")
+async def reset_slow_queries(current_user=Depends(require_role(["admin"]))):
+    """遅いクエリ記録をリセット - Clear this worker's slow query log"""
+    removed = len(_slow)
+    _slow.clear()
+    return {"removed": removed}
@@ -0,0 +1,163 @@
+# ============================================================
+# UNS VISA SYSTEM - Query Registry
+# Consultas frecuentes preparadas una vez por conexión, con tiempos por consulta
+# ============================================================
+
+import time
+from typing import Any, Dict, Optional
+
+import asyncpg
+
+# Asignación activa con su派遣先; único por idx_dispatch_one_active.
+# Compartida por current_assignment y employee_full para que devuelvan las mismas columnas.
+_CURRENT_ASSIGNMENT = """
+    SELECT hs.*,
+           da.id AS assignment_id, da.employment_contract_id, da.dispatch_start_date,
+           da.dispatch_end_date, da.job_title, da.work_location_address,
+           da.work_location_department, da.supervisor_name
+    FROM dispatch_assignments da
+    JOIN haken_saki_company hs ON da.haken_saki_id = hs.id
+    WHERE da.employee_id = {employee_id} AND da.assignment_status = 'active'
+"""
+
+# Nombre -> SQL. Solo consultas calientes: el resto sigue en línea en cada módulo
+QUERIES: Dict[str, str] = {
+    "employee_by_id": "SELECT * FROM employees WHERE id = $1",
+    "employee_by_card": "SELECT * FROM employees WHERE residence_card_number = $1",
+    "haken_moto_company": "SELECT * FROM haken_moto_company LIMIT 1",
+    # etag.table_etag: versiones de las tablas pedidas (en orden de nombre) y la fecha.
+    # version (compactada) + cambios confirmados desde la última compactación
+    "table_versions": """
+        SELECT CURRENT_DATE AS today, array_agg(
+            v.version + (SELECT count(*) FROM table_changes c WHERE c.table_name = v.table_name)
+            ORDER BY v.table_name
+        ) AS versions
+        FROM table_versions v WHERE v.table_name = ANY($1::text[])
+    """,
+    # dispatch.get_current_assignment
+    "current_assignment": _CURRENT_ASSIGNMENT.format(employee_id="$1"),
+    # employee_detail.get_employee_full: empleado + relaciones en un solo viaje (json_agg)
+    "employee_full": f"""
+        SELECT e.*,
+            COALESCE((
+                SELECT json_agg(f ORDER BY f.id)
+                FROM employee_family f WHERE f.employee_id = e.id
+            ), '[]'::json) AS family,
+            COALESCE((
+                SELECT json_agg(w ORDER BY w.display_order NULLS LAST, w.start_date DESC NULLS LAST, w.id)
+                FROM employee_work_history w WHERE w.employee_id = e.id
+            ), '[]'::json) AS work_history,
+            (
+                SELECT row_to_json(c)
+                FROM employment_contracts c
+                WHERE c.employee_id = e.id AND c.contract_status = 'active'
+            ) AS contract,
+            (
+                SELECT row_to_json(d) FROM ({_CURRENT_ASSIGNMENT.format(employee_id="e.id")}) d
+            ) AS dispatch,
+            COALESCE((
+                SELECT json_agg(va ORDER BY va.created_at DESC, va.id DESC)
+                FROM visa_applications va WHERE va.employee_id = e.id
+            ), '[]'::json) AS visa_applications
+        FROM employees e
+        WHERE e.id = $1
+    """,
+    "user_by_username": "SELECT * FROM users WHERE username = $1",
+    "user_by_id": "SELECT * FROM users WHERE id = $1",
+    "user_state": "SELECT is_active, role, token_version FROM users WHERE id = $1",
+}
+
+
+class QueryStats:
+    """Tiempos acumulados de una consulta registrada"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.prepares = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "prepares": self.prepares,
+            "total_ms": round(self.total_ms, 2),
+            "avg_ms": round(self.total_ms / self.calls, 3) if self.calls else None,
+            "max_ms": round(self.max_ms, 2),
+        }
+
+
+_stats: Dict[str, QueryStats] = {name: QueryStats() for name in QUERIES}
+
+
+class RegistryConnection(asyncpg.Connection):
+    """
+    Conexión con caché propia de sentencias preparadas del registro.
+    Se usa como connection_class del pool; el proxy del pool delega en ella.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._registry_statements: Dict[str, asyncpg.prepared_stmt.PreparedStatement] = {}
+
+    async def registry_statement(self, name: str):
+        stmt = self._registry_statements.get(name)
+        if stmt is None:
+            stmt = await self.prepare(QUERIES[name])
+            self._registry_statements[name] = stmt
+            _stats[name].prepares += 1
+        return stmt
+
+    def forget_registry_statement(self, name: str):
+        self._registry_statements.pop(name, None)
+
+
+async def _run(conn, method: str, name: str, args: tuple):
+    if name not in QUERIES:
+        raise KeyError(f"Consulta no registrada: {name}")
+
+    stats = _stats[name]
+    started = time.perf_counter()
+    try:
+        if not hasattr(conn, "registry_statement"):
+            # Conexión fuera del pool (p.ej. asyncpg.connect directo): sin preparar
+            return await getattr(conn, method)(QUERIES[name], *args)
+        stmt = await conn.registry_statement(name)
+        try:
+            return await getattr(stmt, method)(*args)
+        except asyncpg.InvalidCachedStatementError:
+            # El esquema cambió (ALTER TABLE ...): se prepara de nuevo una vez.
+            # Dentro de una transacción la sentencia ya la abortó: no se reintenta.
+            conn.forget_registry_statement(name)
+            if conn.is_in_transaction():
+                raise
+            stmt = await conn.registry_statement(name)
+            return await getattr(stmt, method)(*args)
+    except Exception:
+        stats.errors += 1
+        raise
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        stats.calls += 1
+        stats.total_ms += elapsed_ms
+        stats.max_ms = max(stats.max_ms, elapsed_ms)
+
+
+async def fetchrow(conn, name: str, *args) -> Optional[asyncpg.Record]:
+    return await _run(conn, "fetchrow", name, args)
+
+
+async def fetch(conn, name: str, *args) -> list:
+    return await _run(conn, "fetch", name, args)
+
+
+async def fetchval(conn, name: str, *args) -> Any:
+    return await _run(conn, "fetchval", name, args)
+
+
+def get_query_stats() -> Dict[str, Dict[str, Any]]:
+    """Tiempos por consulta, de mayor a menor tiempo total"""
+    ordered = sorted(_stats.items(), key=lambda item: item[1].total_ms, reverse=True)
+    return {name: stats.snapshot() for name, stats in ordered}
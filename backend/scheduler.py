@@ -0,0 +1,466 @@
+# ============================================================
+# UNS VISA SYSTEM - Job Scheduler
+# Tareas periódicas dentro del proceso (asyncio) con elección de líder
+# mediante advisory lock de PostgreSQL: con varios workers de uvicorn,
+# solo el líder ejecuta las tareas compartidas.
+# ============================================================
+
+from fastapi import APIRouter, Depends, HTTPException
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import logging
+import os
+import socket
+import time
+
+import asyncpg
+
+from auth import require_role
+from database import get_db_pool, get_db_url
+
+router = APIRouter(prefix="/api/scheduler", tags=["Scheduler"])
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() == "true"
+# Cada cuánto un worker que no es líder intenta serlo (y el líder comprueba su conexión)
+SCHEDULER_LEADER_RETRY_SECONDS = float(os.getenv("SCHEDULER_LEADER_RETRY_SECONDS", "30"))
+SCHEDULER_JOB_TIMEOUT_SECONDS = float(os.getenv("SCHEDULER_JOB_TIMEOUT_SECONDS", "600"))
+GENERATED_DIR = os.getenv("GENERATED_DIR", "/app/generated")
+GENERATED_MAX_AGE_HOURS = float(os.getenv("GENERATED_MAX_AGE_HOURS", "24"))
+
+# Clave del advisory lock del líder (constante arbitraria, compartida por todos los workers)
+LEADER_LOCK_KEY = 7_301_202_401
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+# ============================================================
+# CRON
+# ============================================================
+
+class CronSchedule:
+    """
+    Subconjunto de cron de 5 campos: minuto hora día-mes mes día-semana.
+    Cada campo admite *, */n, a, a-b, a-b/n y listas separadas por comas.
+    Día de la semana: 0 = domingo (7 también).
+    """
+
+    _RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Expresión cron inválida (5 campos): {expression!r}")
+        parsed = [self._parse_field(f, lo, hi) for f, (lo, hi) in zip(fields, self._RANGES)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        self.weekdays = {0 if d == 7 else d for d in weekdays}
+        # Como cron: si día-mes y día-semana están restringidos, basta con uno
+        self._day_any = fields[2] == "*"
+        self._weekday_any = fields[4] == "*"
+
+    @staticmethod
+    def _parse_field(field: str, lo: int, hi: int) -> set:
+        values = set()
+        for part in field.split(","):
+            step = 1
+            if "/" in part:
+                part, step_text = part.split("/", 1)
+                step = int(step_text)
+                if step <= 0:
+                    raise ValueError(f"Paso inválido en cron: {field!r}")
+            if part == "*":
+                start, end = lo, hi
+            elif "-" in part:
+                start_text, end_text = part.split("-", 1)
+                start, end = int(start_text), int(end_text)
+            else:
+                start = end = int(part)
+            if start < lo or end > hi or start > end:
+                raise ValueError(f"Valor fuera de rango en cron: {field!r}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, dt: datetime) -> bool:
+        weekday = (dt.weekday() + 1) % 7  # Python: lunes=0 -> cron: domingo=0
+        day_ok = dt.day in self.days
+        weekday_ok = weekday in self.weekdays
+        if self._day_any and self._weekday_any:
+            return True
+        if self._day_any:
+            return weekday_ok
+        if self._weekday_any:
+            return day_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, after: datetime) -> datetime:
+        """Primer minuto estrictamente posterior a `after` que cumple la expresión"""
+        dt = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = dt + timedelta(days=366 * 5)
+        while dt < limit:
+            if dt.month not in self.months or not self._day_matches(dt):
+                dt = (dt + timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            if dt.hour not in self.hours:
+                dt = (dt + timedelta(hours=1)).replace(minute=0)
+                continue
+            if dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+                continue
+            return dt
+        raise ValueError(f"La expresión cron nunca se cumple: {self.expression!r}")
+
+
+# ============================================================
+# JOBS
+# ============================================================
+
+class JobMetrics:
+    def __init__(self):
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.last_ms: Optional[float] = None
+        self.last_status: Optional[str] = None
+        self.last_started_at: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "avg_ms": round(self.total_ms / self.runs, 1) if self.runs else None,
+            "max_ms": round(self.max_ms, 1),
+            "last_ms": round(self.last_ms, 1) if self.last_ms is not None else None,
+            "last_status": self.last_status,
+            "last_started_at": self.last_started_at,
+            "last_error": self.last_error,
+        }
+
+
+class Job:
+    """
+    Tarea programada.
+
+    leader_only=True: solo la ejecuta el worker líder y queda registrada en
+    scheduled_job_runs. False: cada worker la ejecuta (p.ej. cachés en memoria).
+    """
+
+    def __init__(self, name: str, cron: str, func: Callable[[], Awaitable[Any]],
+                 leader_only: bool = True, timeout: float = SCHEDULER_JOB_TIMEOUT_SECONDS):
+        self.name = name
+        self.schedule = CronSchedule(os.getenv(f"SCHEDULER_CRON_{name.upper()}", cron))
+        self.func = func
+        self.leader_only = leader_only
+        self.timeout = timeout
+        self.metrics = JobMetrics()
+        self.next_run: Optional[datetime] = None
+
+
+class Scheduler:
+    def __init__(self):
+        self.jobs: Dict[str, Job] = {}
+        self.is_leader = False
+        self._leader_conn: Optional[asyncpg.Connection] = None
+        self._tasks: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}
+
+    def add_job(self, job: Job):
+        self.jobs[job.name] = job
+
+    # --- ciclo de vida ---
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._tasks.append(asyncio.create_task(self._leader_loop(), name="scheduler-leader"))
+        for job in self.jobs.values():
+            self._tasks.append(asyncio.create_task(self._job_loop(job), name=f"scheduler-{job.name}"))
+        logger.info("Scheduler iniciado (%s): %s", WORKER_ID, ", ".join(self.jobs))
+
+    async def stop(self):
+        for task in self._tasks + list(self._running.values()):
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._running.values(), return_exceptions=True)
+        self._tasks.clear()
+        self._running.clear()
+        await self._release_leadership()
+
+    # --- líder ---
+
+    async def _leader_loop(self):
+        while True:
+            try:
+                if self._leader_conn is None:
+                    conn = await asyncpg.connect(get_db_url())
+                    try:
+                        acquired = await conn.fetchval("SELECT pg_try_advisory_lock($1)", LEADER_LOCK_KEY)
+                    except Exception:
+                        conn.terminate()
+                        raise
+                    if acquired:
+                        # La conexión mantiene el lock: si el worker muere, otro toma el relevo
+                        self._leader_conn = conn
+                        self.is_leader = True
+                        logger.info("Scheduler: %s es el líder", WORKER_ID)
+                    else:
+                        await conn.close()
+                else:
+                    await self._leader_conn.fetchval("SELECT 1")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Scheduler: se pierde/no se obtiene el liderazgo: %s", e)
+                await self._release_leadership()
+            await asyncio.sleep(SCHEDULER_LEADER_RETRY_SECONDS)
+
+    async def _release_leadership(self):
+        conn, self._leader_conn = self._leader_conn, None
+        self.is_leader = False
+        if conn is not None and not conn.is_closed():
+            try:
+                await conn.close()  # cerrar la sesión libera el advisory lock
+            except Exception:
+                conn.terminate()
+
+    # --- ejecución ---
+
+    async def _job_loop(self, job: Job):
+        while True:
+            job.next_run = job.schedule.next_after(datetime.now())
+            delay = (job.next_run - datetime.now()).total_seconds()
+            await asyncio.sleep(max(0.0, delay))
+            if job.leader_only and not self.is_leader:
+                job.metrics.skipped += 1
+                continue
+            if job.name in self._running:
+                job.metrics.skipped += 1
+                logger.warning("Scheduler: %s sigue en ejecución, se omite", job.name)
+                continue
+            await self._run(job, job.next_run)
+
+    async def run_now(self, name: str) -> Dict[str, Any]:
+        """Ejecución manual (endpoint); no comprueba liderazgo"""
+        job = self.jobs[name]
+        if name in self._running:
+            raise RuntimeError(f"{name} ya está en ejecución")
+        return await self._run(job, datetime.now().replace(microsecond=0), manual=True)
+
+    async def _run(self, job: Job, scheduled_for: datetime, manual: bool = False) -> Dict[str, Any]:
+        run_id = None
+        if job.leader_only:
+            run_id = await self._claim_run(job, scheduled_for, manual)
+            if run_id is None:
+                # Otro worker ya ejecutó este turno (p.ej. durante un cambio de líder)
+                job.metrics.skipped += 1
+                return {"job": job.name, "status": "skipped"}
+
+        metrics = job.metrics
+        metrics.last_started_at = datetime.now()
+        started = time.perf_counter()
+        result, error, status = None, None, "success"
+        task = asyncio.create_task(asyncio.wait_for(job.func(), timeout=job.timeout))
+        self._running[job.name] = task
+        try:
+            result = await task
+        except asyncio.TimeoutError:
+            status, error = "timeout", f"timeout ({job.timeout}s)"
+        except asyncio.CancelledError:
+            status, error = "cancelled", "cancelled"
+            raise
+        except Exception as e:
+            status, error = "failed", str(e)
+            logger.exception("Scheduler: %s falló", job.name)
+        finally:
+            self._running.pop(job.name, None)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            metrics.runs += 1
+            metrics.total_ms += elapsed_ms
+            metrics.max_ms = max(metrics.max_ms, elapsed_ms)
+            metrics.last_ms = elapsed_ms
+            metrics.last_status = status
+            metrics.last_error = error
+            if status != "success":
+                metrics.failures += 1
+            if run_id is not None:
+                await self._finish_run(run_id, status, elapsed_ms, result, error)
+
+        return {"job": job.name, "status": status, "duration_ms": round(elapsed_ms, 1),
+                "result": result, "error": error}
+
+    async def _claim_run(self, job: Job, scheduled_for: datetime, manual: bool) -> Optional[int]:
+        try:
+            pool = await get_db_pool()
+            async with pool.acquire() as conn:
+                return await conn.fetchval("""
+                    INSERT INTO scheduled_job_runs (job_name, scheduled_for, manual, worker, status)
+                    VALUES ($1, $2, $3, $4, 'running')
+                    ON CONFLICT (job_name, scheduled_for) WHERE NOT manual DO NOTHING
+                    RETURNING id
+                """, job.name, scheduled_for, manual, WORKER_ID)
+        except Exception as e:
+            logger.warning("Scheduler: no se pudo registrar %s: %s", job.name, e)
+            return None
+
+    async def _finish_run(self, run_id: int, status: str, elapsed_ms: float, result: Any, error: Optional[str]):
+        try:
+            pool = await get_db_pool()
+            async with pool.acquire() as conn:
+                await conn.execute("""
+                    UPDATE scheduled_job_runs
+                    SET status = $2, finished_at = CURRENT_TIMESTAMP, duration_ms = $3,
+                        result = $4, error = $5
+                    WHERE id = $1
+                """, run_id, status, int(elapsed_ms), result if isinstance(result, (dict, list)) else
+                    ({"value": result} if result is not None else None), error)
+        except Exception as e:
+            logger.warning("Scheduler: no se pudo cerrar el registro %s: %s", run_id, e)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "enabled": SCHEDULER_ENABLED,
+            "worker": WORKER_ID,
+            "is_leader": self.is_leader,
+            "jobs": {
+                name: {
+                    "cron": job.schedule.expression,
+                    "leader_only": job.leader_only,
+                    "next_run": job.next_run,
+                    "running": name in self._running,
+                    **job.metrics.snapshot(),
+                }
+                for name, job in self.jobs.items()
+            },
+        }
+
+
+# ============================================================
+# TAREAS
+# ============================================================
+
+async def _visa_notifications():
+    from notifications import generate_visa_notifications
+    return await generate_visa_notifications()
+
+
+async def _visa_alert_rollover():
+    from visa_alerts import refresh_expiry_alerts
+    return {"changed": await refresh_expiry_alerts()}
+
+
+async def _ocr_cache_purge_memory():
+    from ocr_cache import ocr_cache
+    return {"purged": ocr_cache.purge_expired()}
+
+
+async def _ocr_cache_purge_db():
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        status = await conn.execute("DELETE FROM ocr_result_cache WHERE expires_at < CURRENT_TIMESTAMP")
+    return {"deleted": int(status.split()[-1])}
+
+
+def _remove_old_files(directory: str, max_age_seconds: float) -> Dict[str, int]:
+    removed, kept = 0, 0
+    cutoff = time.time() - max_age_seconds
+    if not os.path.isdir(directory):
+        return {"removed": 0, "kept": 0}
+    for entry in os.scandir(directory):
+        if not entry.is_file(follow_symlinks=False):
+            continue
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+            else:
+                kept += 1
+        except FileNotFoundError:
+            pass
+    return {"removed": removed, "kept": kept}
+
+
+async def _generated_files_cleanup():
+    return await asyncio.to_thread(_remove_old_files, GENERATED_DIR, GENERATED_MAX_AGE_HOURS * 3600)
+
+
+async def _scheduler_history_cleanup():
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        status = await conn.execute(
+            "DELETE FROM scheduled_job_runs WHERE started_at < CURRENT_TIMESTAMP - INTERVAL '90 days'"
+        )
+    return {"deleted": int(status.split()[-1])}
+
+
+async def _table_versions_compact():
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        moved = await conn.fetchval("SELECT compact_table_versions()")
+    return {"moved": moved}
+
+
+scheduler = Scheduler()
+scheduler.add_job(Job("visa_alert_rollover", "1 0 * * *", _visa_alert_rollover))
+scheduler.add_job(Job("visa_notifications", "0 7 * * *", _visa_notifications))
+scheduler.add_job(Job("ocr_cache_purge_db", "15 * * * *", _ocr_cache_purge_db))
+scheduler.add_job(Job("ocr_cache_purge_memory", "*/10 * * * *", _ocr_cache_purge_memory, leader_only=False))
+scheduler.add_job(Job("generated_files_cleanup", "30 * * * *", _generated_files_cleanup))
+scheduler.add_job(Job("scheduler_history_cleanup", "0 4 * * 0", _scheduler_history_cleanup))
+scheduler.add_job(Job("table_versions_compact", "*/15 * * * *", _table_versions_compact))
+
+
+async def start_scheduler():
+    if SCHEDULER_ENABLED:
+        await scheduler.start()
+
+
+async def stop_scheduler():
+    await scheduler.stop()
+
+
+# ============================================================
+# ENDPOINTS
+# ============================================================
+
+@router.get("/jobs")
+async def list_jobs(current_user=Depends(require_role(["admin"]))):
+    """スケジューラ状態 - Jobs, next run, timing metrics and leader status of this worker"""
+    return scheduler.status()
+
+
+@router.get("/runs")
+async def list_runs(job: Optional[str] = None, limit: int = 50, before_id: Optional[int] = None,
+                    current_user=Depends(require_role(["admin"]))):
+    """実行履歴 - Run history (newest first)"""
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT id, job_name, scheduled_for, manual, worker, status,
+                   started_at, finished_at, duration_ms, result, error
+            FROM scheduled_job_runs
+            WHERE ($1::varchar IS NULL OR job_name = $1)
+              AND ($2::int IS NULL OR id < $2)
+            ORDER BY id DESC
+            LIMIT $3
+        """, job, before_id, min(limit, 200))
+    items = [dict(r) for r in rows]
+    return {
+        "items": items,
+        "next_before_id": items[-1]["id"] if len(items) == min(limit, 200) else None
+    }
+
+
+@router.post("/jobs/{name}/run")
+async def run_job(name: str, current_user=Depends(require_role(["admin"]))):
+    """ジョブを今すぐ実行 - Run a job now on this worker"""
+    if name not in scheduler.jobs:
+        raise HTTPException(404, "ジョブが見つかりません")
+    try:
+        return await scheduler.run_now(name)
+    except RuntimeError as e:
+        raise HTTPException(409, str(e))
@@ -0,0 +1,52 @@
+# ============================================================
+# UNS VISA SYSTEM - Validators
+# Validaciones de formato compartidas (API, OCR)
+# ============================================================
+
+import re
+from datetime import date
+
+
+class Validators:
+    @staticmethod
+    def residence_card(card: str) -> bool:
+        """在留カード番号: 2文字 + 8数字 + 2文字 (例: AB12345678CD)"""
+        return bool(re.match(r'^[A-Z]{2}\d{8}[A-Z]{2}$', card.upper())) if card else False
+    
+    @staticmethod
+    def corporation_number(num: str) -> bool:
+        """法人番号: 13桁"""
+        return bool(re.match(r'^\d{13}$', num)) if num else True
+    
+    @staticmethod
+    def insurance_number(num: str) -> bool:
+        """雇用保険番号: 11桁"""
+        return bool(re.match(r'^\d{11}$', num)) if num else True
+    
+    @staticmethod
+    def phone_japan(phone: str) -> bool:
+        """日本の電話番号"""
+        if not phone:
+            return True
+        clean = re.sub(r'[-\s]', '', phone)
+        return bool(re.match(r'^0\d{9,10}$', clean))
+    
+    @staticmethod
+    def postal_code(code: str) -> bool:
+        """郵便番号: 7桁"""
+        if not code:
+            return True
+        clean = re.sub(r'[-\s]', '', code)
+        return bool(re.match(r'^\d{7}$', clean))
+    
+    @staticmethod
+    def visa_status(expiration: date) -> dict:
+        """ビザ期限のステータス計算"""
+        days = (expiration - date.today()).days
+        return {
+            "days_remaining": days,
+            "is_expired": days < 0,
+            "status": "expired" if days < 0 else "critical" if days <= 30 else "warning" if days <= 90 else "ok",
+            "can_renew": 0 < days <= 90,
+            "message": f"期限まで{days}日" if days > 0 else f"期限切れ（{abs(days)}日経過）"
+        }
@@ -0,0 +1,53 @@
+# ============================================================
+# UNS VISA SYSTEM - Visa Expiry Alerts
+# Lectura de la tabla visa_expiry_alerts (mantenida por triggers en PostgreSQL)
+# ============================================================
+
+from typing import Any, Dict, List
+
+from database import get_db_pool, get_read_pool
+
+# Debe coincidir con la ventana de v_visa_expiry_alert_source (init.sql)
+VISA_ALERT_HORIZON_DAYS = 365
+
+_ALERTS_SQL = """
+    SELECT employee_id AS id, employee_code, family_name, given_name, nationality,
+           current_visa_status, expiration_date AS current_expiration_date,
+           residence_card_number, days_remaining, urgency
+    FROM visa_expiry_alerts
+    WHERE days_remaining BETWEEN 0 AND $1
+    ORDER BY expiration_date, employee_id
+"""
+
+
+async def refresh_expiry_alerts() -> int:
+    """
+    Cambio de día: recalcula days_remaining y urgencia de todas las alertas.
+    Devuelve el número de filas modificadas.
+    """
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetchval("SELECT refresh_visa_expiry_alerts()")
+
+
+async def get_expiring(days: int) -> List[Dict[str, Any]]:
+    """
+    Empleados cuya visa vence en los próximos `days` días (máx. VISA_ALERT_HORIZON_DAYS).
+
+    Si quedan filas calculadas otro día (no se ejecutó el refresco diario),
+    se refresca en el primario antes de contestar.
+    """
+    days = max(0, min(days, VISA_ALERT_HORIZON_DAYS))
+
+    pool = await get_read_pool()
+    async with pool.acquire() as conn:
+        stale = await conn.fetchval(
+            "SELECT EXISTS (SELECT 1 FROM visa_expiry_alerts WHERE computed_on < CURRENT_DATE)"
+        )
+        if not stale:
+            return [dict(r) for r in await conn.fetch(_ALERTS_SQL, days)]
+
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        await conn.execute("SELECT refresh_visa_expiry_alerts()")
+        return [dict(r) for r in await conn.fetch(_ALERTS_SQL, days)]
@@ -0,0 +1,425 @@
+# ============================================================
+# UNS VISA SYSTEM - Visa Applications (ビザ申請)
+# CRUD, máquina de estados draft → submitted → under_review →
+# approved / denied, colas indexadas y Excel del申請書 guardado una
+# vez y enlazado por excel_file_url.
+# ============================================================
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import FileResponse
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional
+from datetime import date
+from pathlib import Path
+import asyncio
+import logging
+import os
+import secrets
+
+import audit
+from auth import TokenData, get_current_active_user, require_role
+from database import get_db_pool, get_read_pool
+from export import build_form_data, render_form
+
+router = APIRouter(prefix="/api/visa-applications", tags=["Visa Applications"])
+
+logger = logging.getLogger(__name__)
+
+# Subcarpeta de /app/generated: la limpieza periódica (scheduler) solo borra
+# archivos del primer nivel, así que los申請書 guardados aquí se conservan
+VISA_APPLICATION_FILES_DIR = os.getenv("VISA_APPLICATION_FILES_DIR", "/app/generated/applications")
+VISA_APPLICATION_FILES_URL = os.getenv("VISA_APPLICATION_FILES_URL", "/generated/applications")
+
+# Estado actual -> estados siguientes permitidos
+TRANSITIONS: Dict[str, tuple] = {
+    "draft": ("submitted",),
+    "submitted": ("under_review",),
+    "under_review": ("approved", "denied"),
+    "approved": (),
+    "denied": (),
+}
+# Literal (no parámetro) para que el planner use el índice parcial idx_visa_apps_pending_office
+PENDING_SQL = "('submitted', 'under_review')"
+
+# 許可 / 不許可 (cambian los datos de visa del empleado)
+DECISION_ROLES = ["admin"]
+
+# application_type -> form_type de export.build_form_data
+FORM_TYPES = {"更新": None, "認定": "coe", "変更": "change"}
+
+# ============================================================
+# MODELS
+# ============================================================
+
+class VisaApplication(BaseModel):
+    employee_id: int
+    application_type: str = Field(..., pattern='^(認定|変更|更新)$')
+    submission_office: str
+    requested_period: str
+    reason: str
+    visa_category: Optional[str] = Field(None, max_length=100)
+    notes: Optional[str] = None
+
+class VisaApplicationUpdate(BaseModel):
+    """Solo en draft"""
+    submission_office: Optional[str] = None
+    requested_period: Optional[str] = None
+    reason: Optional[str] = None
+    visa_category: Optional[str] = Field(None, max_length=100)
+    representative_type: Optional[str] = None
+    representative_name: Optional[str] = None
+    representative_organization: Optional[str] = None
+    notes: Optional[str] = None
+
+class SubmitRequest(BaseModel):
+    application_date: Optional[date] = None  # hoy por defecto
+    application_number: Optional[str] = None
+
+class ApproveRequest(BaseModel):
+    new_expiration_date: date
+    approved_period: str
+    decision_date: Optional[date] = None
+
+class DenyRequest(BaseModel):
+    denial_reason: str
+    decision_date: Optional[date] = None
+
+# ============================================================
+# HELPERS
+# ============================================================
+
+async def _get_or_404(conn, application_id: int, lock: bool = False):
+    row = await conn.fetchrow(
+        f"SELECT * FROM visa_applications WHERE id = $1{' FOR UPDATE' if lock else ''}", application_id
+    )
+    if not row:
+        raise HTTPException(404, "申請が見つかりません")
+    return row
+
+
+async def _transition(conn, application_id: int, to_status: str, set_sql: str = "", args: tuple = ()):
+    """
+    Cambia el estado si la transición es válida. El estado de origen se comprueba
+    en el propio UPDATE: dos transiciones concurrentes no pueden aplicarse ambas.
+    set_sql usa los parámetros a partir de $3.
+    """
+    from_statuses = [s for s, nexts in TRANSITIONS.items() if to_status in nexts]
+    row = await conn.fetchrow(f"""
+        UPDATE visa_applications
+        SET application_status = '{to_status}'{', ' + set_sql if set_sql else ''}
+        WHERE id = $1 AND application_status = ANY($2::varchar[])
+        RETURNING *
+    """, application_id, from_statuses, *args)
+    if row:
+        return row
+    current = await _get_or_404(conn, application_id)
+    raise HTTPException(
+        409, f"状態 {current['application_status']} から {to_status} には変更できません"
+    )
+
+
+def _remove_file(url: Optional[str]):
+    if url and url.startswith(VISA_APPLICATION_FILES_URL + "/"):
+        try:
+            os.remove(os.path.join(VISA_APPLICATION_FILES_DIR, os.path.basename(url)))
+        except FileNotFoundError:
+            pass
+
+
+def _file_path(url: str) -> Path:
+    return Path(VISA_APPLICATION_FILES_DIR) / os.path.basename(url)
+
+
+async def _generate_excel(conn, application) -> str:
+    """Genera el申請書, lo guarda con nombre no adivinable y devuelve su URL"""
+    data, _ = await build_form_data(
+        conn, application["employee_id"], FORM_TYPES.get(application["application_type"]),
+        overrides={
+            "submission_office": application["submission_office"],
+            "desired_period": application["requested_period"],
+            "reason_for_extension": application["reason_for_application"],
+            "desired_visa_status": application["visa_category"],
+        },
+    )
+    excel_file = render_form(data)
+    filename = f"{application['id']}_{secrets.token_hex(8)}.xlsx"
+    path = Path(VISA_APPLICATION_FILES_DIR) / filename
+
+    def write():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(excel_file.getvalue())
+
+    await asyncio.to_thread(write)
+    return f"{VISA_APPLICATION_FILES_URL}/{filename}"
+
+# ============================================================
+# ENDPOINTS - CRUD
+# ============================================================
+
+@router.post("")
+async def create_application(application: VisaApplication,
+                             current_user: TokenData = Depends(get_current_active_user)):
+    """ビザ申請を作成（下書き）"""
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        exists = await conn.fetchval("SELECT 1 FROM employees WHERE id = $1", application.employee_id)
+        if not exists:
+            raise HTTPException(404, "従業員が見つかりません")
+        row = await conn.fetchrow("""
+            INSERT INTO visa_applications (
+                employee_id, employment_contract_id, dispatch_assignment_id,
+                application_type, visa_category, submission_office, requested_period,
+                reason_for_application, application_status, created_by, notes
+            )
+            VALUES (
+                $1,
+                (SELECT id FROM employment_contracts WHERE employee_id = $1 AND contract_status = 'active'),
+                (SELECT id FROM dispatch_assignments WHERE employee_id = $1 AND assignment_status = 'active'),
+                $2, $3, $4, $5, $6, 'draft', $7, $8
+            )
+            RETURNING *
+        """, application.employee_id, application.application_type, application.visa_category,
+            application.submission_office, application.requested_period, application.reason,
+            current_user.user_id, application.notes)
+        return dict(row)
+
+@router.get("/queue/my-drafts")
+async def my_drafts(limit: int = Query(50, ge=1, le=200), current_user: TokenData = Depends(get_current_active_user)):
+    """自分の下書き - Drafts created by the current user (idx_visa_apps_drafts_by_creator)"""
+    pool = await get_read_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT va.*, e.employee_code, e.family_name, e.given_name
+            FROM visa_applications va
+            JOIN employees e ON e.id = va.employee_id
+            WHERE va.created_by = $1 AND va.application_status = 'draft'
+            ORDER BY va.updated_at DESC
+            LIMIT $2
+        """, current_user.user_id, limit)
+        return [dict(r) for r in rows]
+
+@router.get("/queue/pending")
+async def pending_at_office(office: str, limit: int = Query(100, ge=1, le=500), after_id: Optional[int] = None):
+    """
+    入管別の審査待ち - Submitted / under review at one immigration office,
+    oldest first (idx_visa_apps_pending_office)
+    """
+    pool = await get_read_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(f"""
+            SELECT va.*, e.employee_code, e.family_name, e.given_name, e.current_expiration_date
+            FROM visa_applications va
+            JOIN employees e ON e.id = va.employee_id
+            WHERE va.submission_office = $1
+            AND va.application_status IN {PENDING_SQL}
+            AND ($2::int IS NULL OR va.id > $2)
+            ORDER BY va.id
+            LIMIT $3
+        """, office, after_id, limit)
+        items = [dict(r) for r in rows]
+    return {"items": items, "next_after_id": items[-1]["id"] if len(items) == limit else None}
+
+@router.get("/queue/pending/summary")
+async def pending_summary():
+    """入管別の審査待ち件数 - Pending count per office and status"""
+    pool = await get_read_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(f"""
+            SELECT submission_office, application_status, COUNT(*) AS count
+            FROM visa_applications
+            WHERE application_status IN {PENDING_SQL}
+            GROUP BY 1, 2
+            ORDER BY 1, 2
+        """)
+    summary: Dict[str, Dict[str, int]] = {}
+    for r in rows:
+        summary.setdefault(r["submission_office"] or "不明", {})[r["application_status"]] = r["count"]
+    return summary
+
+@router.get("/employee/{employee_id}")
+async def list_employee_applications(employee_id: int):
+    """従業員の申請履歴"""
+    pool = await get_read_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT * FROM visa_applications
+            WHERE employee_id = $1
+            ORDER BY created_at DESC, id DESC
+        """, employee_id)
+        return [dict(r) for r in rows]
+
+@router.get("/{application_id}")
+async def get_application(application_id: int):
+    """ビザ申請詳細"""
+    pool = await get_read_pool()
+    async with pool.acquire() as conn:
+        row = await _get_or_404(conn, application_id)
+    return {**dict(row), "allowed_transitions": list(TRANSITIONS.get(row["application_status"], ()))}
+
+@router.put("/{application_id}")
+async def update_application(application_id: int, update: VisaApplicationUpdate,
+                             current_user: TokenData = Depends(get_current_active_user)):
+    """ビザ申請を更新（下書きのみ）- El Excel guardado deja de valer y se regenera al pedirlo"""
+    data = update.dict(exclude_unset=True)
+    if "reason" in data:
+        data["reason_for_application"] = data.pop("reason")
+    if not data:
+        return await get_application(application_id)
+
+    set_clauses = [f"{k} = ${i + 2}" for i, k in enumerate(data)]
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            current = await _get_or_404(conn, application_id, lock=True)
+            if current["application_status"] != "draft":
+                raise HTTPException(409, "提出済みの申請は編集できません")
+            row = await conn.fetchrow(f"""
+                UPDATE visa_applications
+                SET {', '.join(set_clauses)}, excel_file_url = NULL
+                WHERE id = $1
+                RETURNING *
+            """, application_id, *data.values())
+    _remove_file(current["excel_file_url"])
+    return dict(row)
+
+@router.delete("/{application_id}")
+async def delete_application(application_id: int,
+                             current_user: TokenData = Depends(get_current_active_user)):
+    """ビザ申請を削除（下書きのみ）"""
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow("""
+            DELETE FROM visa_applications
+            WHERE id = $1 AND application_status = 'draft'
+            RETURNING excel_file_url
+        """, application_id)
+        if not row:
+            await _get_or_404(conn, application_id)
+            raise HTTPException(409, "提出済みの申請は削除できません")
+    _remove_file(row["excel_file_url"])
+    return {"message": "申請を削除しました"}
+
+# ============================================================
+# ENDPOINTS - STATE TRANSITIONS
+# ============================================================
+
+@router.post("/{application_id}/submit")
+async def submit_application(application_id: int, request: SubmitRequest,
+                             current_user: TokenData = Depends(get_current_active_user)):
+    """
+    申請を提出 (draft → submitted)
+    El Excel se genera de nuevo con los datos actuales y queda fijo desde aquí
+    """
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        draft = await _get_or_404(conn, application_id)
+        if draft["application_status"] != "draft":
+            raise HTTPException(409, f"状態 {draft['application_status']} から submitted には変更できません")
+        url = await _generate_excel(conn, draft)
+        try:
+            row = await _transition(
+                conn, application_id, "submitted",
+                "application_date = COALESCE($3, application_date, CURRENT_DATE), "
+                "application_number = COALESCE($4, application_number), submitted_by = $5, excel_file_url = $6",
+                (request.application_date, request.application_number, current_user.user_id, url),
+            )
+        except HTTPException:
+            _remove_file(url)
+            raise
+    if draft["excel_file_url"] != url:
+        _remove_file(draft["excel_file_url"])
+    return dict(row)
+
+@router.post("/{application_id}/review")
+async def start_review(application_id: int, current_user: TokenData = Depends(get_current_active_user)):
+    """審査開始 (submitted → under_review)"""
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        row = await _transition(conn, application_id, "under_review")
+    return dict(row)
+
+@router.post("/{application_id}/approve")
+async def approve_application(application_id: int, request: ApproveRequest,
+                              current_user: TokenData = Depends(require_role(DECISION_ROLES))):
+    """
+    許可 (under_review → approved)
+    Actualiza en la misma transacción el在留期限 del empleado (y el在留資格 en 変更)
+    """
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            row = await _transition(
+                conn, application_id, "approved",
+                "decision_date = COALESCE($3, CURRENT_DATE), approved_period = $4, new_expiration_date = $5",
+                (request.decision_date, request.approved_period, request.new_expiration_date),
+            )
+            employee = await conn.fetchrow("""
+                UPDATE employees
+                SET current_expiration_date = $2,
+                    current_period_of_stay = $3,
+                    current_visa_status = CASE WHEN $4 = '変更' THEN COALESCE($5, old.current_visa_status)
+                                               ELSE old.current_visa_status END
+                FROM employees old
+                WHERE employees.id = $1 AND old.id = employees.id
+                RETURNING employees.*, old AS _old
+            """, row["employee_id"], request.new_expiration_date, request.approved_period,
+                row["application_type"], row["visa_category"])
+    if employee:
+        new, old = audit.split_old(employee)
+        audit.record("employees", row["employee_id"], "UPDATE", old, new)
+    return dict(row)
+
+@router.post("/{application_id}/deny")
+async def deny_application(application_id: int, request: DenyRequest,
+                           current_user: TokenData = Depends(require_role(DECISION_ROLES))):
+    """不許可 (under_review → denied)"""
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        row = await _transition(
+            conn, application_id, "denied",
+            "decision_date = COALESCE($3, CURRENT_DATE), denial_reason = $4",
+            (request.decision_date, request.denial_reason),
+        )
+    return dict(row)
+
+# ============================================================
+# ENDPOINTS - EXCEL
+# ============================================================
+
+@router.get("/{application_id}/excel")
+async def get_application_excel(application_id: int, regenerate: bool = False,
+                                current_user: TokenData = Depends(get_current_active_user)):
+    """
+    申請書Excel - Se sirve el archivo guardado (excel_file_url); solo se genera si
+    no existe o si se pide regenerate en un borrador
+    """
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        application = await _get_or_404(conn, application_id)
+        url = application["excel_file_url"]
+        if regenerate and application["application_status"] != "draft":
+            raise HTTPException(409, "提出済みの申請書は再生成できません")
+
+        if regenerate or not url or not _file_path(url).is_file():
+            new_url = await _generate_excel(conn, application)
+            # Si otra petición lo generó a la vez, gana la primera y se borra este
+            stored = await conn.fetchval("""
+                UPDATE visa_applications SET excel_file_url = $2
+                WHERE id = $1 AND excel_file_url IS NOT DISTINCT FROM $3
+                RETURNING excel_file_url
+            """, application_id, new_url, url)
+            if stored:
+                _remove_file(url)
+                url = new_url
+            else:
+                _remove_file(new_url)
+                url = await conn.fetchval(
+                    "SELECT excel_file_url FROM visa_applications WHERE id = $1", application_id
+                )
+
+    filename = f"visa_application_{application_id}.xlsx"
+    return FileResponse(
+        _file_path(url),
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        filename=filename,
+    )
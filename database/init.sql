@@ -454,6 +454,8 @@ CREATE TABLE IF NOT EXISTS notifications (
     
     due_date DATE,
     days_before_due INT,
+    -- Umbral (días) que generó el aviso: uno por empleado, due_date y umbral
+    threshold_days INT,
     
     is_read BOOLEAN DEFAULT FALSE,
     is_actioned BOOLEAN DEFAULT FALSE,
@@ -498,10 +500,138 @@ CREATE TABLE IF NOT EXISTS users (
     is_active BOOLEAN DEFAULT TRUE,
     last_login TIMESTAMP,
     
+    -- Se incrementa en logout / cambio de contraseña / baja: revoca los JWT emitidos
+    token_version INT NOT NULL DEFAULT 0,
+    
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- ============================================================
+-- TABLA 13: OCRキャッシュ (OCR RESULT CACHE)
+-- ============================================================
+CREATE TABLE IF NOT EXISTS ocr_result_cache (
+    -- SHA-256(imagen normalizada + tipo de documento + versión del prompt)
+    cache_key CHAR(64) PRIMARY KEY,
+    document_type VARCHAR(30) NOT NULL,
+    result JSONB NOT NULL,
+    
+    hit_count INT DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_hit_at TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL
+);
+
+-- ============================================================
+-- TABLA 14: OCRスキャン履歴 (OCR SCAN AUDIT)
+-- ============================================================
+CREATE TABLE IF NOT EXISTS ocr_scans (
+    id SERIAL PRIMARY KEY,
+    
+    image_hash CHAR(64) NOT NULL,
+    document_type VARCHAR(30) NOT NULL,
+    source VARCHAR(20),             -- vision / mrz
+    model VARCHAR(100),
+    cached BOOLEAN DEFAULT FALSE,
+    success BOOLEAN NOT NULL,
+    latency_ms INT,
+    
+    -- Resultado
+    raw_response TEXT,
+    extracted_data JSONB,
+    field_confidence JSONB,
+    confidence VARCHAR(10),         -- high / medium / low
+    confidence_score NUMERIC(4,3),
+    error TEXT,
+    
+    -- Revisión
+    needs_review BOOLEAN DEFAULT FALSE,
+    reviewed_at TIMESTAMP,
+    reviewed_by INT REFERENCES users(id),
+    
+    employee_id INT REFERENCES employees(id) ON DELETE SET NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- ============================================================
+-- TABLA 15: 在留期限アラート (VISA EXPIRY ALERTS)
+-- Materialización de v_visa_expiry_alert_source: la mantienen los triggers
+-- de employees y refresh_visa_expiry_alerts() (cambio de día)
+-- ============================================================
+CREATE TABLE IF NOT EXISTS visa_expiry_alerts (
+    employee_id INT PRIMARY KEY REFERENCES employees(id) ON DELETE CASCADE,
+    
+    employee_code VARCHAR(20),
+    family_name VARCHAR(100),
+    given_name VARCHAR(100),
+    nationality VARCHAR(100),
+    current_visa_status VARCHAR(100),
+    residence_card_number VARCHAR(20),
+    
+    expiration_date DATE NOT NULL,
+    days_remaining INT NOT NULL,
+    urgency VARCHAR(10) NOT NULL,   -- expired / critical / warning / info
+    
+    -- Día en que se calcularon days_remaining/urgency
+    computed_on DATE NOT NULL DEFAULT CURRENT_DATE,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- ============================================================
+-- TABLA 16: スケジューラ実行履歴 (SCHEDULED JOB RUNS)
+-- ============================================================
+CREATE TABLE IF NOT EXISTS scheduled_job_runs (
+    id SERIAL PRIMARY KEY,
+    
+    job_name VARCHAR(100) NOT NULL,
+    scheduled_for TIMESTAMP NOT NULL,   -- turno cron (minuto) o hora de la ejecución manual
+    manual BOOLEAN DEFAULT FALSE,
+    worker VARCHAR(100),                -- host:pid que la ejecutó
+    
+    status VARCHAR(20) NOT NULL,        -- running / success / failed / timeout / cancelled
+    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP,
+    duration_ms INT,
+    result JSONB,
+    error TEXT
+);
+
+-- ============================================================
+-- TABLA 17: 派遣先別集計 (HAKEN SAKI STATS)
+-- Mantenida por triggers de dispatch_assignments y employees
+-- ============================================================
+CREATE TABLE IF NOT EXISTS haken_saki_stats (
+    haken_saki_id INT PRIMARY KEY REFERENCES haken_saki_company(id) ON DELETE CASCADE,
+    
+    -- Asignaciones activas de empleados activos
+    active_employees INT NOT NULL DEFAULT 0,
+    foreign_employees INT NOT NULL DEFAULT 0,
+    nearest_visa_expiration DATE,
+    nationality_counts JSONB NOT NULL DEFAULT '{}',   -- {"ベトナム": 12, "ブラジル": 3}
+    
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- ============================================================
+-- TABLA 18: テーブル版数 (TABLE VERSIONS)
+-- Versión de cada tabla = version + filas en table_changes: ETag de las lecturas (etag.py).
+-- Solo la actualiza compact_table_versions(); las escrituras nunca bloquean esta fila
+-- ============================================================
+CREATE TABLE IF NOT EXISTS table_versions (
+    table_name VARCHAR(100) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- ============================================================
+-- TABLA 19: テーブル変更ログ (TABLE CHANGES)
+-- Una fila por sentencia de escritura (solo INSERT: sin bloqueos entre escrituras).
+-- Transaccional: una escritura cuenta cuando se confirma, igual que sus datos
+-- ============================================================
+CREATE TABLE IF NOT EXISTS table_changes (
+    table_name VARCHAR(100) NOT NULL
+);
+
 -- ============================================================
 -- ÍNDICES
 -- ============================================================
@@ -515,21 +645,38 @@ CREATE INDEX idx_employees_name ON employees(family_name, given_name);
 CREATE INDEX idx_employees_code ON employees(employee_code);
 
 -- Contracts
-CREATE INDEX idx_contracts_employee ON employment_contracts(employee_id);
+-- Historial por empleado (más reciente primero)
+CREATE INDEX idx_contracts_employee ON employment_contracts(employee_id, contract_start_date DESC);
+-- Invariante: como mucho un contrato activo por empleado
+CREATE UNIQUE INDEX idx_contracts_one_active ON employment_contracts(employee_id) WHERE contract_status = 'active';
 CREATE INDEX idx_contracts_status ON employment_contracts(contract_status);
 CREATE INDEX idx_contracts_dates ON employment_contracts(contract_start_date, contract_end_date);
 
 -- Dispatch
-CREATE INDEX idx_dispatch_employee ON dispatch_assignments(employee_id);
+CREATE INDEX idx_dispatch_employee ON dispatch_assignments(employee_id, dispatch_start_date DESC);
+-- Invariante: como mucho una asignación activa por empleado; también es la búsqueda del派遣先 actual
+CREATE UNIQUE INDEX idx_dispatch_one_active ON dispatch_assignments(employee_id) WHERE assignment_status = 'active';
 CREATE INDEX idx_dispatch_haken_saki ON dispatch_assignments(haken_saki_id);
+-- Plantilla activa de un派遣先 (reasignación masiva, v_employees_by_haken_saki)
+CREATE INDEX idx_dispatch_haken_saki_active ON dispatch_assignments(haken_saki_id) WHERE assignment_status = 'active';
+CREATE INDEX idx_dispatch_contract ON dispatch_assignments(employment_contract_id);
 CREATE INDEX idx_dispatch_dates ON dispatch_assignments(dispatch_start_date, dispatch_end_date);
 CREATE INDEX idx_dispatch_status ON dispatch_assignments(assignment_status);
 
+-- Family / Work history (GET /api/employees/{id}/full)
+CREATE INDEX idx_family_employee ON employee_family(employee_id);
+CREATE INDEX idx_work_history_employee ON employee_work_history(employee_id, display_order);
+
 -- Visa Applications
 CREATE INDEX idx_visa_apps_employee ON visa_applications(employee_id);
 CREATE INDEX idx_visa_apps_status ON visa_applications(application_status);
 CREATE INDEX idx_visa_apps_type ON visa_applications(application_type);
 CREATE INDEX idx_visa_apps_date ON visa_applications(application_date);
+-- Colas de trabajo (visa_applications.py): borradores por autor y pendientes por入管
+CREATE INDEX idx_visa_apps_drafts_by_creator ON visa_applications(created_by, updated_at DESC)
+    WHERE application_status = 'draft';
+CREATE INDEX idx_visa_apps_pending_office ON visa_applications(submission_office, id)
+    WHERE application_status IN ('submitted', 'under_review');
 
 -- Companies
 CREATE INDEX idx_haken_saki_name ON haken_saki_company(company_name);
@@ -542,6 +689,35 @@ CREATE INDEX idx_users_username ON users(username);
 CREATE INDEX idx_users_email ON users(email);
 CREATE INDEX idx_users_active ON users(is_active);
 
+-- Audit log (historial de un registro: audit.py)
+CREATE INDEX idx_audit_log_record ON audit_log(table_name, record_id, created_at);
+
+-- OCR cache
+CREATE INDEX idx_ocr_cache_expires ON ocr_result_cache(expires_at);
+
+-- OCR scans
+CREATE INDEX idx_ocr_scans_review_queue ON ocr_scans(id DESC) WHERE needs_review = TRUE AND reviewed_at IS NULL;
+CREATE INDEX idx_ocr_scans_type_created ON ocr_scans(document_type, created_at);
+CREATE INDEX idx_ocr_scans_image_hash ON ocr_scans(image_hash);
+
+-- Notifications
+CREATE INDEX idx_notifications_employee_type_created ON notifications(employee_id, notification_type, created_at);
+-- Contador de no leídos: index-only scan sobre un índice pequeño
+CREATE INDEX idx_notifications_unread ON notifications(id) WHERE is_read = FALSE;
+CREATE UNIQUE INDEX idx_notifications_visa_threshold ON notifications(employee_id, due_date, threshold_days)
+    WHERE notification_type = 'visa_expiring' AND threshold_days IS NOT NULL;
+
+-- Scheduled job runs (un turno cron se ejecuta una sola vez entre todos los workers)
+CREATE UNIQUE INDEX idx_job_runs_slot ON scheduled_job_runs(job_name, scheduled_for) WHERE NOT manual;
+CREATE INDEX idx_job_runs_started ON scheduled_job_runs(started_at);
+
+-- Visa expiry alerts
+CREATE INDEX idx_visa_alerts_days ON visa_expiry_alerts(days_remaining);
+CREATE INDEX idx_visa_alerts_computed_on ON visa_expiry_alerts(computed_on);
+
+-- Table changes (etag.table_etag cuenta las filas de cada tabla desde la última compactación)
+CREATE INDEX idx_table_changes_table ON table_changes(table_name);
+
 -- Full-text search (Japanese)
 CREATE INDEX idx_haken_saki_name_trgm ON haken_saki_company USING gin(company_name gin_trgm_ops);
 CREATE INDEX idx_employees_name_trgm ON employees USING gin(family_name gin_trgm_ops);
@@ -550,6 +726,17 @@ CREATE INDEX idx_employees_name_trgm ON employees USING gin(family_name gin_trgm
 -- VISTAS
 -- ============================================================
 
+-- Función: Nivel de urgencia según días restantes (usada por la vista de alertas)
+CREATE OR REPLACE FUNCTION visa_alert_urgency(days_remaining INT)
+RETURNS VARCHAR AS $$
+    SELECT CASE
+        WHEN days_remaining < 0 THEN 'expired'
+        WHEN days_remaining <= 30 THEN 'critical'
+        WHEN days_remaining <= 60 THEN 'warning'
+        ELSE 'info'
+    END;
+$$ LANGUAGE sql IMMUTABLE;
+
 -- Vista: Empleados con visa por vencer
 CREATE OR REPLACE VIEW v_employees_visa_expiring AS
 SELECT 
@@ -583,6 +770,23 @@ LEFT JOIN haken_saki_company hs ON da.haken_saki_id = hs.id
 WHERE e.employment_status = 'active'
 ORDER BY e.current_expiration_date;
 
+-- Vista: Origen de visa_expiry_alerts (ventana: 30 días vencida .. 365 días por delante)
+CREATE OR REPLACE VIEW v_visa_expiry_alert_source AS
+SELECT 
+    e.id AS employee_id,
+    e.employee_code,
+    e.family_name,
+    e.given_name,
+    e.nationality,
+    e.current_visa_status,
+    e.residence_card_number,
+    e.current_expiration_date AS expiration_date,
+    (e.current_expiration_date - CURRENT_DATE) AS days_remaining,
+    visa_alert_urgency(e.current_expiration_date - CURRENT_DATE) AS urgency
+FROM employees e
+WHERE e.employment_status = 'active'
+AND e.current_expiration_date BETWEEN CURRENT_DATE - 30 AND CURRENT_DATE + 365;
+
 -- Vista: Empleados por派遣先
 CREATE OR REPLACE VIEW v_employees_by_haken_saki AS
 SELECT 
@@ -592,14 +796,12 @@ SELECT
     hs.full_address,
     hs.telephone,
     hs.contact_person,
-    COUNT(DISTINCT da.employee_id) AS active_employees,
-    STRING_AGG(DISTINCT e.nationality, ', ' ORDER BY e.nationality) AS nationalities,
-    MIN(e.current_expiration_date) AS nearest_visa_expiration
+    COALESCE(s.active_employees, 0)::BIGINT AS active_employees,
+    (SELECT STRING_AGG(k, ', ' ORDER BY k) FROM jsonb_object_keys(s.nationality_counts) AS k) AS nationalities,
+    s.nearest_visa_expiration
 FROM haken_saki_company hs
-LEFT JOIN dispatch_assignments da ON hs.id = da.haken_saki_id AND da.assignment_status = 'active'
-LEFT JOIN employees e ON da.employee_id = e.id AND e.employment_status = 'active'
+LEFT JOIN haken_saki_stats s ON s.haken_saki_id = hs.id
 WHERE hs.is_active = TRUE
-GROUP BY hs.id, hs.company_name, hs.branch_name, hs.full_address, hs.telephone, hs.contact_person
 ORDER BY hs.company_name;
 
 -- Vista: Datos completos para formulario de visa
@@ -758,45 +960,409 @@ CREATE TRIGGER trg_contracts_updated_at BEFORE UPDATE ON employment_contracts FO
 CREATE TRIGGER trg_dispatch_updated_at BEFORE UPDATE ON dispatch_assignments FOR EACH ROW EXECUTE FUNCTION update_updated_at();
 CREATE TRIGGER trg_visa_apps_updated_at BEFORE UPDATE ON visa_applications FOR EACH ROW EXECUTE FUNCTION update_updated_at();
 
--- Función: Crear notificación de visa por vencer
-CREATE OR REPLACE FUNCTION create_visa_expiration_notifications()
+-- Función: Avisar a los clientes (SSE) de cambios en notifications vía LISTEN/NOTIFY
+-- Un NOTIFY por sentencia (no por fila): el generador inserta miles de filas de golpe
+CREATE OR REPLACE FUNCTION notify_notifications_changed()
+RETURNS TRIGGER AS $$
+DECLARE
+    changed INT;
+    last_id INT;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        SELECT COUNT(*) INTO changed FROM old_rows;
+    ELSE
+        SELECT COUNT(*), MAX(id) INTO changed, last_id FROM new_rows;
+    END IF;
+    
+    IF changed > 0 THEN
+        PERFORM pg_notify('notifications', json_build_object(
+            'op', lower(TG_OP),
+            'count', changed,
+            'last_id', last_id,
+            'unread', (SELECT COUNT(*) FROM notifications WHERE is_read = FALSE)
+        )::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_notifications_notify_insert ON notifications;
+CREATE TRIGGER trg_notifications_notify_insert
+    AFTER INSERT ON notifications
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_notifications_changed();
+
+DROP TRIGGER IF EXISTS trg_notifications_notify_update ON notifications;
+CREATE TRIGGER trg_notifications_notify_update
+    AFTER UPDATE ON notifications
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_notifications_changed();
+
+DROP TRIGGER IF EXISTS trg_notifications_notify_delete ON notifications;
+CREATE TRIGGER trg_notifications_notify_delete
+    AFTER DELETE ON notifications
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_notifications_changed();
+
+-- Función: Recalcular la alerta de un empleado (la llama el trigger de employees)
+CREATE OR REPLACE FUNCTION sync_visa_expiry_alert(p_employee_id INT)
 RETURNS void AS $$
+BEGIN
+    INSERT INTO visa_expiry_alerts (
+        employee_id, employee_code, family_name, given_name, nationality,
+        current_visa_status, residence_card_number,
+        expiration_date, days_remaining, urgency, computed_on, updated_at
+    )
+    SELECT employee_id, employee_code, family_name, given_name, nationality,
+           current_visa_status, residence_card_number,
+           expiration_date, days_remaining, urgency, CURRENT_DATE, CURRENT_TIMESTAMP
+    FROM v_visa_expiry_alert_source
+    WHERE employee_id = p_employee_id
+    ON CONFLICT (employee_id) DO UPDATE SET
+        employee_code = EXCLUDED.employee_code,
+        family_name = EXCLUDED.family_name,
+        given_name = EXCLUDED.given_name,
+        nationality = EXCLUDED.nationality,
+        current_visa_status = EXCLUDED.current_visa_status,
+        residence_card_number = EXCLUDED.residence_card_number,
+        expiration_date = EXCLUDED.expiration_date,
+        days_remaining = EXCLUDED.days_remaining,
+        urgency = EXCLUDED.urgency,
+        computed_on = EXCLUDED.computed_on,
+        updated_at = EXCLUDED.updated_at;
+    
+    -- Fuera de la ventana (renovada, baja, sin fecha): se quita
+    IF NOT FOUND THEN
+        DELETE FROM visa_expiry_alerts WHERE employee_id = p_employee_id;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_sync_visa_expiry_alert()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM sync_visa_expiry_alert(NEW.id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_employees_visa_alert ON employees;
+CREATE TRIGGER trg_employees_visa_alert
+    AFTER INSERT OR UPDATE OF current_expiration_date, employment_status, employee_code,
+        family_name, given_name, nationality, current_visa_status, residence_card_number
+    ON employees
+    FOR EACH ROW
+    EXECUTE FUNCTION trg_sync_visa_expiry_alert();
+
+-- Función: Recalcular todas las alertas (cambio de día: days_remaining y urgencia)
+-- Devuelve el número de filas insertadas o modificadas
+CREATE OR REPLACE FUNCTION refresh_visa_expiry_alerts()
+RETURNS INT AS $$
+DECLARE
+    changed INT;
+BEGIN
+    -- Dos refrescos a la vez se esperan en lugar de bloquearse mutuamente
+    PERFORM pg_advisory_xact_lock(hashtext('refresh_visa_expiry_alerts'));
+    
+    DELETE FROM visa_expiry_alerts a
+    WHERE NOT EXISTS (
+        SELECT 1 FROM v_visa_expiry_alert_source s WHERE s.employee_id = a.employee_id
+    );
+    
+    INSERT INTO visa_expiry_alerts (
+        employee_id, employee_code, family_name, given_name, nationality,
+        current_visa_status, residence_card_number,
+        expiration_date, days_remaining, urgency, computed_on, updated_at
+    )
+    SELECT employee_id, employee_code, family_name, given_name, nationality,
+           current_visa_status, residence_card_number,
+           expiration_date, days_remaining, urgency, CURRENT_DATE, CURRENT_TIMESTAMP
+    FROM v_visa_expiry_alert_source
+    ON CONFLICT (employee_id) DO UPDATE SET
+        expiration_date = EXCLUDED.expiration_date,
+        days_remaining = EXCLUDED.days_remaining,
+        urgency = EXCLUDED.urgency,
+        computed_on = EXCLUDED.computed_on,
+        updated_at = EXCLUDED.updated_at
+    WHERE visa_expiry_alerts.computed_on IS DISTINCT FROM EXCLUDED.computed_on
+       OR visa_expiry_alerts.expiration_date IS DISTINCT FROM EXCLUDED.expiration_date;
+    
+    GET DIAGNOSTICS changed = ROW_COUNT;
+    RETURN changed;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Carga inicial (bases ya existentes con empleados)
+SELECT refresh_visa_expiry_alerts();
+
+-- Función: ¿Extranjero? (nacionalidad informada y distinta de Japón)
+CREATE OR REPLACE FUNCTION is_foreign_nationality(nationality TEXT)
+RETURNS BOOLEAN AS $$
+    SELECT COALESCE(BTRIM(nationality), '') NOT IN ('', '日本', '日本国', 'ﾆﾎﾝ', 'ニホン', 'JAPAN', 'Japan', 'JPN');
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Función: Recalcular haken_saki_stats de los派遣先 indicados (NULL = todos)
+-- Solo se agrega la plantilla activa de cada uno (idx_dispatch_haken_saki_active)
+CREATE OR REPLACE FUNCTION refresh_haken_saki_stats(p_ids INT[] DEFAULT NULL)
+RETURNS INT AS $$
+DECLARE
+    changed INT;
+BEGIN
+    INSERT INTO haken_saki_stats (haken_saki_id)
+    SELECT id FROM haken_saki_company WHERE p_ids IS NULL OR id = ANY(p_ids)
+    ON CONFLICT (haken_saki_id) DO NOTHING;
+    
+    -- Bloqueo en orden: dos transacciones sobre el mismo派遣先 se serializan y la
+    -- segunda agrega con una instantánea nueva que ya ve lo que confirmó la primera
+    PERFORM 1 FROM haken_saki_stats
+    WHERE p_ids IS NULL OR haken_saki_id = ANY(p_ids)
+    ORDER BY haken_saki_id
+    FOR UPDATE;
+    
+    WITH by_nationality AS (
+        SELECT da.haken_saki_id,
+               COALESCE(NULLIF(BTRIM(e.nationality), ''), '不明') AS nationality,
+               is_foreign_nationality(e.nationality) AS is_foreign,
+               COUNT(*) AS n,
+               MIN(e.current_expiration_date) AS nearest
+        FROM dispatch_assignments da
+        JOIN employees e ON e.id = da.employee_id AND e.employment_status = 'active'
+        WHERE da.assignment_status = 'active'
+        AND (p_ids IS NULL OR da.haken_saki_id = ANY(p_ids))
+        GROUP BY 1, 2, 3
+    ),
+    totals AS (
+        SELECT haken_saki_id,
+               SUM(n)::INT AS active_employees,
+               COALESCE(SUM(n) FILTER (WHERE is_foreign), 0)::INT AS foreign_employees,
+               MIN(nearest) AS nearest_visa_expiration,
+               jsonb_object_agg(nationality, n) AS nationality_counts
+        FROM (
+            SELECT haken_saki_id, nationality, BOOL_OR(is_foreign) AS is_foreign,
+                   SUM(n) AS n, MIN(nearest) AS nearest
+            FROM by_nationality GROUP BY 1, 2
+        ) t
+        GROUP BY haken_saki_id
+    )
+    UPDATE haken_saki_stats s
+    SET active_employees = COALESCE(t.active_employees, 0),
+        foreign_employees = COALESCE(t.foreign_employees, 0),
+        nearest_visa_expiration = t.nearest_visa_expiration,
+        nationality_counts = COALESCE(t.nationality_counts, '{}'),
+        updated_at = CURRENT_TIMESTAMP
+    FROM haken_saki_stats target
+    LEFT JOIN totals t ON t.haken_saki_id = target.haken_saki_id
+    WHERE s.haken_saki_id = target.haken_saki_id
+    AND (p_ids IS NULL OR target.haken_saki_id = ANY(p_ids));
+    
+    GET DIAGNOSTICS changed = ROW_COUNT;
+    RETURN changed;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Trigger: cambios de asignaciones (alta, fin, traslado, reasignación masiva)
+-- Por sentencia: una reasignación masiva recalcula cada派遣先 una sola vez
+CREATE OR REPLACE FUNCTION trg_dispatch_haken_saki_stats()
+RETURNS TRIGGER AS $$
+DECLARE
+    ids INT[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(DISTINCT haken_saki_id) INTO ids
+        FROM new_rows WHERE assignment_status = 'active';
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT array_agg(DISTINCT haken_saki_id) INTO ids
+        FROM old_rows WHERE assignment_status = 'active';
+    ELSE
+        SELECT array_agg(DISTINCT x.haken_saki_id) INTO ids
+        FROM old_rows o
+        JOIN new_rows n ON n.id = o.id
+        CROSS JOIN LATERAL (VALUES (o.haken_saki_id, o.assignment_status),
+                                   (n.haken_saki_id, n.assignment_status)) AS x(haken_saki_id, status)
+        WHERE (o.assignment_status, o.haken_saki_id, o.employee_id)
+              IS DISTINCT FROM (n.assignment_status, n.haken_saki_id, n.employee_id)
+        AND x.status = 'active';
+    END IF;
+    
+    IF ids IS NOT NULL THEN
+        PERFORM refresh_haken_saki_stats(array_remove(ids, NULL));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_dispatch_stats_insert ON dispatch_assignments;
+CREATE TRIGGER trg_dispatch_stats_insert
+    AFTER INSERT ON dispatch_assignments
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_dispatch_haken_saki_stats();
+
+DROP TRIGGER IF EXISTS trg_dispatch_stats_update ON dispatch_assignments;
+CREATE TRIGGER trg_dispatch_stats_update
+    AFTER UPDATE ON dispatch_assignments
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_dispatch_haken_saki_stats();
+
+DROP TRIGGER IF EXISTS trg_dispatch_stats_delete ON dispatch_assignments;
+CREATE TRIGGER trg_dispatch_stats_delete
+    AFTER DELETE ON dispatch_assignments
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_dispatch_haken_saki_stats();
+
+-- Trigger: cambios de empleados que afectan a los contadores (estado, nacionalidad, caducidad).
+-- Las bajas de employees llegan por el ON DELETE CASCADE de dispatch_assignments.
+-- (Un trigger con tablas de transición no admite UPDATE OF columnas: se filtra aquí)
+CREATE OR REPLACE FUNCTION trg_employees_haken_saki_stats()
+RETURNS TRIGGER AS $$
 DECLARE
-    emp RECORD;
+    ids INT[];
 BEGIN
-    -- Eliminar notificaciones antiguas no leídas
-    DELETE FROM notifications 
-    WHERE notification_type = 'visa_expiring' 
-    AND is_read = FALSE 
-    AND created_at < CURRENT_DATE - INTERVAL '7 days';
-    
-    -- Crear notificaciones para visas que vencen en 90, 60, 30 días
-    FOR emp IN 
-        SELECT id, employee_code, family_name, given_name, current_expiration_date,
-               (current_expiration_date - CURRENT_DATE) AS days_remaining
-        FROM employees
-        WHERE employment_status = 'active'
-        AND current_expiration_date BETWEEN CURRENT_DATE AND CURRENT_DATE + INTERVAL '90 days'
-    LOOP
-        -- Verificar si ya existe notificación reciente
-        IF NOT EXISTS (
-            SELECT 1 FROM notifications 
-            WHERE employee_id = emp.id 
-            AND notification_type = 'visa_expiring'
-            AND created_at > CURRENT_DATE - INTERVAL '7 days'
-        ) THEN
-            INSERT INTO notifications (
-                employee_id, notification_type, title, message, due_date, days_before_due
-            ) VALUES (
-                emp.id,
-                'visa_expiring',
-                '在留期限通知: ' || emp.family_name || ' ' || emp.given_name,
-                '在留期限まで' || emp.days_remaining || '日です。更新手続きを開始してください。',
-                emp.current_expiration_date,
-                emp.days_remaining
-            );
-        END IF;
-    END LOOP;
+    SELECT array_agg(DISTINCT da.haken_saki_id) INTO ids
+    FROM old_rows o
+    JOIN new_rows n ON n.id = o.id
+    JOIN dispatch_assignments da ON da.employee_id = n.id AND da.assignment_status = 'active'
+    WHERE (o.employment_status, o.nationality, o.current_expiration_date)
+          IS DISTINCT FROM (n.employment_status, n.nationality, n.current_expiration_date);
+    
+    IF ids IS NOT NULL THEN
+        PERFORM refresh_haken_saki_stats(array_remove(ids, NULL));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_employees_haken_saki_stats ON employees;
+CREATE TRIGGER trg_employees_haken_saki_stats
+    AFTER UPDATE ON employees
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_employees_haken_saki_stats();
+
+-- Carga inicial
+SELECT refresh_haken_saki_stats();
+
+-- Función: Incrementar la versión de la tabla modificada (trigger por sentencia)
+-- Un INSERT en table_changes por sentencia, no por fila: sin UPDATE de una fila
+-- compartida, las escrituras concurrentes no se esperan ni se bloquean entre sí.
+-- Una sentencia que no toca filas también cuenta: como mucho un 200 de más, nunca un 304 con datos viejos
+CREATE OR REPLACE FUNCTION bump_table_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO table_changes (table_name) VALUES (TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Función: Pasar table_changes a table_versions (tarea table_versions_compact del scheduler)
+-- En una sola sentencia: la suma version + cambios no varía para ningún lector.
+-- Los cambios aún sin confirmar no se ven y quedan para la siguiente pasada
+CREATE OR REPLACE FUNCTION compact_table_versions()
+RETURNS INT AS $$
+DECLARE
+    v_moved INT;
+BEGIN
+    WITH moved AS (
+        DELETE FROM table_changes RETURNING table_name
+    ), counts AS (
+        SELECT table_name, count(*) AS n FROM moved GROUP BY table_name
+    ), bumped AS (
+        INSERT INTO table_versions (table_name, version, updated_at)
+        SELECT table_name, n, CURRENT_TIMESTAMP FROM counts
+        ON CONFLICT (table_name) DO UPDATE
+        SET version = table_versions.version + EXCLUDED.version, updated_at = EXCLUDED.updated_at
+    )
+    -- Los CTE que escriben se ejecutan aunque no se referencien
+    SELECT COALESCE(sum(n), 0) INTO v_moved FROM counts;
+    RETURN v_moved;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Tablas que leen los endpoints con ETag (employees, haken-saki, stats, alerts)
+DROP TRIGGER IF EXISTS trg_employees_version ON employees;
+CREATE TRIGGER trg_employees_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON employees
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+DROP TRIGGER IF EXISTS trg_haken_saki_version ON haken_saki_company;
+CREATE TRIGGER trg_haken_saki_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON haken_saki_company
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+DROP TRIGGER IF EXISTS trg_haken_saki_stats_version ON haken_saki_stats;
+CREATE TRIGGER trg_haken_saki_stats_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON haken_saki_stats
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+DROP TRIGGER IF EXISTS trg_visa_expiry_alerts_version ON visa_expiry_alerts;
+CREATE TRIGGER trg_visa_expiry_alerts_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON visa_expiry_alerts
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+-- Función: Crear notificaciones de visa por vencer (set-based)
+-- Una notificación por empleado, fecha de caducidad y umbral alcanzado:
+-- con 90/60/30/14/7, quien tiene 25 días recibe la de 30 (y no las de 90/60 atrasadas).
+-- Devuelve {"created": n, "removed": n, "by_threshold": {"30": n, ...}}
+DROP FUNCTION IF EXISTS create_visa_expiration_notifications();
+CREATE OR REPLACE FUNCTION create_visa_expiration_notifications(
+    thresholds INT[] DEFAULT ARRAY[90, 60, 30, 14, 7]
+)
+RETURNS JSONB AS $$
+DECLARE
+    max_threshold INT;
+    removed INT;
+    summary JSONB;
+BEGIN
+    SELECT MAX(t) INTO max_threshold FROM unnest(thresholds) AS t;
+    
+    -- Las alertas deben reflejar el día de hoy antes de leerlas
+    PERFORM refresh_visa_expiry_alerts();
+    
+    -- Quitar avisos no leídos que ya no aplican (visa renovada, baja)
+    DELETE FROM notifications n
+    WHERE n.notification_type = 'visa_expiring'
+    AND n.is_read = FALSE
+    AND NOT EXISTS (
+        SELECT 1 FROM visa_expiry_alerts a
+        WHERE a.employee_id = n.employee_id AND a.expiration_date = n.due_date
+    );
+    GET DIAGNOSTICS removed = ROW_COUNT;
+    
+    WITH due AS (
+        SELECT a.employee_id, a.family_name, a.given_name, a.expiration_date, a.days_remaining,
+               (SELECT MIN(t) FROM unnest(thresholds) AS t WHERE t >= a.days_remaining) AS threshold
+        FROM visa_expiry_alerts a
+        WHERE a.days_remaining BETWEEN 0 AND max_threshold
+    ),
+    inserted AS (
+        INSERT INTO notifications (
+            employee_id, notification_type, title, message, due_date, days_before_due, threshold_days
+        )
+        SELECT
+            d.employee_id,
+            'visa_expiring',
+            '在留期限通知: ' || d.family_name || ' ' || d.given_name,
+            '在留期限まで' || d.days_remaining || '日です。更新手続きを開始してください。',
+            d.expiration_date,
+            d.days_remaining,
+            d.threshold
+        FROM due d
+        WHERE NOT EXISTS (
+            SELECT 1 FROM notifications n
+            WHERE n.employee_id = d.employee_id
+            AND n.notification_type = 'visa_expiring'
+            AND n.due_date = d.expiration_date
+            AND n.threshold_days = d.threshold
+        )
+        ON CONFLICT DO NOTHING
+        RETURNING notifications.threshold_days
+    )
+    SELECT jsonb_build_object(
+        'created', COALESCE(SUM(c.created), 0),
+        'removed', removed,
+        'by_threshold', COALESCE(jsonb_object_agg(c.threshold_days::text, c.created), '{}'::jsonb)
+    )
+    INTO summary
+    FROM (
+        SELECT i.threshold_days, COUNT(*) AS created FROM inserted i GROUP BY i.threshold_days
+    ) c;
+    
+    RETURN summary;
 END;
 $$ LANGUAGE plpgsql;
 
@@ -840,6 +1406,11 @@ VALUES (
     true
 ) ON CONFLICT (username) DO NOTHING;
 
+-- Versiones de tabla (ETag)
+INSERT INTO table_versions (table_name) VALUES
+    ('employees'), ('haken_saki_company'), ('haken_saki_stats'), ('visa_expiry_alerts')
+ON CONFLICT (table_name) DO NOTHING;
+
 -- ============================================================
 -- COMENTARIOS
 -- ============================================================
@@ -849,16 +1420,26 @@ COMMENT ON TABLE haken_moto_company IS '派遣元会社（自社UNS）情報';
 COMMENT ON TABLE haken_saki_company IS '派遣先会社（クライアント・工場）情報';
 COMMENT ON TABLE employment_contracts IS '雇用契約情報 - 派遣元との契約';
 COMMENT ON TABLE dispatch_assignments IS '派遣契約情報 - 派遣先への配属';
+COMMENT ON COLUMN dispatch_assignments.assignment_status IS 'active (una por empleado) / ended / transferred';
+COMMENT ON COLUMN employment_contracts.contract_status IS 'active (uno por empleado) / ended';
 COMMENT ON TABLE visa_applications IS 'ビザ申請履歴 - 認定・変更・更新の全記録';
 COMMENT ON TABLE employee_family IS '従業員の在日親族情報';
 COMMENT ON TABLE employee_work_history IS '従業員の職歴';
 COMMENT ON TABLE notifications IS '通知・リマインダー（ビザ期限等）';
 COMMENT ON TABLE audit_log IS '監査ログ - データ変更履歴';
+COMMENT ON TABLE ocr_scans IS 'OCRスキャン履歴 - 生レスポンス・信頼度・レイテンシ';
+COMMENT ON TABLE ocr_result_cache IS 'OCR結果キャッシュ - 同じ画像の再スキャンでAPIを呼ばない';
+COMMENT ON TABLE scheduled_job_runs IS 'スケジューラ実行履歴 - ジョブ毎の状態・所要時間';
+COMMENT ON TABLE visa_expiry_alerts IS '在留期限アラート - トリガーと日次リフレッシュで更新';
+COMMENT ON TABLE haken_saki_stats IS '派遣先別集計 - 派遣契約・従業員のトリガーで更新';
+COMMENT ON TABLE table_versions IS 'テーブル版数 - version + table_changes の件数（ETag / If-None-Match 用）';
+COMMENT ON TABLE table_changes IS 'テーブル変更ログ - 書き込み文ごとに1行、定期的に table_versions へ集約';
 
 COMMENT ON VIEW v_employees_visa_expiring IS '在留期限が近い従業員一覧';
 COMMENT ON VIEW v_employees_by_haken_saki IS '派遣先別の従業員数';
 COMMENT ON VIEW v_visa_form_data IS 'ビザ申請書に必要な全データ';
 COMMENT ON VIEW v_dashboard_stats IS 'ダッシュボード用統計';
+COMMENT ON VIEW v_visa_expiry_alert_source IS 'visa_expiry_alerts の元データ（期限の前後ウィンドウ）';
 
 -- ============================================================
 -- 完了メッセージ
@@ -866,8 +1447,8 @@ COMMENT ON VIEW v_dashboard_stats IS 'ダッシュボード用統計';
 DO $$
 BEGIN
     RAISE NOTICE '✅ UNS Visa System Database initialized successfully!';
-    RAISE NOTICE '📊 Tables created: 12';
-    RAISE NOTICE '👁️ Views created: 4';
-    RAISE NOTICE '🔧 Functions created: 3';
+    RAISE NOTICE '📊 Tables created: 19';
+    RAISE NOTICE '👁️ Views created: 5';
+    RAISE NOTICE '🔧 Functions created: 14';
     RAISE NOTICE '🏢 Default company (UNS) inserted';
 END $$;